@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the upload downscale path.
+
+Compares the previous decode (full-resolution JPEG decode, EXIF transpose,
+LANCZOS resize) with ``image_variants.load_scaled`` (draft mode + reduce)
+on synthetic phone photos of 12, 24 and 48 MP, rotated via EXIF like a
+portrait shot. Reports wall time and the size of the decoded pixel buffer.
+
+Timings depend heavily on the CPU; run it on each architecture the add-on
+ships for (amd64, aarch64, armv7, ...) – the machine is printed in the header.
+
+Usage:
+    python scripts/bench_downscale.py
+    python scripts/bench_downscale.py --megapixels 12 48 --repeat 5
+"""
+import argparse
+import io
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wine-tracker", "app"))
+
+import PIL  # noqa: E402
+from PIL import Image, ImageOps  # noqa: E402
+
+from image_variants import load_scaled  # noqa: E402
+
+MAX_IMAGE_PX = 1800  # same as app.MAX_IMAGE_PX
+
+# 4:3 sensor sizes
+SIZES = {12: (4000, 3000), 24: (5664, 4248), 48: (8000, 6000)}
+
+
+def phone_photo(size):
+    """A noisy gradient JPEG with EXIF orientation 6 (rotated 90°)."""
+    noise = Image.effect_noise(size, 48)
+    gradient = Image.linear_gradient("L").resize(size)
+    img = Image.merge("RGB", (noise, gradient, Image.eval(noise, lambda v: 255 - v)))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90, exif=exif)
+    return buf.getvalue()
+
+
+def previous(data):
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        decoded = img.size
+        w, h = img.size
+        ratio = MAX_IMAGE_PX / max(w, h)
+        img = img.resize((int(w * ratio), int(h * ratio)), Image.LANCZOS)
+        img.save(io.BytesIO(), format="JPEG", quality=85, optimize=True)
+    return decoded
+
+
+def draft_reduce(data):
+    with Image.open(io.BytesIO(data)) as img:
+        scaled = load_scaled(img, MAX_IMAGE_PX)
+        decoded = img.size  # after draft()
+        scaled.save(io.BytesIO(), format="JPEG", quality=85, optimize=True)
+    return decoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--megapixels", type=int, nargs="+", choices=sorted(SIZES), default=sorted(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{platform.machine()}, Python {platform.python_version()}, Pillow {PIL.__version__}")
+    print(f"{'photo':>6}  {'previous':>16}  {'draft + reduce':>16}  {'speed-up':>8}")
+    for mp in args.megapixels:
+        data = phone_photo(SIZES[mp])
+        results = []
+        for fn in (previous, draft_reduce):
+            t = min(timeit.repeat(lambda: fn(data), number=1, repeat=args.repeat))
+            w, h = fn(data)
+            results.append((t, w * h * 3 / 1e6))
+        (old_t, old_mb), (new_t, new_mb) = results
+        print(f"{mp:>4} MP  {old_t * 1000:>6.0f} ms {old_mb:>4.0f} MB  "
+              f"{new_t * 1000:>6.0f} ms {new_mb:>4.0f} MB  {old_t / new_t:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
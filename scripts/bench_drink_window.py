@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the drink-window chart aggregation.
+
+Compares the sweep-line histogram in ``cellar_stats`` with the previous
+per-year loop on synthetic cellars.
+
+Usage:
+    python scripts/bench_drink_window.py
+    python scripts/bench_drink_window.py --wines 500 5000 --outliers 0.01
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wine-tracker", "app"))
+
+from cellar_stats import drink_window_histogram  # noqa: E402
+
+TYPES = ["Rotwein", "Weisswein", "Rosé", "Schaumwein", "Dessertwein", None]
+
+
+def synthetic_cellar(n, outliers, seed=1):
+    """``n`` wines with 1-20 year windows; a share ``outliers`` ends in 2999."""
+    rnd = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        frm = rnd.randint(2015, 2035)
+        until = 2999 if rnd.random() < outliers else frm + rnd.randint(0, 20)
+        rows.append({
+            "type": rnd.choice(TYPES), "quantity": rnd.randint(1, 12),
+            "drink_from": frm if rnd.random() < 0.9 else None, "drink_until": until,
+        })
+    return rows
+
+
+def per_year_loop(rows):
+    """The previous implementation (counts plus per-year name lists)."""
+    by_year = defaultdict(lambda: defaultdict(int))
+    names = defaultdict(lambda: defaultdict(list))
+    for w in rows:
+        try:
+            until = int(w["drink_until"])
+            frm = int(w["drink_from"]) if w["drink_from"] else until
+        except (ValueError, TypeError):
+            continue
+        t = w["type"] or "Anderes"
+        entry = {"q": w["quantity"]}
+        for yr in range(frm, until + 1):
+            by_year[yr][t] += w["quantity"]
+            names[yr][t].append(entry)
+    return by_year, names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--wines", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--outliers", type=float, default=0.0,
+                        help="share of wines with drink_until=2999 (default 0)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'wines':>7}  {'outliers':>8}  {'per-year loop':>14}  {'sweep line':>11}  {'speed-up':>8}")
+    for n in args.wines:
+        for outliers in sorted({0.0, args.outliers}):
+            rows = synthetic_cellar(n, outliers)
+            old = min(timeit.repeat(lambda: per_year_loop(rows), number=1, repeat=args.repeat))
+            new = min(timeit.repeat(lambda: drink_window_histogram(rows), number=1, repeat=args.repeat))
+            print(f"{n:>7}  {outliers:>8.2%}  {old * 1000:>11.2f} ms  {new * 1000:>8.2f} ms  {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
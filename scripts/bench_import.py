@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the bulk import path (``export_import.apply_import``).
+
+Imports a synthetic backup – 50k wines with 200k timeline events by
+default – into a fresh, fully migrated database file (triggers, FTS and
+statistics included) and reports the time per stage.
+
+Usage:
+    python scripts/bench_import.py
+    python scripts/bench_import.py --wines 5000 --events 20000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wine-tracker", "app"))
+
+from export_import import _normalize_wine, apply_import, match_wines  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+TYPES = ["Rotwein", "Weisswein", "Rosé", "Schaumwein", "Dessertwein"]
+ACTIONS = ["added", "consumed", "restocked"]
+
+
+def synthetic_backup(n_wines, n_events, seed=1):
+    rnd = random.Random(seed)
+    raw = [{
+        "id": i + 1,
+        "name": f"Wine {i}",
+        "year": rnd.randint(1990, 2024),
+        "type": rnd.choice(TYPES),
+        "region": f"Region {rnd.randint(1, 300)}",
+        "quantity": rnd.randint(0, 24),
+        "price": round(rnd.uniform(5, 200), 2),
+        "notes": "Synthetic benchmark wine",
+    } for i in range(n_wines)]
+    timeline = [{
+        "wine_id": rnd.randint(1, n_wines),
+        "action": rnd.choice(ACTIONS),
+        "quantity": rnd.randint(1, 6),
+        "timestamp": f"20{rnd.randint(10, 25)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T12:00:00",
+    } for _ in range(n_events)]
+    return {
+        "source": "zip",
+        "schema_version": 1,
+        "wines": [_normalize_wine(w) for w in raw],
+        "original_ids": [w["id"] for w in raw],
+        "timeline": timeline,
+        "images": {},
+        "archive": None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--wines", type=int, default=50_000)
+    parser.add_argument("--events", type=int, default=200_000)
+    args = parser.parse_args()
+
+    parsed = synthetic_backup(args.wines, args.events)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = sqlite3.connect(os.path.join(tmp, "wine.db"))
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA cache_size=-16000")
+        migrate(db)
+
+        stages = {}
+        start = time.perf_counter()
+
+        def progress(stage, done, total):
+            stages[stage] = (time.perf_counter() - start, done, total)
+
+        t0 = time.perf_counter()
+        matches = match_wines(parsed["wines"], db)
+        t_match = time.perf_counter() - t0
+
+        start = time.perf_counter()
+        result = apply_import(parsed, matches, db, os.path.join(tmp, "uploads"), progress=progress)
+        total = time.perf_counter() - start
+
+        events = db.execute("SELECT COUNT(*) FROM timeline").fetchone()[0]
+        db.close()
+
+    print(f"{args.wines} wines, {args.events} timeline events")
+    print(f"  match:    {t_match * 1000:8.0f} ms")
+    prev = 0.0
+    for stage in ("images", "wines", "timeline"):
+        if stage in stages:
+            at, done, _ = stages[stage]
+            print(f"  {stage + ':':9} {(at - prev) * 1000:8.0f} ms  ({done} rows)")
+            prev = at
+    print(f"  total:    {total * 1000:8.0f} ms  ({(args.wines + events) / total:,.0f} rows/s)")
+    print(f"  result:   {result}, {events} timeline rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation of the chat's retrieval mode against the full cellar list.
+
+For every question the wines an answer needs are known up front. The script
+checks how many of them end up in the prompt with retrieval
+(``cellar_retrieval.relevant_ids``), compared with the full listing the chat
+sends below ``chat_retrieval_threshold``. It also prints the prompt size of
+both modes. No AI provider is called: this measures whether the model
+*could* answer from its context, not what it answers.
+
+By default a synthetic cellar (seeded, so runs are comparable) is generated
+in memory, with questions derived from it. To check a real cellar, pass a
+copy of its database and a JSON file of questions:
+
+    [{"question": "Which Barolo is ready?", "expect": [12, 48],
+      "history": ["optional earlier messages"]}]
+
+Usage:
+    python scripts/eval_chat_retrieval.py
+    python scripts/eval_chat_retrieval.py --wines 3000 --top-k 30
+    python scripts/eval_chat_retrieval.py --db wine.db --questions questions.json
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "wine-tracker", "app"))
+
+import cellar_context  # noqa: E402
+import cellar_retrieval  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+# Same as app.WINE_LABELS["en"] and app._FTS_WEIGHTS
+LABELS = {
+    "vintage": "Vintage", "type": "Type", "region": "Region", "grape": "Grape",
+    "drink_window": "Drinking window", "notes": "Notes", "quantity": "Quantity",
+    "bottles": "btl.", "rating": "Rating", "location": "Location",
+}
+FTS_WEIGHTS = "10.0, 5.0, 5.0, 2.0, 1.0, 2.0, 3.0"
+
+# region -> (type, grapes)
+REGIONS = {
+    "Bordeaux, FR": ("Rotwein", ["Merlot", "Cabernet Sauvignon", "Cabernet Franc"]),
+    "Burgundy, FR": ("Rotwein", ["Pinot Noir"]),
+    "Chablis, FR": ("Weisswein", ["Chardonnay"]),
+    "Champagne, FR": ("Schaumwein", ["Chardonnay", "Pinot Noir", "Pinot Meunier"]),
+    "Rhône, FR": ("Rotwein", ["Syrah", "Grenache"]),
+    "Sauternes, FR": ("Dessertwein", ["Sémillon"]),
+    "Provence, FR": ("Rosé", ["Grenache", "Cinsault"]),
+    "Piemonte, IT": ("Rotwein", ["Nebbiolo", "Barbera"]),
+    "Tuscany, IT": ("Rotwein", ["Sangiovese"]),
+    "Veneto, IT": ("Schaumwein", ["Glera"]),
+    "Rioja, ES": ("Rotwein", ["Tempranillo"]),
+    "Jerez, ES": ("Likörwein", ["Palomino"]),
+    "Douro, PT": ("Likörwein", ["Touriga Nacional"]),
+    "Mosel, DE": ("Weisswein", ["Riesling"]),
+    "Wachau, AT": ("Weisswein", ["Grüner Veltliner"]),
+    "Valais, CH": ("Weisswein", ["Chasselas", "Petite Arvine"]),
+    "Barossa Valley, AU": ("Rotwein", ["Shiraz"]),
+    "Napa Valley, US": ("Rotwein", ["Cabernet Sauvignon", "Zinfandel"]),
+    "Marlborough, NZ": ("Weisswein", ["Sauvignon Blanc"]),
+    "Mendoza, AR": ("Rotwein", ["Malbec"]),
+}
+PRODUCERS = [f"{a} {b}" for a in ("Domaine", "Château", "Weingut", "Bodega", "Tenuta", "Quinta")
+             for b in ("Aubert", "Belmont", "Castell", "Dorner", "Esteve", "Fontana", "Gerber",
+                       "Hollenstein", "Iturri", "Jaboulet", "Kessler", "Lafleur", "Moreau")]
+NOTES = ["cherry and tobacco", "great with lamb", "citrus, mineral", "pairs with oysters",
+         "for the cheese board", "smoky, needs decanting", "birthday gift", "with roast duck",
+         "light, for summer evenings", "honey and apricot", "with chocolate dessert", ""]
+
+
+def synthetic_cellar(db, n, seed):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        region = rng.choice(list(REGIONS))
+        wine_type, grapes = REGIONS[region]
+        year = rng.randint(1995, 2022)
+        drink_from = year + rng.randint(2, 8)
+        rows.append((
+            f"{rng.choice(PRODUCERS)} {rng.choice(['Réserve', 'Classic', 'Vieilles Vignes', 'Estate', 'No. ' + str(i % 9 + 1)])}",
+            year, wine_type, region, rng.choice(grapes),
+            rng.choice([0, 1, 1, 2, 3, 6, 12]), rng.randint(0, 5),
+            rng.choice(NOTES), f"Rack {rng.choice('ABCDEF')}{rng.randint(1, 8)}",
+            drink_from, drink_from + rng.randint(3, 20),
+        ))
+    db.executemany(
+        "INSERT INTO wines (name, year, type, region, grape, quantity, rating, notes, location, "
+        "drink_from, drink_until) VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows,
+    )
+    db.commit()
+
+
+def synthetic_questions(db, seed):
+    """Questions with the in-stock wines an answer needs."""
+    rng = random.Random(seed)
+    wines = [dict(r) for r in db.execute("SELECT * FROM wines WHERE quantity > 0")]
+
+    def ids(pred):
+        return [w["id"] for w in wines if pred(w)]
+
+    pick = rng.sample(wines, 4)
+    questions = [
+        ("Which Piemonte wines do I have?", ids(lambda w: w["region"] == "Piemonte, IT")),
+        ("Something with Riesling for tonight?", ids(lambda w: w["grape"] == "Riesling")),
+        ("I want to open a Malbec, which one is ready?", ids(lambda w: w["grape"] == "Malbec")),
+        (f"Do I still have the {pick[0]['name']} {pick[0]['year']}?",
+         ids(lambda w: w["name"] == pick[0]["name"] and w["year"] == pick[0]["year"])),
+        (f"What do I have from {pick[1]['name'].rsplit(' ', 1)[0]}?",
+         ids(lambda w: w["name"].startswith(pick[1]["name"].rsplit(" ", 1)[0]))),
+        (f"What is stored in {pick[2]['location']}?", ids(lambda w: w["location"] == pick[2]["location"])),
+        ("Which 2010 wines are in the cellar?", ids(lambda w: w["year"] == 2010)),
+        ("Which wine goes with lamb?", ids(lambda w: "lamb" in (w["notes"] or ""))),
+        ("Recommend a sparkling wine for a party", ids(lambda w: w["type"] == "Schaumwein")),
+        ("Eine Flasche Sherry oder Port zum Dessert?", ids(lambda w: w["type"] == "Likörwein")),
+    ]
+    cases = [{"question": q, "expect": e, "history": []} for q, e in questions]
+    cases.append({
+        "question": "How long can I keep the first one?",
+        "expect": [pick[3]["id"]],
+        "history": ["Any ideas for Sunday?",
+                    f"Try the [{pick[3]['name']} {pick[3]['year']}](wine:{pick[3]['id']}) or a Rioja."],
+    })
+    return cases
+
+
+def evaluate(db, cases, top_k):
+    full_text, total = cellar_context.CellarContext().get(db, "eval", 0, "en", LABELS)
+    print(f"{total} wines in stock, full listing {len(full_text):,} chars (~{len(full_text) // 4:,} tokens)\n")
+    print(f"{'question':<52} {'needed':>6} {'full':>5} {'retrieval':>9} {'chars':>7} {'ms':>5}")
+    coverage = []
+    for case in cases:
+        expect = set(case["expect"])
+        start = time.perf_counter()
+        picked = cellar_retrieval.relevant_ids(db, case["question"], case["history"], k=top_k, weights=FTS_WEIGHTS)
+        summary = cellar_retrieval.summary(db)
+        rows = {r[0]: dict(zip(cellar_context.COLUMNS, r)) for r in db.execute(
+            f"SELECT {', '.join(cellar_context.COLUMNS)} FROM wines WHERE id IN ({','.join('?' * len(picked))})",
+            picked,
+        )} if picked else {}
+        text = summary + "\n" + "\n".join(cellar_context.format_wine(rows[i], LABELS) for i in picked if i in rows)
+        ms = (time.perf_counter() - start) * 1000
+        needed = min(len(expect), top_k)
+        score = len(expect & set(picked)) / needed if needed else 1.0
+        coverage.append(score)
+        print(f"{case['question'][:52]:<52} {needed:>6} {1.0:>5.0%} {score:>9.0%} {len(text):>7,} {ms:>5.1f}")
+    print(f"\nmean coverage: full 100%, retrieval {sum(coverage) / len(coverage):.0%} (top-k {top_k})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", help="copy of a wine.db to evaluate (default: synthetic cellar)")
+    parser.add_argument("--questions", help="JSON file with questions (required with --db)")
+    parser.add_argument("--wines", type=int, default=1500, help="size of the synthetic cellar")
+    parser.add_argument("--top-k", type=int, default=cellar_retrieval.DEFAULT_TOP_K)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.db:
+        if not args.questions:
+            parser.error("--questions is required with --db")
+        db = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+        db.row_factory = sqlite3.Row
+        with open(args.questions, encoding="utf-8") as f:
+            cases = [{"history": [], **c} for c in json.load(f)]
+    else:
+        db = sqlite3.connect(":memory:")
+        db.row_factory = sqlite3.Row
+        migrate(db)
+        synthetic_cellar(db, args.wines, args.seed)
+        cases = synthetic_questions(db, args.seed)
+    evaluate(db, cases, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Long-lived API clients for the AI providers.
+
+Every ``anthropic.Anthropic`` / ``openai.OpenAI`` instance owns its own
+connection pool, so building one per call meant a new TCP + TLS handshake
+for every label scan and chat turn. ``ClientRegistry`` builds a client on
+first use and hands the same one out afterwards; its pool keeps the
+connection to the provider alive between calls.
+
+Each provider has one cached client, remembered together with the settings
+it was built from (SDK, API key, base URL). When the add-on options change,
+the next call builds a fresh client. The SDKs' own retries are switched
+off; ``ai_resilience`` decides when to retry. Like ``jobs.WorkerPool`` the cache is
+per process: connection pools must not be shared across a Gunicorn fork.
+
+``RateLimiter`` spaces out requests to a provider for bulk work (the
+enrichment job), so concurrent calls stay below the provider's
+requests-per-minute limit.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+
+def build_client(sdk: str, api_key: str | None, base_url: str | None):
+    """A new client for ``sdk``; the SDKs are imported on first use."""
+    if sdk == "anthropic":
+        import anthropic
+        return anthropic.Anthropic(api_key=api_key, base_url=base_url, max_retries=0)
+    if sdk == "openai":
+        from openai import OpenAI
+        return OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    if sdk == "http":
+        import requests
+        return requests.Session()
+    raise ValueError(f"Unknown SDK: {sdk}")
+
+
+class ClientRegistry:
+    """Per-process cache of one client per provider."""
+
+    def __init__(self, builder=build_client):
+        self._builder = builder
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pid = None
+
+    def get(self, provider: str, sdk: str, api_key: str | None = None, base_url: str | None = None):
+        """The cached client for ``provider``, rebuilt if its settings changed.
+
+        A replaced client is not closed explicitly – another thread may still
+        be using it; its pool is closed when it is garbage-collected.
+        """
+        settings = (sdk, api_key, base_url)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._clients = {}
+                self._pid = os.getpid()
+            cached = self._clients.get(provider)
+            if cached is not None and cached[0] == settings:
+                return cached[1]
+            client = self._builder(sdk, api_key, base_url)
+            self._clients[provider] = (settings, client)
+            return client
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients = {}
+
+
+class RateLimiter:
+    """Per-process request spacing, one schedule per provider.
+
+    ``acquire(provider, per_minute)`` blocks until the caller may start its
+    request: starts are at least ``60 / per_minute`` seconds apart, across
+    all threads of the process. ``per_minute <= 0`` means no limit.
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = {}  # provider -> earliest start of the next request
+
+    def acquire(self, provider: str, per_minute: float) -> float:
+        """Wait for a slot; returns the seconds waited."""
+        if per_minute <= 0:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._next.get(provider, now))
+            self._next[provider] = start + 60.0 / per_minute
+        wait = start - now
+        if wait > 0:
+            self._sleep(wait)
+        return wait
@@ -0,0 +1,211 @@
+"""
+Deadlines, retries and circuit breaking for AI provider calls.
+
+Provider calls used the SDK defaults (ten minutes for Anthropic / OpenAI,
+with their own silent retries) and only Ollama had a timeout, so a
+degraded provider could hold a web worker for minutes. ``call()`` runs
+one provider operation under
+
+* a deadline for the whole operation, retries included. The provider
+  functions pass ``remaining()`` as their request timeout;
+* jittered exponential backoff on transient failures (429, 5xx,
+  connection errors), honouring ``Retry-After``. Other errors such as a
+  bad request or an invalid key are raised at once;
+* a per-provider ``CircuitBreaker``. After ``FAILURE_THRESHOLD``
+  consecutive transient failures, calls fail fast with ``CircuitOpen``
+  for ``RESET_SECONDS``. Then a single trial call decides whether the
+  circuit closes again.
+
+``stream()`` does the same for streaming replies, up to the first chunk –
+a reply that has started cannot be retried.
+
+Failures that exhausted the policy are raised as ``ProviderError`` with a
+``kind`` (``timeout``, ``rate_limited``, ``unavailable``, ``circuit_open``)
+instead of being recognised by their message text. Errors are classified
+by duck typing, so neither SDK has to be imported here.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import random
+import threading
+import time
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+FAILURE_THRESHOLD = 5
+RESET_SECONDS = 30.0
+
+# Request timeout outside of call() (matches the old Ollama timeout)
+DEFAULT_TIMEOUT = 120.0
+
+_TIMEOUT_ERRORS = {"APITimeoutError", "Timeout", "TimeoutException", "TimeoutError",
+                   "ReadTimeout", "ConnectTimeout", "ReadTimeoutError"}
+_CONNECTION_ERRORS = {"APIConnectionError", "ConnectionError", "ConnectError",
+                      "RemoteProtocolError", "ChunkedEncodingError"}
+
+_deadline = contextvars.ContextVar("ai_deadline", default=None)
+_END = object()
+
+
+class ProviderError(Exception):
+    """A provider call that failed after the retry policy gave up."""
+
+    def __init__(self, kind: str, provider: str, message: str = ""):
+        super().__init__(message or f"{provider}: {kind}")
+        self.kind = kind
+        self.provider = provider
+
+
+class CircuitOpen(ProviderError):
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__("circuit_open", provider,
+                         f"{provider} is unavailable, retrying in {retry_in:.0f} s")
+
+
+def _status(exc) -> int | None:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify(exc) -> str | None:
+    """``timeout``, ``rate_limited`` or ``unavailable`` for transient errors, else None."""
+    if isinstance(exc, ProviderError):
+        return exc.kind
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    status = _status(exc)
+    if names & _TIMEOUT_ERRORS or status == 408:
+        return "timeout"
+    if status == 429:
+        return "rate_limited"
+    if status is not None:
+        return "unavailable" if status >= 500 else None
+    if names & _CONNECTION_ERRORS:
+        return "unavailable"
+    return None
+
+
+def retry_after(exc) -> float | None:
+    """Seconds from a ``Retry-After`` header (delta-seconds form only)."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return max(0.0, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+def remaining(clock=time.monotonic) -> float:
+    """Seconds left for the current provider operation – use as request timeout."""
+    end = _deadline.get()
+    if end is None:
+        return DEFAULT_TIMEOUT
+    return max(0.1, end - clock())
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker, one circuit per provider."""
+
+    def __init__(self, threshold: int = FAILURE_THRESHOLD, reset_seconds: float = RESET_SECONDS,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = {}   # provider -> consecutive transient failures
+        self._opened = {}     # provider -> when the circuit (re)opened
+
+    def state(self, provider: str) -> str:
+        with self._lock:
+            if self._failures.get(provider, 0) < self.threshold:
+                return "closed"
+            if self._clock() - self._opened[provider] < self.reset_seconds:
+                return "open"
+            return "half_open"
+
+    def check(self, provider: str) -> None:
+        """Raise ``CircuitOpen`` unless a call to ``provider`` may go out.
+
+        Once the reset period is over one caller gets through as the trial;
+        the circuit counts as freshly opened for everybody else until it
+        reports back.
+        """
+        with self._lock:
+            if self._failures.get(provider, 0) < self.threshold:
+                return
+            waited = self._clock() - self._opened[provider]
+            if waited < self.reset_seconds:
+                raise CircuitOpen(provider, self.reset_seconds - waited)
+            self._opened[provider] = self._clock()
+
+    def success(self, provider: str) -> None:
+        with self._lock:
+            self._failures.pop(provider, None)
+            self._opened.pop(provider, None)
+
+    def failure(self, provider: str) -> None:
+        with self._lock:
+            count = self._failures.get(provider, 0) + 1
+            self._failures[provider] = count
+            if count >= self.threshold:
+                self._opened[provider] = self._clock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._failures.clear()
+            self._opened.clear()
+
+
+def call(provider: str, fn, *, timeout: float, breaker: CircuitBreaker, attempts: int | None = None,
+         sleep=time.sleep, rand=random.random, clock=time.monotonic):
+    """``fn()`` for ``provider`` with a ``timeout`` second deadline, retries and breaker."""
+    attempts = attempts or RETRY_ATTEMPTS
+    end = clock() + timeout
+    for attempt in range(attempts):
+        breaker.check(provider)
+        if clock() >= end:
+            raise ProviderError("timeout", provider, f"{provider}: deadline of {timeout:.0f} s exceeded")
+        token = _deadline.set(end)
+        try:
+            result = fn()
+        except Exception as e:
+            kind = classify(e)
+            if kind is None:
+                breaker.success(provider)  # it answered, if only with an error
+                raise
+            breaker.failure(provider)
+            delay = retry_after(e)
+            if delay is None:
+                delay = rand() * min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+            if kind == "timeout" or attempt + 1 >= attempts or clock() + delay >= end:
+                raise ProviderError(kind, provider, str(e) or kind) from e
+            sleep(delay)
+            continue
+        finally:
+            _deadline.reset(token)
+        breaker.success(provider)
+        return result
+
+
+def stream(provider: str, start, *, timeout: float, breaker: CircuitBreaker, **kwargs):
+    """Yield from the generator ``start()``; retried like ``call()`` until its first item."""
+    def first():
+        gen = start()
+        return gen, next(gen, _END)  # the request goes out on the first next()
+
+    gen, item = call(provider, first, timeout=timeout, breaker=breaker, **kwargs)
+    if item is _END:
+        return
+    yield item
+    try:
+        yield from gen
+    except Exception as e:
+        kind = classify(e)
+        if kind is None:
+            raise
+        breaker.failure(provider)
+        raise ProviderError(kind, provider, str(e) or kind) from e
@@ -0,0 +1,74 @@
+"""
+Persistent cache of AI label analyses.
+
+Scanning the same label twice, or re-analysing a duplicated wine, used to
+send the whole image to the provider again – seconds of waiting and a paid
+request for an answer we already had. ``analysis_cache`` stores the parsed
+fields of every successful analysis in the database (so all workers and
+restarts share it), keyed by
+
+* the SHA-256 of the image bytes sent (uploads are downscaled
+  deterministically, so the same photo always yields the same bytes),
+* the SHA-256 of the prompt – it embeds the JSON schema, the rules, the
+  answer language and any known wine details, so changing any of them
+  misses the cache,
+* the provider and model, and ``VERSION`` for changes to how answers are
+  parsed.
+
+Entries expire after a TTL; beyond ``MAX_ENTRIES`` the least recently used
+ones are dropped on the next write.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+
+# Bump when the stored fields would no longer match what the parser returns
+VERSION = 1
+
+MAX_ENTRIES = 500
+
+
+def cache_key(image_b64: str | None, prompt: str, provider: str, model: str) -> str:
+    image = hashlib.sha256((image_b64 or "").encode()).hexdigest()
+    prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
+    return f"v{VERSION}:{provider}:{model}:{image}:{prompt_hash}"
+
+
+def get(db, key: str, ttl_seconds: float) -> dict | None:
+    """The cached fields for ``key``, or None if missing or expired. Commits."""
+    row = db.execute("SELECT fields, created FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    now = time.time()
+    if now - row[1] > ttl_seconds:
+        db.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+        db.commit()
+        return None
+    db.execute("UPDATE analysis_cache SET last_used = ? WHERE key = ?", (now, key))
+    db.commit()
+    return json.loads(row[0])
+
+
+def put(db, key: str, fields: dict, ttl_seconds: float, max_entries: int = MAX_ENTRIES) -> None:
+    """Store ``fields`` and evict expired and least recently used entries. Commits."""
+    now = time.time()
+    db.execute(
+        "INSERT OR REPLACE INTO analysis_cache (key, fields, created, last_used) VALUES (?, ?, ?, ?)",
+        (key, json.dumps(fields, ensure_ascii=False), now, now),
+    )
+    db.execute("DELETE FROM analysis_cache WHERE created < ?", (now - ttl_seconds,))
+    db.execute(
+        "DELETE FROM analysis_cache WHERE key IN ("
+        "SELECT key FROM analysis_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+        (max_entries,),
+    )
+    db.commit()
+
+
+def clear(db) -> int:
+    count = db.execute("DELETE FROM analysis_cache").rowcount
+    db.commit()
+    return count
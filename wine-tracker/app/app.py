@@ -1,18 +1,33 @@
+import hashlib
 import json
 import os
+import re
 import secrets
 import shutil
 import sqlite3
-import uuid
+import threading
+import time
 from collections import defaultdict
-from datetime import date, datetime
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, jsonify, g, session, Response
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import click
+from datetime import date, datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, jsonify, g, session, Response, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from translations import TRANSLATIONS
 from export_import import (
-    build_export_zip, export_filename,
+    iter_export_zip, export_filename,
     parse_import_file, match_wines, apply_import, ImportError as WineImportError,
 )
+from migrations import migrate, check_query_plans, create_search_index, rebuild_search_index
+import ai_clients
+import ai_resilience
+import analysis_cache
+import cellar_context
+import cellar_retrieval
+import cellar_stats
+import image_store
+import image_variants
+import jobs
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", secrets.token_hex(32))
@@ -51,8 +66,36 @@ _USERS = parse_user_string(_users_raw) if AUTH_ENABLED else {}
 # ── HA Add-on Options ─────────────────────────────────────────────────────────
 OPTIONS_PATH = os.environ.get("OPTIONS_PATH", "/data/options.json")
 
+# (path, mtime_ns, size) -> parsed options.json; re-read only when the file changes
+_options_file_cache = (None, {})
+
+
+def _read_options_file():
+    """Return the parsed options.json, cached until the file changes on disk."""
+    global _options_file_cache
+    try:
+        st = os.stat(OPTIONS_PATH)
+    except OSError:
+        return {}
+    stamp = (OPTIONS_PATH, st.st_mtime_ns, st.st_size)
+    cached_stamp, cached = _options_file_cache
+    if cached_stamp == stamp:
+        return cached
+    try:
+        with open(OPTIONS_PATH, "r") as f:
+            opts = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        opts = {}
+    _options_file_cache = (stamp, opts)
+    return opts
+
+
 def load_options():
-    """Read HA add-on options with sensible defaults."""
+    """Read HA add-on options with sensible defaults.
+
+    options.json is only re-parsed when its mtime or size changes; ENV
+    overrides are applied on every call.
+    """
     defaults = {
         "currency": "CHF",
         "language": "de",
@@ -69,13 +112,16 @@ def load_options():
         "minimax_model": "MiniMax-Text-01",
         "mistral_api_key": "",
         "mistral_model": "pixtral-large-latest",
+        "server_workers": 2,
+        "server_threads": 4,
+        "db_cache_mb": 16,
+        "db_mmap_mb": 64,
+        "chat_retrieval_threshold": 200,
+        "analysis_cache_days": 30,
+        "ai_requests_per_minute": 30,
+        "ai_fallback_provider": "none",
     }
-    try:
-        with open(OPTIONS_PATH, "r") as f:
-            opts = json.load(f)
-        defaults.update(opts)
-    except (FileNotFoundError, json.JSONDecodeError):
-        pass
+    defaults.update(_read_options_file())
 
     # ENV variables override options.json (for standalone Docker deployment)
     env_map = {
@@ -94,6 +140,14 @@ def load_options():
         "MINIMAX_MODEL": "minimax_model",
         "MISTRAL_API_KEY": "mistral_api_key",
         "MISTRAL_MODEL": "mistral_model",
+        "SERVER_WORKERS": "server_workers",
+        "SERVER_THREADS": "server_threads",
+        "DB_CACHE_MB": "db_cache_mb",
+        "DB_MMAP_MB": "db_mmap_mb",
+        "CHAT_RETRIEVAL_THRESHOLD": "chat_retrieval_threshold",
+        "ANALYSIS_CACHE_DAYS": "analysis_cache_days",
+        "AI_REQUESTS_PER_MINUTE": "ai_requests_per_minute",
+        "AI_FALLBACK_PROVIDER": "ai_fallback_provider",
     }
     for env_key, opt_key in env_map.items():
         val = os.environ.get(env_key)
@@ -123,6 +177,27 @@ def _is_ai_configured(opts):
     return False
 
 
+def server_settings(opts=None):
+    """Return worker/thread counts for the production WSGI server.
+
+    Values come from ``load_options()`` (options.json or ENV) and are clamped
+    to a sane range so a typo cannot fork hundreds of processes on a Pi.
+    """
+    opts = opts if opts is not None else load_options()
+
+    def _clamp(key, default, lo, hi):
+        try:
+            val = int(opts.get(key, default))
+        except (TypeError, ValueError):
+            return default
+        return max(lo, min(hi, val))
+
+    return {
+        "workers": _clamp("server_workers", 2, 1, 8),
+        "threads": _clamp("server_threads", 4, 1, 32),
+    }
+
+
 def _ssl_verify():
     """Return best available CA bundle for requests verify parameter."""
     try:
@@ -344,7 +419,7 @@ def check_auth():
     """Enforce login when AUTH_ENABLED=true (standalone Docker deployment)."""
     if not AUTH_ENABLED:
         return
-    if request.endpoint in ("login", "static", "uploaded_file"):
+    if request.endpoint in ("login", "static", "uploaded_file", "uploaded_variant"):
         return
     if not session.get("user"):
         if request.path.startswith("/api/"):
@@ -362,7 +437,8 @@ def check_readonly():
     if request.method in ("POST", "PUT", "DELETE"):
         # Allow login POST, chat API, chat sessions for readonly users
         # (session delete is blocked in the endpoint itself)
-        allowed = {"login", "api_chat", "api_chat_sessions_list", "api_chat_session_detail"}
+        allowed = {"login", "api_chat", "api_chat_stream", "api_chat_sessions_list",
+                   "api_chat_session_detail", "api_job_export"}
         if request.endpoint not in allowed:
             if request.is_json or request.headers.get("X-Requested-With"):
                 return jsonify(ok=False, error="readonly"), 403
@@ -409,30 +485,12 @@ def inject_globals():
         "auth_readonly": session.get("role") == "readonly" if AUTH_ENABLED else False,
         "app_version": APP_VERSION,
         "wine_types": WINE_TYPES,
+        "static_url": static_url,
     }
     # Provide form datalist values for the shared edit modal on every page
     try:
-        db = get_db()
-        ctx["used_regions_list"] = [
-            row[0] for row in db.execute(
-                "SELECT DISTINCT region FROM wines WHERE region IS NOT NULL AND region != '' ORDER BY region"
-            ).fetchall()
-        ]
-        ctx["used_grapes"] = [
-            row[0] for row in db.execute(
-                "SELECT DISTINCT grape FROM wines WHERE grape IS NOT NULL AND grape != '' ORDER BY grape"
-            ).fetchall()
-        ]
-        ctx["used_purchased_at"] = [
-            row[0] for row in db.execute(
-                "SELECT DISTINCT purchased_at FROM wines WHERE purchased_at IS NOT NULL AND purchased_at != '' ORDER BY purchased_at"
-            ).fetchall()
-        ]
-        ctx["used_locations"] = [
-            row[0] for row in db.execute(
-                "SELECT DISTINCT location FROM wines WHERE location IS NOT NULL AND location != '' ORDER BY location"
-            ).fetchall()
-        ]
+        if request.endpoint != "login":
+            ctx.update(_datalists(get_db()))
     except Exception:
         ctx.setdefault("used_regions_list", [])
         ctx.setdefault("used_grapes", [])
@@ -441,6 +499,112 @@ def inject_globals():
     return ctx
 
 
+# ── HTTP caching ──────────────────────────────────────────────────────────────
+
+# Uploads never change under their name, and static URLs carry a content hash
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+# filename -> (mtime, short content hash)
+_static_hashes = {}
+
+# New on every start, so ETags handed out for a replaced database never match
+_ETAG_SALT = secrets.token_hex(4)
+
+
+def static_url(filename):
+    """URL of a file in static/ with a ``?v=`` content hash."""
+    url = f"{g.get('ingress', '')}/static/{filename}"
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return url
+    cached = _static_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            cached = _static_hashes[filename] = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+    return f"{url}?v={cached[1]}"
+
+
+@app.after_request
+def set_cache_headers(resp):
+    """Far-future caching for hashed static files and uploads."""
+    if resp.status_code != 200:
+        return resp
+    if request.endpoint == "static" and request.args.get("v"):
+        resp.headers["Cache-Control"] = IMMUTABLE_CACHE
+    elif request.endpoint in ("uploaded_file", "uploaded_variant"):
+        # Until the background downscale has swapped in the final file, and
+        # never for an original served in place of a failed variant
+        pending = image_pending(request.view_args["filename"]) or g.get("variant_fallback")
+        resp.headers["Cache-Control"] = "no-cache" if pending else IMMUTABLE_CACHE
+    return resp
+
+
+def revision_etag(*parts):
+    """ETag derived from revision counters (and whatever else the body depends on)."""
+    raw = "|".join(str(p) for p in (_ETAG_SALT, APP_VERSION, *parts))
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+def conditional_json(etag, build):
+    """304 if the client already has ``etag``, else the response of ``build()``.
+
+    ``build`` is only called when the body is actually needed. Clients must
+    revalidate every time (``no-cache``), so changes show up immediately.
+    """
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = build()
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+# (DB_PATH, cellar revision) -> datalist values for the wine form
+_datalist_cache = (None, {})
+
+
+def _app_state(db, key):
+    row = db.execute("SELECT value FROM app_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else 0
+
+
+def cellar_revision(db):
+    """Counter bumped by a trigger on every INSERT/UPDATE/DELETE on `wines`."""
+    return _app_state(db, "cellar_rev")
+
+
+def timeline_revision(db):
+    """Counter bumped by a trigger on every write to `timeline`."""
+    return _app_state(db, "timeline_rev")
+
+
+def chat_revision(db):
+    """Counter bumped by a trigger on every write to `chat_sessions`."""
+    return _app_state(db, "chat_rev")
+
+
+def _datalists(db):
+    """Distinct region/grape/shop/location values, cached per cellar revision."""
+    global _datalist_cache
+    key = (DB_PATH, cellar_revision(db))
+    cached_key, cached = _datalist_cache
+    if cached_key == key:
+        return cached
+    data = {}
+    for ctx_key, col in (("used_regions_list", "region"), ("used_grapes", "grape"),
+                         ("used_purchased_at", "purchased_at"), ("used_locations", "location")):
+        data[ctx_key] = [
+            row[0] for row in db.execute(
+                f"SELECT DISTINCT {col} FROM wines WHERE {col} IS NOT NULL AND {col} != '' ORDER BY {col}"
+            ).fetchall()
+        ]
+    _datalist_cache = (key, data)
+    return data
+
+
 def ingress_redirect(endpoint, **kwargs):
     """Redirect using the ingress-aware path."""
     path = g.get("ingress", "") + url_for(endpoint, **kwargs)
@@ -449,72 +613,77 @@ def ingress_redirect(endpoint, **kwargs):
 
 # ── Database ──────────────────────────────────────────────────────────────────
 
+# Every thread keeps one persistent connection (gthread workers reuse their
+# threads), so page caches stay warm and the PRAGMAs are applied only once.
+# Connections are never shared between threads and are dropped when DB_PATH
+# changes or the process forks.
+
+DB_BUSY_TIMEOUT_MS = 5000
+
+# The import job waits this long for edits in flight before it takes the
+# write lock, instead of failing after DB_BUSY_TIMEOUT_MS
+IMPORT_BUSY_TIMEOUT_MS = 60000
+
+_db_local = threading.local()
+
+
+def _option_int(key, default):
+    try:
+        return max(0, int(HA_OPTIONS.get(key, default)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _connect(path=None):
+    """Open a SQLite connection with WAL and the tuned PRAGMAs applied."""
+    conn = sqlite3.connect(path or DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    # Negative cache_size means KiB instead of pages
+    conn.execute(f"PRAGMA cache_size = -{_option_int('db_cache_mb', 16) * 1024}")
+    conn.execute(f"PRAGMA mmap_size = {_option_int('db_mmap_mb', 64) * 1024 * 1024}")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def _pooled_connection():
+    """Return this thread's persistent connection, opening it on first use."""
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None and _db_local.key != (os.getpid(), DB_PATH):
+        # Never close a connection inherited through fork() – the parent owns it.
+        if _db_local.key[0] == os.getpid():
+            conn.close()
+        conn = None
+    if conn is None:
+        conn = _connect()
+        _db_local.conn = conn
+        _db_local.key = (os.getpid(), DB_PATH)
+    return conn
+
+
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DB_PATH)
-        g.db.row_factory = sqlite3.Row
+        g.db = _pooled_connection()
     return g.db
 
 
 @app.teardown_appcontext
 def close_db(e=None):
+    """Hand the connection back to the pool without leaving a transaction open."""
     db = g.pop("db", None)
-    if db:
-        db.close()
+    if db is not None and db.in_transaction:
+        db.rollback()
 
 
 def init_db():
-    with sqlite3.connect(DB_PATH) as db:
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS wines (
-                id           INTEGER PRIMARY KEY AUTOINCREMENT,
-                name         TEXT    NOT NULL,
-                year         INTEGER,
-                type         TEXT,
-                region       TEXT,
-                quantity     INTEGER DEFAULT 1,
-                rating       INTEGER DEFAULT 0,
-                notes        TEXT,
-                image        TEXT,
-                added        TEXT,
-                purchased_at TEXT,
-                price        REAL,
-                drink_from   INTEGER,
-                drink_until  INTEGER,
-                location     TEXT,
-                grape        TEXT
-            )
-        """)
-        # Migrate existing DBs – add columns if missing
-        existing = {row[1] for row in db.execute("PRAGMA table_info(wines)")}
-        migrations = {
-            "purchased_at":   "TEXT",
-            "price":          "REAL",
-            "drink_from":     "INTEGER",
-            "drink_until":    "INTEGER",
-            "location":       "TEXT",
-            "grape":          "TEXT",
-            "vivino_id":      "INTEGER",
-            "bottle_format":  "REAL DEFAULT 0.75",
-            "maturity_data":  "TEXT",
-            "taste_profile":  "TEXT",
-            "food_pairings":  "TEXT",
-        }
-        for col, dtype in migrations.items():
-            if col not in existing:
-                db.execute(f"ALTER TABLE wines ADD COLUMN {col} {dtype}")
-
-        # ── timeline table ────────────────────────────────────────────────
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS timeline (
-                id        INTEGER PRIMARY KEY AUTOINCREMENT,
-                wine_id   INTEGER NOT NULL,
-                action    TEXT NOT NULL,
-                quantity  INTEGER DEFAULT 1,
-                timestamp TEXT NOT NULL,
-                FOREIGN KEY (wine_id) REFERENCES wines(id)
-            )
-        """)
+    """Migrate the schema to the current version and run startup checks."""
+    db = _connect()
+    try:
+        applied = migrate(db)
+        if applied:
+            app.logger.info("Database migrated to schema version %d", applied[-1])
 
         # Backfill: insert 'added' entries for existing wines (only on first migration)
         log_count = db.execute("SELECT COUNT(*) FROM timeline").fetchone()[0]
@@ -527,33 +696,55 @@ def init_db():
                     "INSERT INTO timeline (wine_id, action, quantity, timestamp) VALUES (?,?,?,?)",
                     (w[0], "added", qty, ts),
                 )
+        db.commit()
 
-        # ── chat session tables ───────────────────────────────────────────
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS chat_sessions (
-                id        INTEGER PRIMARY KEY AUTOINCREMENT,
-                title     TEXT,
-                created   TEXT NOT NULL,
-                updated   TEXT NOT NULL
-            )
-        """)
-        db.execute("""
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id         INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id INTEGER NOT NULL,
-                role       TEXT NOT NULL,
-                content    TEXT NOT NULL,
-                timestamp  TEXT NOT NULL,
-                FOREIGN KEY (session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE
-            )
-        """)
+        drift = cellar_stats.check(db)
+        if drift:
+            app.logger.warning("Cellar statistics out of sync, rebuilding: %s", "; ".join(drift))
+            cellar_stats.rebuild(db)
+            db.commit()
 
-        # ── chat_messages migration: image_path ─────────────────────────
-        chat_cols = {row[1] for row in db.execute("PRAGMA table_info(chat_messages)")}
-        if "image_path" not in chat_cols:
-            db.execute("ALTER TABLE chat_messages ADD COLUMN image_path TEXT")
+        for res in check_query_plans(db):
+            if not res["ok"]:
+                app.logger.warning(
+                    "Query plan for %r does not use %s: %s",
+                    res["label"], res["index"], res["plan"],
+                )
+    finally:
+        db.close()
+
+    finished = _finish_pending_images()
+    if finished:
+        app.logger.info("Downscaled %d image(s) left pending by a previous run", finished)
+
+    db = _connect()
+    try:
+        image_store.migrate_uploads(db, UPLOAD_DIR)
+        collected = image_store.collect_garbage(db, UPLOAD_DIR)
+    finally:
+        db.close()
+    if collected:
+        app.logger.info("Removed %d unreferenced upload(s)", len(collected))
+
+    pruned = image_variants.prune(UPLOAD_DIR, _image_cache_dir())
+    if pruned:
+        app.logger.info("Removed %d orphaned image variant(s)", pruned)
+
+    interrupted = jobs.recover(_jobs_db())
+    if interrupted:
+        app.logger.warning("Marked %d interrupted background job(s) as failed", len(interrupted))
+    _cleanup_job_exports()
 
-        db.commit()
+
+def reap_jobs():
+    """Fail background jobs whose worker process has died.
+
+    Called by each Gunicorn worker as it starts, which is when a predecessor
+    that was killed by a timeout or recycled may have left jobs behind.
+    """
+    orphaned = jobs.reap(_jobs_db())
+    if orphaned:
+        app.logger.warning("Marked %d orphaned background job(s) as failed", len(orphaned))
 
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
@@ -584,6 +775,7 @@ def wine_json(wine_id):
     if not row:
         return None
     d = dict(row)
+    d["image_pending"] = image_pending(d["image"])
     # Parse JSON text columns into real objects
     for key in ("maturity_data", "taste_profile", "food_pairings"):
         raw = d.get(key)
@@ -599,9 +791,10 @@ def stats_json():
     """Return current stats dict."""
     db = get_db()
     s = db.execute(
-        "SELECT SUM(quantity) as total, COUNT(DISTINCT name) as types FROM wines WHERE quantity > 0"
+        "SELECT SUM(quantity) as total, COUNT(DISTINCT name) as types, COUNT(*) as wines "
+        "FROM wines WHERE quantity > 0"
     ).fetchone()
-    return {"total": s["total"] or 0, "types": s["types"] or 0}
+    return {"total": s["total"] or 0, "types": s["types"] or 0, "wines": s["wines"] or 0}
 
 
 def allowed(filename):
@@ -610,23 +803,93 @@ def allowed(filename):
 
 MAX_IMAGE_PX = 1800  # downscale images so longest edge ≤ this
 
+# Uploads are stored as received and downscaled on this pool, off the
+# request path. A "<name>.pending" marker next to the file flags it as not
+# yet optimized (visible to every worker process).
+IMAGE_WORKERS = 2
+IMAGE_WAIT_SECONDS = 60
+
+_image_pool = jobs.WorkerPool(IMAGE_WORKERS, "image")
+_image_futures = {}
+
 
 def _downscale(filepath):
-    """Resize an image file in-place so its longest edge ≤ MAX_IMAGE_PX."""
+    """Resize an image file so its longest edge ≤ MAX_IMAGE_PX.
+
+    The result is written next to the original and swapped in with
+    ``os.replace``, so readers never see a half-written file.
+    """
+    tmp = f"{filepath}.{secrets.token_hex(4)}.part"
     try:
-        from PIL import Image, ImageOps
+        from PIL import Image
         with Image.open(filepath) as img:
-            img = ImageOps.exif_transpose(img)
-            w, h = img.size
-            if max(w, h) <= MAX_IMAGE_PX:
-                img.save(filepath, quality=85, optimize=True)
-                return
-            ratio = MAX_IMAGE_PX / max(w, h)
-            new_size = (int(w * ratio), int(h * ratio))
-            img = img.resize(new_size, Image.LANCZOS)
-            img.save(filepath, quality=85, optimize=True)
+            if image_variants.is_final(img, MAX_IMAGE_PX):
+                return  # already small and upright: keep the file as is
+            fmt = img.format
+            img = image_variants.load_scaled(img, MAX_IMAGE_PX)
+            img.save(tmp, format=fmt, quality=85, optimize=True)
+        os.replace(tmp, filepath)
     except Exception as e:
         app.logger.warning("Image downscale failed: %s", e)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _pending_marker(path):
+    return path + ".pending"
+
+
+def image_pending(filename):
+    """True while an upload is still waiting for its background downscale."""
+    return bool(filename) and os.path.exists(_pending_marker(os.path.join(UPLOAD_DIR, filename)))
+
+
+def _downscale_pending(path):
+    try:
+        _downscale(path)
+    finally:
+        try:
+            os.remove(_pending_marker(path))
+        except FileNotFoundError:
+            pass
+
+
+def queue_downscale(path):
+    """Mark an upload as pending and downscale it on the image pool."""
+    name = os.path.basename(path)
+    open(_pending_marker(path), "w").close()
+    future = _image_pool.submit(_downscale_pending, path)
+    _image_futures[name] = future
+    future.add_done_callback(lambda _: _image_futures.pop(name, None))
+
+
+def wait_for_image(filename, timeout=IMAGE_WAIT_SECONDS):
+    """Block until a downscale queued by this process has finished."""
+    future = _image_futures.get(filename)
+    if future is None:
+        return
+    try:
+        future.result(timeout)
+    except TimeoutError:
+        app.logger.warning("Downscale of %s still running after %ss", filename, timeout)
+
+
+def _finish_pending_images():
+    """Downscale uploads whose worker died before finishing (startup only)."""
+    try:
+        entries = os.listdir(UPLOAD_DIR)
+    except FileNotFoundError:
+        return 0
+    done = 0
+    for entry in entries:
+        if entry.endswith(".pending"):
+            path = os.path.join(UPLOAD_DIR, entry[:-len(".pending")])
+            if os.path.isfile(path):
+                _downscale_pending(path)
+                done += 1
+            else:
+                os.remove(os.path.join(UPLOAD_DIR, entry))
+    return done
 
 
 def _downscale_bytes(file_storage):
@@ -638,13 +901,12 @@ def _downscale_bytes(file_storage):
                   "png": "image/png", "webp": "image/webp",
                   "gif": "image/gif"}.get(ext, "image/jpeg")
     try:
-        from PIL import Image, ImageOps
+        from PIL import Image
         with Image.open(file_storage.stream) as img:
-            img = ImageOps.exif_transpose(img)
-            w, h = img.size
-            if max(w, h) > MAX_IMAGE_PX:
-                ratio = MAX_IMAGE_PX / max(w, h)
-                img = img.resize((int(w * ratio), int(h * ratio)), Image.LANCZOS)
+            if image_variants.is_final(img, MAX_IMAGE_PX):
+                file_storage.stream.seek(0)
+                return base64.standard_b64encode(file_storage.stream.read()).decode("utf-8"), media_type
+            img = image_variants.load_scaled(img, MAX_IMAGE_PX)
             buf = BytesIO()
             fmt = "JPEG" if ext in ("jpg", "jpeg") else ext.upper()
             if fmt == "WEBP":
@@ -664,10 +926,9 @@ def _downscale_bytes(file_storage):
 def save_image(file):
     if file and file.filename and allowed(file.filename):
         ext = file.filename.rsplit(".", 1)[1].lower()
-        fname = f"{uuid.uuid4().hex}.{ext}"
-        path = os.path.join(UPLOAD_DIR, fname)
-        file.save(path)
-        _downscale(path)
+        fname, created = image_store.store_stream(UPLOAD_DIR, file.stream, ext)
+        if created:
+            queue_downscale(os.path.join(UPLOAD_DIR, fname))
         return fname
     return None
 
@@ -697,27 +958,347 @@ def logout():
     return redirect(url_for("login"))
 
 
-@app.route("/")
-def index():
-    db = get_db()
-    q = request.args.get("q", "").strip()
-    t = request.args.get("type", "")
-    show_empty = request.args.get("show_empty", "1")
+# Columns the cellar list (cards, table view, card data-* attributes) needs.
+# The AI text blobs (maturity_data, taste_profile, food_pairings) are only
+# loaded on demand through /api/wine/<id>.
+WINE_LIST_COLUMNS = (
+    "id", "name", "year", "type", "region", "quantity", "rating", "notes",
+    "image", "purchased_at", "price", "drink_from", "drink_until",
+    "location", "grape", "vivino_id", "bottle_format",
+)
+
+WINE_PAGE_SIZE = 60
+WINE_PAGE_MAX = 500
+
+# Default order of the cellar list. type and year may be NULL; COALESCE keeps
+# them comparable in the keyset condition and matches idx_wines_list_order.
+WINE_LIST_ORDER = ("COALESCE(type, '')", "name", "COALESCE(year, 0)")
+
+# Columns the table view can sort by (server-side, over the whole result)
+WINE_SORT_COLUMNS = {
+    "type": "COALESCE(type, '')",
+    "name": "name",
+    "year": "COALESCE(year, 0)",
+    "region": "COALESCE(region, '')",
+    "grape": "COALESCE(grape, '')",
+    "price": "COALESCE(price, 0)",
+    "quantity": "COALESCE(quantity, 0)",
+}
 
-    sql = "SELECT * FROM wines WHERE 1=1"
-    params = []
+# Drink-window filter (``dw``); every ``?`` is the current year
+_DRINK_WINDOW_SQL = {
+    "in": "drink_until >= ? AND COALESCE(drink_from, 0) <= ?",
+    "last": "drink_until = ?",
+    "past": "drink_until > 0 AND drink_until < ?",
+}
 
+
+def _wine_list_filters(args, show_empty="1"):
+    """The cellar list filters from request args: ``q``, ``type``,
+    ``show_empty`` and ``dw`` (drink window: in, last or past)."""
+    dw = args.get("dw", "")
+    return {
+        "q": args.get("q", "").strip(),
+        "t": args.get("type", ""),
+        "show_empty": args.get("show_empty", show_empty),
+        "dw": dw if dw in _DRINK_WINDOW_SQL else "",
+    }
+
+
+def _wine_list_where(db, q="", t="", show_empty="1", dw=""):
+    """WHERE conditions and params for the cellar list filters."""
+    where, params = ["1=1"], []
     if q:
-        sql += " AND (name LIKE ? OR region LIKE ? OR notes LIKE ?)"
-        params += [f"%{q}%", f"%{q}%", f"%{q}%"]
+        clause, search_params = _search_clause(db, q)
+        where.append(clause)
+        params += search_params
     if t:
-        sql += " AND type = ?"
+        where.append("COALESCE(type, '') = ?")
         params.append(t)
     if show_empty == "0":
-        sql += " AND quantity > 0"
+        where.append("quantity > 0")
+    if dw:
+        cond = _DRINK_WINDOW_SQL[dw]
+        where.append(cond)
+        params += [date.today().year] * cond.count("?")
+    return where, params
+
+
+def _wine_list_match(db, filters, sort=None):
+    """FTS5 query to rank the cellar list by, or None.
+
+    A search is listed by relevance (BM25, like ``/api/search``) unless the
+    table view sorts by a column. Without FTS5 it keeps the default order.
+    """
+    q = (filters or {}).get("q")
+    if not q or sort is not None or not _has_search_index(db):
+        return None
+    return _fts_query(q) or None
+
+
+def _wine_list_keys(sort=None, t="", ranked=False):
+    """Sort key expressions of the cellar list, ``id`` last."""
+    if ranked:
+        return ("rank", "id")
+    if sort is not None:
+        return (WINE_SORT_COLUMNS[sort], "id")
+    # Within one type the type key is constant; leaving it out lets SQLite
+    # read that type's range of idx_wines_list_order in order
+    return (*(WINE_LIST_ORDER[1:] if t else WINE_LIST_ORDER), "id")
+
+
+def _wine_list_page(db, filters=None, sort=None, desc=False, cursor=None, limit=None):
+    """One page of the cellar list.
+
+    Sorted by ``WINE_LIST_ORDER``, by relevance when searching, or, for the
+    table view, by the ``WINE_SORT_COLUMNS`` key ``sort``, with ``id`` as
+    the tie-breaker.
+    ``cursor`` is the ``next_cursor`` of the previous page: the sort key of
+    its last row. Unlike an OFFSET it stays correct when rows before it are
+    deleted or drop out of the filter. Fetches ``limit + 1`` rows to know
+    whether another page follows. Returns ``(wines, next_cursor)``;
+    ``next_cursor`` is None on the last page.
+    """
+    limit = limit or WINE_PAGE_SIZE
+    filters = filters or {}
+    match = _wine_list_match(db, filters, sort)
+    keys = _wine_list_keys(sort, filters.get("t"), ranked=match is not None)
+    source, params = "wines", []
+    if match:
+        # The search filter becomes a join that also yields the BM25 rank
+        source = (
+            f"wines JOIN (SELECT rowid AS fts_id, bm25(wines_fts, {_FTS_WEIGHTS}) AS rank "
+            "FROM wines_fts WHERE wines_fts MATCH ?) ON fts_id = wines.id"
+        )
+        params.append(match)
+        filters = {**filters, "q": ""}
+    where, where_params = _wine_list_where(db, **filters)
+    params += where_params
+    if cursor:
+        op = "<" if desc else ">"
+        where.append(f"({', '.join(keys)}) {op} ({', '.join('?' * len(keys))})")
+        # Lets SQLite seek to the cursor's first key instead of scanning from the start
+        where.append(f"{keys[0]} {op}= ?")
+        params += [*cursor, cursor[0]]
+
+    direction = "DESC" if desc else "ASC"
+    key_cols = ", ".join(f"{k} AS _k{i}" for i, k in enumerate(keys))
+    rows = db.execute(
+        f"SELECT {', '.join(WINE_LIST_COLUMNS)}, {key_cols} FROM {source} "
+        f"WHERE {' AND '.join(where)} "
+        f"ORDER BY {', '.join(f'{k} {direction}' for k in keys)} LIMIT ?",
+        params + [limit + 1],
+    ).fetchall()
+
+    wines = [{c: row[c] for c in WINE_LIST_COLUMNS} for row in rows[:limit]]
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        return wines, json.dumps([last[f"_k{i}"] for i in range(len(keys))])
+    return wines, None
+
+
+def _parse_wine_cursor(raw, size):
+    """Decode a ``next_cursor`` of ``size`` keys; raises ValueError if invalid."""
+    values = json.loads(raw)
+    if (not isinstance(values, list) or len(values) != size
+            or not isinstance(values[-1], int)
+            or any(isinstance(v, (list, dict, bool)) or v is None for v in values)):
+        raise ValueError("invalid cursor")
+    return values
+
+
+def _wine_list_counts(db, filters=None):
+    """Badge and filter-menu counts for the cellar list.
+
+    ``bottles`` / ``wines`` cover every active filter. ``types`` counts per
+    type ignoring the type filter, ``drink_window`` per drink-window option
+    ignoring that filter, as the filter menu shows them. ``cellar`` is the
+    number of wines without any filter.
+    """
+    filters = dict(filters or {})
+    where, params = _wine_list_where(db, **filters)
+    bottles, wines = db.execute(
+        f"SELECT IFNULL(SUM(quantity), 0), COUNT(*) FROM wines WHERE {' AND '.join(where)}", params
+    ).fetchone()
+
+    where, params = _wine_list_where(db, **{**filters, "t": ""})
+    types = dict(db.execute(
+        f"SELECT COALESCE(type, ''), COUNT(*) FROM wines WHERE {' AND '.join(where)} GROUP BY 1",
+        params,
+    ).fetchall())
+
+    where, params = _wine_list_where(db, **{**filters, "dw": ""})
+    year = date.today().year
+    sums = [f"IFNULL(SUM({cond}), 0)" for cond in _DRINK_WINDOW_SQL.values()]
+    sum_params = [year] * sum(cond.count("?") for cond in _DRINK_WINDOW_SQL.values())
+    row = db.execute(
+        f"SELECT COUNT(*), {', '.join(sums)} FROM wines WHERE {' AND '.join(where)}",
+        sum_params + params,
+    ).fetchone()
+
+    cellar, has_drink_window = db.execute(
+        "SELECT COUNT(*), IFNULL(MAX(drink_until > 0), 0) FROM wines"
+    ).fetchone()
+    return {
+        "bottles": bottles,
+        "wines": wines,
+        "types": types,
+        "drink_window": dict(zip(("", *_DRINK_WINDOW_SQL), row)),
+        "has_drink_window": bool(has_drink_window),
+        "cellar": cellar,
+    }
+
+
+# ── Search ────────────────────────────────────────────────────────────────────
+
+# BM25 column weights, in migrations.FTS_COLUMNS order:
+# name, region, grape, location, notes, food_pairings, year
+_FTS_WEIGHTS = "10.0, 5.0, 5.0, 2.0, 1.0, 2.0, 3.0"
+
+# Used when SQLite was built without FTS5
+_LIKE_SEARCH_COLUMNS = ("name", "region", "grape", "location", "notes", "food_pairings")
+
+
+def _has_search_index(db):
+    return db.execute("SELECT 1 FROM sqlite_master WHERE name = 'wines_fts'").fetchone() is not None
+
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix.
+
+    Words are quoted, so FTS5 operators and stray quotes in the input can
+    never cause a syntax error.
+    """
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+
+def _search_clause(db, q):
+    """SQL condition (on `wines`) and params matching the search text ``q``."""
+    if _has_search_index(db):
+        match = _fts_query(q)
+        if not match:
+            return "0", []
+        return "id IN (SELECT rowid FROM wines_fts WHERE wines_fts MATCH ?)", [match]
+    like = " OR ".join(f"{col} LIKE ?" for col in _LIKE_SEARCH_COLUMNS)
+    return f"({like})", [f"%{q}%"] * len(_LIKE_SEARCH_COLUMNS)
+
+
+def search_wines(db, q, limit=20):
+    """Ranked search. Returns ``(ids, rows)``: all matching ids, best first,
+    and the list columns of the first ``limit`` of them."""
+    cols = ", ".join(f"w.{c}" for c in WINE_LIST_COLUMNS)
+    if _has_search_index(db):
+        match = _fts_query(q)
+        if not match:
+            return [], []
+        ranked = db.execute(
+            f"SELECT rowid FROM wines_fts WHERE wines_fts MATCH ? "
+            f"ORDER BY bm25(wines_fts, {_FTS_WEIGHTS})",
+            (match,),
+        ).fetchall()
+        ids = [r[0] for r in ranked]
+    else:
+        clause, params = _search_clause(db, q)
+        ids = [r[0] for r in db.execute(
+            f"SELECT id FROM wines WHERE {clause} ORDER BY name, year", params
+        ).fetchall()]
+    top = ids[:limit]
+    if not top:
+        return ids, []
+    by_id = {
+        row["id"]: dict(row) for row in db.execute(
+            f"SELECT {cols} FROM wines w WHERE w.id IN ({','.join('?' * len(top))})", top
+        ).fetchall()
+    }
+    return ids, [by_id[i] for i in top if i in by_id]
+
+
+@app.cli.command("check-stats")
+@click.option("--rebuild", is_flag=True, help="Rebuild the statistics from scratch.")
+def check_stats_command(rebuild):
+    """Verify the materialized cellar statistics against the wines table."""
+    db = _connect()
+    try:
+        problems = cellar_stats.check(db)
+        for line in problems:
+            print(line)
+        if rebuild:
+            cellar_stats.rebuild(db)
+            db.commit()
+            print("Cellar statistics rebuilt.")
+        elif not problems:
+            print("Cellar statistics are consistent.")
+    finally:
+        db.close()
+
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Create (if needed) and rebuild the full-text search index."""
+    db = _connect()
+    try:
+        if not create_search_index(db):
+            print("FTS5 is not available in this SQLite build; search uses LIKE.")
+            return
+        rebuild_search_index(db)
+        db.commit()
+        count = db.execute("SELECT COUNT(*) FROM wines").fetchone()[0]
+        print(f"Search index rebuilt ({count} wines).")
+    finally:
+        db.close()
 
-    sql += " ORDER BY type, name, year"
-    wines = [dict(row) for row in db.execute(sql, params).fetchall()]
+
+@app.cli.command("prune-images")
+def prune_images_command():
+    """Delete cached image variants whose original upload is gone."""
+    removed = image_variants.prune(UPLOAD_DIR, _image_cache_dir())
+    print(f"Removed {removed} orphaned image variant(s).")
+
+
+@app.cli.command("gc-images")
+@click.option("--dry-run", is_flag=True, help="Only list the files that would be removed.")
+def gc_images_command(dry_run):
+    """Delete uploaded images that no wine or chat message references."""
+    db = _connect()
+    try:
+        removed = image_store.collect_garbage(db, UPLOAD_DIR, dry_run=dry_run)
+    finally:
+        db.close()
+    for name in removed:
+        print(name)
+    verb = "Would remove" if dry_run else "Removed"
+    print(f"{verb} {len(removed)} unreferenced upload(s).")
+
+
+@app.route("/api/search")
+def api_search():
+    """Full-text search over name, region, grape, location, notes, food
+    pairings and vintage, ranked by BM25 (accent-insensitive, prefix match).
+
+    ``ids`` lists every match, ``wines`` holds the list columns of the first
+    ``limit`` matches. The cellar page pages through the same ranking with
+    ``/api/wines?q=``.
+    """
+    q = request.args.get("q", "").strip()
+    try:
+        limit = min(max(0, int(request.args.get("limit", 20))), WINE_PAGE_MAX)
+    except (TypeError, ValueError):
+        return jsonify(ok=False, error="invalid_paging"), 400
+    if not q:
+        return jsonify(ok=True, query=q, ids=[], wines=[])
+    ids, wines = search_wines(get_db(), q, limit)
+    return jsonify(ok=True, query=q, ids=ids, wines=wines)
+
+
+@app.route("/")
+def index():
+    db = get_db()
+    # Empty bottles are hidden unless asked for, like the filter menu shows it
+    filters = _wine_list_filters(request.args, show_empty="0")
+
+    # Only the first page is rendered; the rest is fetched from /api/wines
+    # while scrolling.
+    wines, next_cursor = _wine_list_page(db, filters)
 
     stats = db.execute(
         "SELECT SUM(quantity) as total, COUNT(DISTINCT name) as types FROM wines WHERE quantity > 0"
@@ -733,14 +1314,55 @@ def index():
     return render_template(
         "index.html",
         wines=wines,
+        next_cursor=next_cursor,
+        page_size=WINE_PAGE_SIZE,
+        table_sort_keys=list(WINE_SORT_COLUMNS),
+        wine_counts=_wine_list_counts(db, filters),
         used_types=used_types,
-        query=q,
-        active_type=t,
-        show_empty=show_empty,
+        query=filters["q"],
+        active_type=filters["t"],
+        show_empty=filters["show_empty"],
+        drink_window=filters["dw"],
         stats=stats,
     )
 
 
+@app.route("/api/wines")
+def api_wines():
+    """Paginated cellar list (list columns only) for lazy loading.
+
+    Query args: the filters ``q``, ``type``, ``show_empty`` and ``dw`` (as
+    for ``/``), ``sort`` (a ``WINE_SORT_COLUMNS`` key) with ``desc=1``,
+    ``limit`` and ``cursor`` (the ``next_cursor`` of the previous page).
+    """
+    db = get_db()
+    filters = _wine_list_filters(request.args)
+    sort = request.args.get("sort") or None
+    if sort is not None and sort not in WINE_SORT_COLUMNS:
+        return jsonify(ok=False, error="invalid_sort"), 400
+    try:
+        limit = min(max(1, int(request.args.get("limit", WINE_PAGE_SIZE))), WINE_PAGE_MAX)
+        cursor = request.args.get("cursor")
+        if cursor:
+            ranked = _wine_list_match(db, filters, sort) is not None
+            cursor = _parse_wine_cursor(cursor, len(_wine_list_keys(sort, filters["t"], ranked)))
+    except (TypeError, ValueError):
+        return jsonify(ok=False, error="invalid_paging"), 400
+
+    wines, next_cursor = _wine_list_page(
+        db, filters, sort, request.args.get("desc") == "1", cursor, limit,
+    )
+    return jsonify(ok=True, wines=wines, next_cursor=next_cursor)
+
+
+@app.route("/api/wines/counts")
+def api_wine_counts():
+    """Badge and filter-menu counts for the cellar list filters (see
+    ``_wine_list_counts``)."""
+    db = get_db()
+    return jsonify(ok=True, counts=_wine_list_counts(db, _wine_list_filters(request.args)))
+
+
 @app.route("/add", methods=["POST"])
 def add():
     db = get_db()
@@ -809,30 +1431,14 @@ def edit(wine_id):
 
     image = wine["image"]
     if request.form.get("delete_image") == "1":
-        if image:
-            try:
-                os.remove(os.path.join(UPLOAD_DIR, image))
-            except FileNotFoundError:
-                pass
         image = None
     new_image = save_image(request.files.get("image"))
     if new_image:
-        # Remove old image
-        if image:
-            try:
-                os.remove(os.path.join(UPLOAD_DIR, image))
-            except FileNotFoundError:
-                pass
         image = new_image
     # If no file upload but AI/Vivino downloaded an image, use that
     if not new_image:
         ai_img = request.form.get("ai_image", "").strip()
         if ai_img and ai_img != image and os.path.isfile(os.path.join(UPLOAD_DIR, ai_img)):
-            if image:
-                try:
-                    os.remove(os.path.join(UPLOAD_DIR, image))
-                except FileNotFoundError:
-                    pass
             image = ai_img
 
     old_quantity = wine["quantity"] or 0
@@ -897,6 +1503,8 @@ def edit(wine_id):
             (wine_id, "restocked", new_quantity - old_quantity, datetime.now().isoformat()),
         )
     db.commit()
+    if wine["image"] != image:
+        image_store.release(db, UPLOAD_DIR, wine["image"])
     if is_ajax():
         return jsonify({"ok": True, "wine": wine_json(wine_id), "stats": stats_json()})
     path = g.get("ingress", "") + url_for("index") + f"?new={wine_id}"
@@ -912,14 +1520,10 @@ def duplicate(wine_id):
 
     new_year = request.form.get("new_year") or wine["year"]
 
-    # Copy image so each wine has its own independent file
+    # Uploads are content-addressed: the copy simply references the same file
     new_image = None
-    if wine["image"]:
-        src = os.path.join(UPLOAD_DIR, wine["image"])
-        if os.path.exists(src):
-            ext = wine["image"].rsplit(".", 1)[-1].lower()
-            new_image = f"{uuid.uuid4().hex}.{ext}"
-            shutil.copy2(src, os.path.join(UPLOAD_DIR, new_image))
+    if wine["image"] and os.path.exists(os.path.join(UPLOAD_DIR, wine["image"])):
+        new_image = wine["image"]
 
     db.execute(
         """INSERT INTO wines (name, year, type, region, quantity, rating, notes, image, added,
@@ -973,18 +1577,10 @@ def delete(wine_id):
             "INSERT INTO timeline (wine_id, action, quantity, timestamp) VALUES (?,?,?,?)",
             (wine_id, "removed", wine["quantity"] or 0, datetime.now().isoformat()),
         )
-    if wine and wine["image"]:
-        # Only delete image if no other wine uses it
-        count = db.execute(
-            "SELECT COUNT(*) FROM wines WHERE image=? AND id!=?", (wine["image"], wine_id)
-        ).fetchone()[0]
-        if count == 0:
-            try:
-                os.remove(os.path.join(UPLOAD_DIR, wine["image"]))
-            except FileNotFoundError:
-                pass
     db.execute("DELETE FROM wines WHERE id=?", (wine_id,))
     db.commit()
+    if wine:
+        image_store.release(db, UPLOAD_DIR, wine["image"])
     if is_ajax():
         return jsonify({"ok": True, "deleted": wine_id, "stats": stats_json()})
     return ingress_redirect("index")
@@ -1003,101 +1599,207 @@ def timeline_page():
     return render_template("timeline.html")
 
 
+TIMELINE_PAGE_SIZE = 100
+TIMELINE_PAGE_MAX = 500
+
+# Timeline rows grouped by wine + action + day (chat entries are never grouped:
+# each is its own conversation). With a single MAX() aggregate SQLite takes
+# the bare column ``id`` from the newest row of each group.
+_TIMELINE_GROUPS_SQL = """
+    SELECT wl.id, wl.wine_id, wl.action, SUM(wl.quantity) AS quantity,
+           MAX(wl.timestamp) AS timestamp
+    FROM timeline wl
+    WHERE {where}
+    GROUP BY wl.wine_id, wl.action, substr(wl.timestamp, 1, 10),
+             CASE WHEN wl.action = 'chat' THEN wl.id END
+"""
+
+
+def _timeline_cutoff(months_param):
+    """ISO start of the month ``months`` months back, or None."""
+    try:
+        months = int(months_param)
+    except (ValueError, TypeError):
+        return None
+    now = datetime.now()
+    year = now.year
+    month = now.month - months
+    while month < 1:
+        month += 12
+        year -= 1
+    return now.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
+
+
+def _timeline_page(db, cutoff=None, cursor=None, limit=TIMELINE_PAGE_SIZE):
+    """One page of grouped timeline entries, newest first.
+
+    ``cursor`` is the ``(timestamp, id)`` of the last entry of the previous
+    page. Returns ``(entries, next_cursor)``; ``next_cursor`` is None on the
+    last page. Chat entries get the title of the chat session that was open
+    at the time, resolved in the same query.
+    """
+    where, params = ["1=1"], []
+    if cutoff:
+        where.append("wl.timestamp >= ?")
+        params.append(cutoff)
+    page_where, page_params = "", []
+    if cursor:
+        # Groups never span days, so older rows than the cursor's day can
+        # be skipped before grouping
+        next_day = (date.fromisoformat(cursor[0][:10]) + timedelta(days=1)).isoformat()
+        where.append("wl.timestamp < ?")
+        params.append(next_day)
+        page_where = "WHERE (timestamp, id) < (?, ?)"
+        page_params = list(cursor)
+
+    rows = db.execute(f"""
+        WITH page AS (
+            SELECT * FROM ({_TIMELINE_GROUPS_SQL.format(where=" AND ".join(where))})
+            {page_where}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        )
+        SELECT page.*, w.name AS wine_name, w.image AS wine_image, w.type AS wine_type,
+               cs.id AS session_id, cs.title AS session_title
+        FROM page
+        LEFT JOIN wines w ON w.id = page.wine_id
+        LEFT JOIN chat_sessions cs ON page.action = 'chat' AND page.wine_id = 0 AND cs.id = (
+            SELECT s.id FROM chat_sessions s WHERE s.created <= page.timestamp
+            ORDER BY s.created DESC LIMIT 1
+        )
+        ORDER BY page.timestamp DESC, page.id DESC
+    """, params + page_params + [limit + 1]).fetchall()
+
+    entries = []
+    for r in rows[:limit]:
+        if r["action"] == "chat" and r["wine_id"] == 0:
+            wine_name = r["session_title"] or T.get("log_chat", "Sommelier chat")
+        else:
+            wine_name = r["wine_name"] or "(deleted)"
+        entry = {
+            "id": r["id"],
+            "wine_id": r["wine_id"],
+            "wine_name": wine_name,
+            "wine_image": r["wine_image"],
+            "wine_type": r["wine_type"],
+            "action": r["action"],
+            "quantity": r["quantity"],
+            "timestamp": r["timestamp"],
+        }
+        if r["session_id"] is not None:
+            entry["session_id"] = r["session_id"]
+        entries.append(entry)
+
+    if len(rows) > limit:
+        last = entries[-1]
+        return entries, f"{last['timestamp']}|{last['id']}"
+    return entries, None
+
+
+def _timeline_summary(db, cutoff=None):
+    """Header cards: this month's bottles per action and the entry count."""
+    month_start = date.today().replace(day=1).isoformat()
+    per_action = dict(db.execute(
+        "SELECT action, IFNULL(SUM(quantity), 0) FROM timeline WHERE timestamp >= ? GROUP BY action",
+        (max(month_start, cutoff or ""),),
+    ).fetchall())
+    where, params = ("wl.timestamp >= ?", [cutoff]) if cutoff else ("1=1", [])
+    total = db.execute(
+        f"SELECT COUNT(*) FROM ({_TIMELINE_GROUPS_SQL.format(where=where)})", params
+    ).fetchone()[0]
+    return {
+        "consumed_month": per_action.get("consumed", 0),
+        "added_month": per_action.get("added", 0),
+        "restocked_month": per_action.get("restocked", 0),
+        "total": total,
+    }
+
+
 @app.route("/api/timeline")
 def api_timeline():
-    db = get_db()
-    months_param = request.args.get("months")
+    """Grouped timeline entries, newest first, paginated by cursor.
 
-    sql = """
-        SELECT wl.id, wl.wine_id, w.name as wine_name, w.image as wine_image,
-               w.type as wine_type, wl.action, wl.quantity, wl.timestamp
-        FROM timeline wl
-        LEFT JOIN wines w ON wl.wine_id = w.id
+    Query args: ``months`` (only entries from the last N months),
+    ``limit`` and ``cursor`` (the ``next_cursor`` of the previous page).
+    The first page also carries the ``summary`` for the header cards.
     """
-    params = []
-    if months_param:
-        try:
-            months = int(months_param)
-            now = datetime.now()
-            year = now.year
-            month = now.month - months
-            while month < 1:
-                month += 12
-                year -= 1
-            cutoff = now.replace(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0)
-            sql += " WHERE wl.timestamp >= ? "
-            params.append(cutoff.isoformat())
-        except (ValueError, TypeError):
-            pass
+    db = get_db()
+    cutoff = _timeline_cutoff(request.args.get("months"))
+    cursor_param = request.args.get("cursor")
+    try:
+        limit = min(max(1, int(request.args.get("limit", TIMELINE_PAGE_SIZE))), TIMELINE_PAGE_MAX)
+        cursor = None
+        if cursor_param:
+            ts, _, entry_id = cursor_param.rpartition("|")
+            date.fromisoformat(ts[:10])
+            cursor = (ts, int(entry_id))
+    except (TypeError, ValueError):
+        return jsonify(ok=False, error="invalid_paging"), 400
+
+    def build():
+        entries, next_cursor = _timeline_page(db, cutoff, cursor, limit)
+        result = {"ok": True, "entries": entries, "next_cursor": next_cursor}
+        if cursor is None:
+            result["summary"] = _timeline_summary(db, cutoff)
+        return jsonify(result)
 
-    sql += " ORDER BY wl.timestamp DESC"
+    etag = revision_etag(
+        "timeline", timeline_revision(db), cellar_revision(db), chat_revision(db),
+        date.today(), LANG, cutoff, cursor, limit,
+    )
+    return conditional_json(etag, build)
 
-    rows = db.execute(sql, params).fetchall()
 
-    # Group all entries with same wine_id + action + date (regardless of order)
-    grouped = {}
-    for r in rows:
-        day = r["timestamp"][:10] if r["timestamp"] else ""
-        # Chat entries are never grouped (each is a unique conversation)
-        if r["action"] == "chat":
-            key = ("chat", r["id"])
-        else:
-            key = (r["wine_id"], r["action"], day)
-        if key in grouped:
-            grouped[key]["quantity"] += r["quantity"]
-        else:
-            # For chat entries (wine_id=0), look up session title
-            wine_name = r["wine_name"]
-            if r["action"] == "chat" and r["wine_id"] == 0:
-                # Try to get session title and id from the most recent chat session around this timestamp
-                session_row = db.execute(
-                    "SELECT id, title FROM chat_sessions WHERE created <= ? ORDER BY created DESC LIMIT 1",
-                    (r["timestamp"],),
-                ).fetchone()
-                wine_name = session_row["title"] if session_row and session_row["title"] else T.get("log_chat", "Sommelier chat")
-            elif not wine_name:
-                wine_name = "(deleted)"
-            entry = {
-                "id": r["id"],
-                "wine_id": r["wine_id"],
-                "wine_name": wine_name,
-                "wine_image": r["wine_image"],
-                "wine_type": r["wine_type"],
-                "action": r["action"],
-                "quantity": r["quantity"],
-                "timestamp": r["timestamp"],
-            }
-            if r["action"] == "chat" and session_row:
-                entry["session_id"] = session_row["id"]
-            grouped[key] = entry
-    entries = sorted(grouped.values(), key=lambda e: e["timestamp"], reverse=True)
-    return jsonify(ok=True, entries=entries)
+DRINK_WINDOW_WHERE = "WHERE drink_until IS NOT NULL AND drink_until != '' AND quantity > 0"
+
+# (DB_PATH, cellar rev, timeline rev, today, LANG) -> stats.html context
+_stats_snapshot = (None, None)
 
 
 @app.route("/stats")
 def stats_page():
+    """Render the statistics page from a cached snapshot.
+
+    The snapshot is rebuilt only when a wine or timeline entry changed (in
+    any worker – the revisions live in the DB) or the day rolled over.
+    """
+    global _stats_snapshot
     db = get_db()
+    key = (DB_PATH, cellar_revision(db), timeline_revision(db), date.today(), LANG)
+    cached_key, ctx = _stats_snapshot
+    if cached_key != key:
+        ctx = _stats_context(db)
+        _stats_snapshot = (key, ctx)
+    return render_template("stats.html", **ctx)
+
+
+def _stats_context(db):
+    """Template context for the stats page.
+
+    Counts and sums come from the materialized ``cellar_stats`` table; the
+    remaining lookups are indexed ``LIMIT`` queries.
+    """
     current_year = datetime.now().year
+    summary = cellar_stats.totals(db)
 
     # Total bottles & distinct wines
-    totals = db.execute(
-        "SELECT SUM(quantity) as bottles, COUNT(*) as wines FROM wines"
-    ).fetchone()
+    totals = {
+        "bottles": summary["bottles"] if summary["wines"] else None,
+        "wines": summary["wines"],
+    }
 
     # Bottles by type
-    by_type = [dict(r) for r in db.execute(
-        "SELECT type, SUM(quantity) as qty FROM wines WHERE type IS NOT NULL AND type != '' GROUP BY type ORDER BY qty DESC"
-    ).fetchall()]
-
-    # Top regions (bar chart – limited)
-    top_regions = [dict(r) for r in db.execute(
-        "SELECT region, SUM(quantity) as qty FROM wines WHERE region IS NOT NULL AND region != '' GROUP BY region ORDER BY qty DESC LIMIT 7"
-    ).fetchall()]
+    by_type = sorted(
+        ({"type": g["key"], "qty": g["bottles"]} for g in cellar_stats.groups(db, "type") if g["key"]),
+        key=lambda r: r["qty"], reverse=True,
+    )
 
-    # All regions with coordinates (for the map)
-    all_regions = [dict(r) for r in db.execute(
-        "SELECT region, SUM(quantity) as qty FROM wines WHERE region IS NOT NULL AND region != '' GROUP BY region ORDER BY qty DESC"
-    ).fetchall()]
+    # All regions (map) and the top ones (bar chart – limited)
+    all_regions = sorted(
+        ({"region": g["key"], "qty": g["bottles"]} for g in cellar_stats.groups(db, "region") if g["key"]),
+        key=lambda r: r["qty"], reverse=True,
+    )
+    top_regions = all_regions[:7]
     map_points = []
     for r in all_regions:
         coords = geocode_region(r["region"])
@@ -1105,15 +1807,7 @@ def stats_page():
             map_points.append({"region": r["region"], "qty": r["qty"], "lat": coords[0], "lon": coords[1]})
 
     # Total liters (quantity * bottle_format)
-    total_liters = db.execute(
-        "SELECT SUM(quantity * COALESCE(bottle_format, 0.75)) as liters FROM wines"
-    ).fetchone()["liters"] or 0
-
-    # Total value
-    value = db.execute(
-        "SELECT SUM(quantity * price) as total_value, AVG(price) as avg_price, "
-        "MIN(price) as min_price, MAX(price) as max_price FROM wines WHERE price IS NOT NULL AND price > 0"
-    ).fetchone()
+    total_liters = round(summary["liters"], 6)
 
     # Most expensive wine
     most_expensive = db.execute(
@@ -1125,15 +1819,22 @@ def stats_page():
         "SELECT id, name, year, type, price FROM wines WHERE price IS NOT NULL AND price > 0 ORDER BY price ASC LIMIT 1"
     ).fetchone()
 
+    # Total value
+    priced = summary["price_count"]
+    value = {
+        "total_value": round(summary["value"], 6) if priced else None,
+        "avg_price": summary["price_sum"] / priced if priced else None,
+        "min_price": cheapest["price"] if priced and cheapest else None,
+        "max_price": most_expensive["price"] if priced and most_expensive else None,
+    }
+
     # Best rated wines
     best_rated = [dict(r) for r in db.execute(
         "SELECT id, name, year, type, rating, quantity FROM wines WHERE rating > 0 ORDER BY rating DESC, name LIMIT 5"
     ).fetchall()]
 
     # Average age
-    avg_age = db.execute(
-        f"SELECT AVG({current_year} - year) as avg_age FROM wines WHERE year IS NOT NULL AND year > 0"
-    ).fetchone()
+    avg_age = current_year - summary["year_sum"] / summary["year_count"] if summary["year_count"] else None
 
     # Oldest wine
     oldest = db.execute(
@@ -1151,39 +1852,14 @@ def stats_page():
     ).fetchall()]
 
     # Bottles in stock vs out
-    in_stock = db.execute("SELECT SUM(quantity) FROM wines WHERE quantity > 0").fetchone()[0] or 0
-    out_of_stock = db.execute("SELECT COUNT(*) FROM wines WHERE quantity = 0").fetchone()[0] or 0
+    in_stock = summary["in_stock_bottles"]
+    out_of_stock = summary["empty_wines"]
 
     # Drink window chart – bottles per year, stacked by type
-    dw_wines = [dict(r) for r in db.execute(
-        "SELECT id, name, year, type, quantity, drink_from, drink_until FROM wines "
-        "WHERE drink_until IS NOT NULL AND drink_until != '' AND quantity > 0"
-    ).fetchall()]
-    dw_by_year = defaultdict(lambda: defaultdict(int))
-    dw_names_by_year = defaultdict(lambda: defaultdict(list))
-    dw_types = set()
-    for w in dw_wines:
-        try:
-            until = int(w["drink_until"])
-            frm = int(w["drink_from"]) if w.get("drink_from") else until
-            t = w["type"] or "Anderes"
-            dw_types.add(t)
-            entry = {"n": w["name"], "y": w.get("year"), "q": w["quantity"], "id": w["id"]}
-            for yr in range(frm, until + 1):
-                dw_by_year[yr][t] += w["quantity"]
-                dw_names_by_year[yr][t].append(entry)
-        except (ValueError, TypeError):
-            pass
-    if dw_by_year:
-        dw_chart = [{"year": yr, "counts": dict(dw_by_year[yr])}
-                    for yr in range(min(dw_by_year), max(dw_by_year) + 1)]
-        dw_type_order = sorted(dw_types)
-        dw_wine_names = {str(yr): {t: wl for t, wl in types.items()}
-                         for yr, types in dw_names_by_year.items()}
-    else:
-        dw_chart = []
-        dw_type_order = []
-        dw_wine_names = {}
+    # (the wine names per bar are fetched on hover from /api/stats/drink-window)
+    dw_chart, dw_type_order = cellar_stats.drink_window_histogram(db.execute(
+        "SELECT type, quantity, drink_from, drink_until FROM wines " + DRINK_WINDOW_WHERE
+    ))
 
     # Stock history – last 6 months
     today = date.today()
@@ -1265,8 +1941,7 @@ def stats_page():
 
     type_translations = {t: T.get(f"wine_type_{t}", t) for t in WINE_TYPES}
 
-    return render_template(
-        "stats.html",
+    return dict(
         totals=totals,
         total_liters=total_liters,
         by_type=by_type,
@@ -1276,7 +1951,7 @@ def stats_page():
         most_expensive=dict(most_expensive) if most_expensive else None,
         cheapest=dict(cheapest) if cheapest else None,
         best_rated=best_rated,
-        avg_age=avg_age["avg_age"] if avg_age else None,
+        avg_age=avg_age,
         oldest=dict(oldest) if oldest else None,
         newest=dict(newest) if newest else None,
         recent=recent,
@@ -1284,7 +1959,6 @@ def stats_page():
         out_of_stock=out_of_stock,
         dw_chart=dw_chart,
         dw_type_order=dw_type_order,
-        dw_wine_names=dw_wine_names,
         stock_chart=stock_chart,
         wines_by_type=wines_by_type,
         wines_by_region=wines_by_region,
@@ -1299,18 +1973,28 @@ def export_data():
 
     Readonly users may export — it only reads data.
     """
-    zip_bytes = build_export_zip(get_db(), UPLOAD_DIR, app_version=APP_VERSION)
     fname = export_filename()
     return Response(
-        zip_bytes,
+        _export_stream(),
         mimetype="application/zip",
-        headers={
-            "Content-Disposition": f'attachment; filename="{fname}"',
-            "Content-Length": str(len(zip_bytes)),
-        },
+        headers={"Content-Disposition": f'attachment; filename="{fname}"'},
     )
 
 
+def _export_stream():
+    """Stream the archive from its own connection and read snapshot.
+
+    The response body is generated after the request has finished, so it
+    must not borrow the pooled connection (``close_db`` rolls it back).
+    """
+    db = _connect()
+    try:
+        db.execute("BEGIN")
+        yield from iter_export_zip(db, UPLOAD_DIR, app_version=APP_VERSION)
+    finally:
+        db.close()
+
+
 def _cleanup_import_tmp(max_age_seconds=3600):
     """Delete stale import temp files (older than 1h by default)."""
     now = datetime.now().timestamp()
@@ -1326,9 +2010,26 @@ def _cleanup_import_tmp(max_age_seconds=3600):
         pass
 
 
+def _import_tmp_path(token, suffix):
+    return os.path.join(IMPORT_TMP_DIR, f"{token}.{suffix}")
+
+
+def _discard_import(token):
+    for suffix in ("upload", "json"):
+        try:
+            os.remove(_import_tmp_path(token, suffix))
+        except OSError:
+            pass
+
+
 @app.route("/import/preview", methods=["POST"])
 def import_preview():
-    """Parse uploaded archive/CSV, return matches + a token for commit."""
+    """Parse uploaded archive/CSV, return matches + a token for commit.
+
+    The upload is spooled to ``IMPORT_TMP_DIR`` in blocks and parsed from
+    there; the parse result is cached next to it as ``<token>.json`` so the
+    commit does not parse the archive again.
+    """
     if AUTH_ENABLED and session.get("role") == "readonly":
         return jsonify({"ok": False, "error": "forbidden"}), 403
 
@@ -1336,139 +2037,617 @@ def import_preview():
     if not f:
         return jsonify({"ok": False, "error": "Keine Datei hochgeladen"}), 400
 
-    raw = f.read()
-    if not raw:
+    _cleanup_import_tmp()
+    token = secrets.token_urlsafe(16)
+    upload_path = _import_tmp_path(token, "upload")
+    f.save(upload_path)
+    if os.path.getsize(upload_path) == 0:
+        _discard_import(token)
         return jsonify({"ok": False, "error": "Datei ist leer"}), 400
 
-    try:
-        parsed = parse_import_file(raw, filename=f.filename or "")
-    except WineImportError as e:
-        return jsonify({"ok": False, "error": str(e)}), 400
+    try:
+        parsed = parse_import_file(upload_path, filename=f.filename or "")
+    except WineImportError as e:
+        _discard_import(token)
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    if parsed["archive"] is None:
+        # CSV: everything needed is in the parse result
+        os.remove(upload_path)
+    with open(_import_tmp_path(token, "json"), "w", encoding="utf-8") as out:
+        json.dump({**parsed, "archive": parsed["archive"] and os.path.basename(upload_path)}, out)
+
+    matches = match_wines(parsed["wines"], get_db())
+
+    # Build preview: split into new vs. duplicates with a compact label
+    new_items = []
+    duplicates = []
+    for w, m in zip(parsed["wines"], matches):
+        label = w.get("name") or "?"
+        if w.get("year"):
+            label += f" ({w['year']})"
+        if m["matched"]:
+            duplicates.append({
+                "label": label,
+                "existing_id": m["existing_id"],
+                "existing_name": m["existing"]["name"] if m["existing"] else None,
+            })
+        else:
+            new_items.append({"label": label})
+
+    return jsonify({
+        "ok": True,
+        "token": token,
+        "source": parsed["source"],
+        "schema_version": parsed["schema_version"],
+        "counts": {
+            "total": len(parsed["wines"]),
+            "new": len(new_items),
+            "duplicates": len(duplicates),
+            "images": len(parsed.get("images") or {}),
+        },
+        "new": new_items[:500],  # cap for payload size
+        "duplicates": duplicates[:500],
+    })
+
+
+@app.route("/import/commit", methods=["POST"])
+def import_commit():
+    """Apply a previously previewed import given its token + strategy.
+
+    With ``"background": true`` the import runs as a job and the response
+    (202) only carries its ``job_id``.
+    """
+    if AUTH_ENABLED and session.get("role") == "readonly":
+        return jsonify({"ok": False, "error": "forbidden"}), 403
+
+    payload = request.get_json(silent=True) or {}
+    token = (payload.get("token") or "").strip()
+    strategy = (payload.get("strategy") or "skip").strip()
+
+    # Token must be a bare identifier — no path traversal.
+    if not token or "/" in token or "\\" in token or ".." in token:
+        return jsonify({"ok": False, "error": "Ungültiger Token"}), 400
+    if strategy not in ("skip", "overwrite"):
+        return jsonify({"ok": False, "error": "Ungültige Strategie"}), 400
+
+    try:
+        with open(_import_tmp_path(token, "json"), encoding="utf-8") as fh:
+            parsed = json.load(fh)
+    except (OSError, ValueError):
+        return jsonify({"ok": False, "error": "Import-Datei abgelaufen — bitte erneut hochladen"}), 404
+    if parsed.get("archive"):
+        parsed["archive"] = os.path.join(IMPORT_TMP_DIR, parsed["archive"])
+        if not os.path.isfile(parsed["archive"]):
+            _discard_import(token)
+            return jsonify({"ok": False, "error": "Import-Datei abgelaufen — bitte erneut hochladen"}), 404
+
+    if payload.get("background"):
+        job_id = _jobs.submit(_jobs_db(), "import", _import_job, parsed, token, strategy)
+        return jsonify({"ok": True, "job_id": job_id}), 202
+
+    db = get_db()
+    matches = match_wines(parsed["wines"], db)
+    result = apply_import(parsed, matches, db, UPLOAD_DIR, strategy=strategy)
+
+    # Clean up the token files now that we're done
+    _discard_import(token)
+
+    return jsonify({"ok": True, **result})
+
+
+def _import_job(job, parsed, token, strategy):
+    db = _connect()
+    db.execute(f"PRAGMA busy_timeout = {IMPORT_BUSY_TIMEOUT_MS}")
+    try:
+        matches = match_wines(parsed["wines"], db)
+        return apply_import(parsed, matches, db, UPLOAD_DIR, strategy=strategy, progress=job.progress)
+    finally:
+        db.close()
+        _discard_import(token)
+
+
+# ── Background jobs ───────────────────────────────────────────────────────────
+# Long-running work runs on a small thread pool; clients poll /api/jobs/<id>.
+
+JOB_WORKERS = 2
+REANALYZE_MAX_WINES = 500
+
+# Bulk enrichment: fields filled in, provider calls in flight, wines per
+# write transaction, seconds between Message Batches status polls
+ENRICH_FIELDS = ("maturity_data", "taste_profile", "food_pairings")
+ENRICH_CONCURRENCY = 4
+ENRICH_WRITE_BATCH = 25
+ENRICH_POLL_SECONDS = 30
+
+_jobs = jobs.JobRunner(max_workers=JOB_WORKERS)
+_ai_rate_limiter = ai_clients.RateLimiter()
+
+
+def _jobs_db():
+    return os.path.join(os.path.dirname(DB_PATH), "jobs.db")
+
+
+def _job_export_dir():
+    return os.path.join(DATA_DIR, "exports")
+
+
+def _cleanup_job_exports(max_age_seconds=jobs.KEEP_DAYS * 86400):
+    """Delete finished export archives once their job has been pruned."""
+    now = datetime.now().timestamp()
+    try:
+        for entry in os.listdir(_job_export_dir()):
+            path = os.path.join(_job_export_dir(), entry)
+            try:
+                if now - os.path.getmtime(path) > max_age_seconds:
+                    os.remove(path)
+            except OSError:
+                pass
+    except FileNotFoundError:
+        pass
+
+
+def _export_job(job):
+    """Write the backup archive to ``exports/<job id>.zip``."""
+    os.makedirs(_job_export_dir(), exist_ok=True)
+    path = os.path.join(_job_export_dir(), f"{job.id}.zip")
+    db = _connect()
+    try:
+        db.execute("BEGIN")
+        job.progress("export", 0, 1)
+        with open(path + ".part", "wb") as out:
+            for chunk in iter_export_zip(db, UPLOAD_DIR, app_version=APP_VERSION):
+                out.write(chunk)
+        os.replace(path + ".part", path)
+    finally:
+        db.close()
+    job.progress("export", 1, 1)
+    return {"filename": export_filename(), "size": os.path.getsize(path)}
+
+
+def _reanalyze_job(job, wine_ids, opts):
+    """Run the AI analysis for each wine; fields are returned, not applied."""
+    db = _connect()
+    results, failed = {}, {}
+    try:
+        for done, wine_id in enumerate(wine_ids):
+            job.progress("analyze", done, len(wine_ids))
+            wine = db.execute("SELECT * FROM wines WHERE id = ?", (wine_id,)).fetchone()
+            if wine is None:
+                failed[wine_id] = "not_found"
+                continue
+            image_b64, media_type = _load_image_b64(wine["image"])
+            try:
+                results[wine_id] = _analyze_wine_from_context(opts, image_b64, media_type, dict(wine), db=db)
+            except Exception as e:
+                app.logger.warning("Re-analysis of wine %d failed: %s", wine_id, e)
+                failed[wine_id] = str(e) or type(e).__name__
+    finally:
+        db.close()
+    job.progress("analyze", len(wine_ids), len(wine_ids))
+    return {"results": results, "failed": failed}
+
+
+def _wines_missing_enrichment(db, include_empty=False, limit=REANALYZE_MAX_WINES):
+    """Ids of wines lacking any of ``ENRICH_FIELDS`` (in stock only by default)."""
+    missing = " OR ".join(f"{c} IS NULL OR {c} = ''" for c in ENRICH_FIELDS)
+    stock = "" if include_empty else "quantity > 0 AND "
+    return [r[0] for r in db.execute(
+        f"SELECT id FROM wines WHERE {stock}({missing}) ORDER BY id LIMIT ?", (limit,)
+    )]
+
+
+def _ai_requests_per_minute(opts):
+    try:
+        return max(0.0, float(opts.get("ai_requests_per_minute", 30)))
+    except (TypeError, ValueError):
+        return 30.0
+
+
+def _enrich_one(opts, wine):
+    """Analysis of one wine on an enrichment pool thread."""
+    provider = opts.get("ai_provider", "none").strip().lower()
+    _ai_rate_limiter.acquire(provider, _ai_requests_per_minute(opts))
+    image_b64, media_type = _load_image_b64(wine["image"])
+    db = _connect()  # the analysis cache needs a connection of this thread
+    try:
+        return _analyze_wine_from_context(opts, image_b64, media_type, dict(wine), db=db)
+    finally:
+        db.close()
+
+
+def _enrich_concurrently(job, wines, opts):
+    """Yield ``(wine, fields, error)`` as the provider calls complete."""
+    with ThreadPoolExecutor(ENRICH_CONCURRENCY, thread_name_prefix="enrich") as pool:
+        futures = {pool.submit(_enrich_one, opts, wine): wine for wine in wines}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, str(e) or type(e).__name__
+
+
+def _enrich_via_message_batches(job, wines, opts):
+    """Yield ``(wine, fields, error)`` from one Anthropic Message Batch.
+
+    The batch API bills half the price and has no per-request rate limit,
+    but answers asynchronously (usually within minutes, at most 24 hours);
+    the job polls it every ``ENRICH_POLL_SECONDS``.
+    """
+    client = _ai_client("anthropic", opts)
+    requests_, by_id = [], {}
+    for wine in wines:
+        image_b64, media_type = _load_image_b64(wine["image"])
+        try:
+            prompt = _context_prompt(image_b64, dict(wine))
+        except ValueError as e:
+            yield wine, None, str(e)
+            continue
+        by_id[str(wine["id"])] = wine
+        requests_.append({
+            "custom_id": str(wine["id"]),
+            "params": _anthropic_params(image_b64, media_type, prompt, opts),
+        })
+    if not requests_:
+        return
+
+    batch = client.messages.batches.create(requests=requests_)
+    while batch.processing_status != "ended":
+        counts = batch.request_counts
+        job.progress("batch", counts.succeeded + counts.errored + counts.canceled + counts.expired,
+                     len(requests_))
+        time.sleep(ENRICH_POLL_SECONDS)
+        batch = client.messages.batches.retrieve(batch.id)
+
+    for entry in client.messages.batches.results(batch.id):
+        wine = by_id.get(entry.custom_id)
+        if wine is None:
+            continue
+        if entry.result.type != "succeeded":
+            yield wine, None, entry.result.type
+            continue
+        try:
+            yield wine, _parse_analysis(entry.result.message.content[0].text), None
+        except json.JSONDecodeError:
+            yield wine, None, "parse_error"
+
+
+def _enrich_job(job, wine_ids, opts, use_batch_api=False):
+    """Fill in the missing ``ENRICH_FIELDS`` of each wine.
+
+    Only empty columns are written (a value entered meanwhile wins), in one
+    transaction per ``ENRICH_WRITE_BATCH`` wines.
+    """
+    db = _connect()
+    updated, failed, pending = [], {}, {}
+
+    def flush():
+        if not pending:
+            return
+        with db:
+            for wine_id, values in pending.items():
+                sets = ", ".join(f"{c} = COALESCE(NULLIF({c}, ''), ?)" for c in values)
+                db.execute(f"UPDATE wines SET {sets} WHERE id = ?", (*values.values(), wine_id))
+        updated.extend(pending)
+        pending.clear()
+
+    try:
+        rows = {r["id"]: r for r in db.execute(
+            f"SELECT * FROM wines WHERE id IN ({','.join('?' * len(wine_ids))})", wine_ids
+        )}
+        wines = [rows[i] for i in wine_ids if i in rows]
+        failed.update({i: "not_found" for i in wine_ids if i not in rows})
+
+        provider = opts.get("ai_provider", "none").strip().lower()
+        if use_batch_api and provider == "anthropic":
+            results = _enrich_via_message_batches(job, wines, opts)
+        else:
+            results = _enrich_concurrently(job, wines, opts)
+
+        job.progress("enrich", 0, len(wines))
+        for done, (wine, fields, error) in enumerate(results, start=1):
+            if error:
+                app.logger.warning("Enrichment of wine %d failed: %s", wine["id"], error)
+                failed[wine["id"]] = error
+            else:
+                values = {c: json.dumps(fields[c]) for c in ENRICH_FIELDS
+                          if fields.get(c) and not wine[c]}
+                if values:
+                    pending[wine["id"]] = values
+                if len(pending) >= ENRICH_WRITE_BATCH:
+                    flush()
+            job.progress("enrich", done, len(wines))
+        flush()
+    finally:
+        db.close()
+    return {"updated": updated, "failed": failed, "total": len(wine_ids)}
+
+
+@app.route("/api/jobs/<job_id>")
+def api_job_status(job_id):
+    """Status and progress of a background job."""
+    job = jobs.get(_jobs_db(), job_id)
+    if job is None:
+        return jsonify(ok=False, error="not_found"), 404
+    return jsonify(ok=True, job=job)
+
+
+@app.route("/api/jobs/export", methods=["POST"])
+def api_job_export():
+    """Build the backup archive in the background; fetch it via /download."""
+    return jsonify(ok=True, job_id=_jobs.submit(_jobs_db(), "export", _export_job)), 202
+
+
+@app.route("/api/jobs/<job_id>/download")
+def api_job_download(job_id):
+    """Download the archive of a finished export job."""
+    job = jobs.get(_jobs_db(), job_id)
+    if job is None or job["kind"] != "export":
+        return jsonify(ok=False, error="not_found"), 404
+    if job["status"] != "done":
+        return jsonify(ok=False, error="not_ready", status=job["status"]), 409
+    if not os.path.isfile(os.path.join(_job_export_dir(), f"{job_id}.zip")):
+        return jsonify(ok=False, error="expired"), 410
+    return send_from_directory(
+        _job_export_dir(), f"{job_id}.zip",
+        as_attachment=True, download_name=job["result"]["filename"], mimetype="application/zip",
+    )
+
+
+@app.route("/api/jobs/reanalyze", methods=["POST"])
+def api_job_reanalyze():
+    """Re-analyze several wines in the background.
+
+    The job result maps wine ids to the suggested fields; nothing is saved.
+    """
+    opts = load_options()
+    if opts.get("ai_provider", "none").strip().lower() == "none" or not _is_ai_configured(opts):
+        return jsonify(ok=False, error="no_api_key"), 400
+
+    body = request.get_json(silent=True) or {}
+    wine_ids = body.get("wine_ids")
+    if (not isinstance(wine_ids, list) or not wine_ids or len(wine_ids) > REANALYZE_MAX_WINES
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in wine_ids)):
+        return jsonify(ok=False, error="invalid_wine_ids"), 400
+
+    job_id = _jobs.submit(_jobs_db(), "reanalyze", _reanalyze_job, list(dict.fromkeys(wine_ids)), opts)
+    return jsonify(ok=True, job_id=job_id), 202
+
+
+@app.route("/api/jobs/enrich", methods=["POST"])
+def api_job_enrich():
+    """Fill in maturity data, taste profile and food pairings in bulk.
+
+    Optional JSON body: ``wine_ids`` (default: every in-stock wine missing
+    one of them, or every wine with ``include_empty``) and ``batch_api``
+    (Anthropic only: use the asynchronous Message Batches API).
+    """
+    opts = load_options()
+    if opts.get("ai_provider", "none").strip().lower() == "none" or not _is_ai_configured(opts):
+        return jsonify(ok=False, error="no_api_key"), 400
+
+    body = request.get_json(silent=True) or {}
+    wine_ids = body.get("wine_ids")
+    if wine_ids is None:
+        wine_ids = _wines_missing_enrichment(get_db(), include_empty=bool(body.get("include_empty")))
+        if not wine_ids:
+            return jsonify(ok=True, job_id=None, total=0)
+    elif (not isinstance(wine_ids, list) or not wine_ids or len(wine_ids) > REANALYZE_MAX_WINES
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in wine_ids)):
+        return jsonify(ok=False, error="invalid_wine_ids"), 400
+
+    wine_ids = list(dict.fromkeys(wine_ids))
+    job_id = _jobs.submit(_jobs_db(), "enrich", _enrich_job, wine_ids, opts,
+                          use_batch_api=bool(body.get("batch_api")))
+    return jsonify(ok=True, job_id=job_id, total=len(wine_ids)), 202
+
+
+def _is_upload_name(filename):
+    # Only serve flat file names with an allowed extension
+    if not filename or "/" in filename or "\\" in filename:
+        return False
+    parts = filename.rsplit(".", 1)
+    return len(parts) == 2 and parts[1].lower() in ALLOWED_EXT
+
+
+def _image_cache_dir():
+    return os.path.join(DATA_DIR, "image_cache")
+
+
+@app.route("/uploads/<filename>")
+def uploaded_file(filename):
+    if not _is_upload_name(filename):
+        return "Not found", 404
+    return send_from_directory(UPLOAD_DIR, filename)
+
+
+@app.route("/api/images/<filename>")
+def api_image_status(filename):
+    """Whether an upload is ready or still being downscaled."""
+    if not _is_upload_name(filename) or not os.path.isfile(os.path.join(UPLOAD_DIR, filename)):
+        return jsonify(ok=False, error="not_found"), 404
+    return jsonify(ok=True, pending=image_pending(filename))
+
+
+@app.route("/uploads/<size>/<filename>")
+def uploaded_variant(size, filename):
+    """A downscaled copy of an upload (``thumb`` or ``modal``), made on first use.
+
+    WebP is served to browsers that accept it, JPEG otherwise. If the
+    variant cannot be generated the original file is served instead.
+    """
+    if size not in image_variants.SIZES or not _is_upload_name(filename):
+        return "Not found", 404
+    # Only an explicit image/webp counts; "image/*" is sent by browsers without WebP too
+    fmt = "webp" if any(v == "image/webp" and q > 0 for v, q in request.accept_mimetypes) else "jpg"
+    try:
+        path = image_variants.get_variant(UPLOAD_DIR, _image_cache_dir(), filename, size, fmt)
+    except Exception as e:
+        app.logger.warning("Image variant %s of %s failed: %s", size, filename, e)
+        g.variant_fallback = True
+        return send_from_directory(UPLOAD_DIR, filename)
+    if path is None:
+        return "Not found", 404
+    resp = send_from_directory(
+        _image_cache_dir(), os.path.basename(path), mimetype=image_variants.FORMATS[fmt][1]
+    )
+    resp.vary.add("Accept")
+    return resp
+
+
+# ── AI Provider Functions ─────────────────────────────────────────────────────
+
+# Provider → (SDK, option holding the API key, base URL). Each provider has a
+# pair of call functions, _call_<name> (single prompt) and _call_chat_<name>.
+AI_PROVIDERS = {
+    "anthropic": ("anthropic", "anthropic_api_key", None),
+    "openai": ("openai", "openai_api_key", None),
+    "openrouter": ("openai", "openrouter_api_key", "https://openrouter.ai/api/v1"),
+    "ollama": ("http", None, None),
+    "minimax": ("openai", "minimax_api_key", "https://api.minimaxi.chat/v1"),
+    "mistral": ("openai", "mistral_api_key", "https://api.mistral.ai/v1"),
+}
+
+# Model used when the ``<provider>_model`` option is empty
+AI_DEFAULT_MODELS = {
+    "anthropic": "claude-opus-4-6",
+    "openai": "gpt-5.2",
+    "openrouter": "anthropic/claude-opus-4.6",
+    "ollama": "llava",
+    "minimax": "MiniMax-Text-01",
+    "mistral": "pixtral-large-latest",
+}
+
+_ai_clients = ai_clients.ClientRegistry()
+
+
+def _ai_model(provider, opts):
+    """The model actually sent to ``provider``."""
+    return opts.get(f"{provider}_model", "").strip() or AI_DEFAULT_MODELS[provider]
+
+
+def _ai_client(provider, opts):
+    """Shared keep-alive client for a provider, rebuilt when its key changes."""
+    sdk, key_option, base_url = AI_PROVIDERS[provider]
+    api_key = opts.get(key_option, "").strip() if key_option else None
+    return _ai_clients.get(provider, sdk, api_key, base_url)
+
 
-    matches = match_wines(parsed["wines"], get_db())
+def _provider_call(provider, chat=False, stream=False):
+    """The call function of a provider, or None if the provider is unknown.
 
-    _cleanup_import_tmp()
-    token = secrets.token_urlsafe(16)
-    ext = "zip" if parsed["source"] == "zip" else "csv"
-    token_path = os.path.join(IMPORT_TMP_DIR, f"{token}.{ext}")
-    with open(token_path, "wb") as out:
-        out.write(raw)
+    ``_call_<name>`` by default, ``_call_chat_<name>`` with ``chat`` and the
+    generator ``_stream_chat_<name>`` with ``stream``. Looked up by name on
+    every call so a patched function is picked up.
+    """
+    if provider not in AI_PROVIDERS:
+        return None
+    if stream:
+        return globals()[f"_stream_chat_{provider}"]
+    return globals()[f"_call_chat_{provider}" if chat else f"_call_{provider}"]
 
-    # Build preview: split into new vs. duplicates with a compact label
-    new_items = []
-    duplicates = []
-    for w, m in zip(parsed["wines"], matches):
-        label = w.get("name") or "?"
-        if w.get("year"):
-            label += f" ({w['year']})"
-        if m["matched"]:
-            duplicates.append({
-                "label": label,
-                "existing_id": m["existing_id"],
-                "existing_name": m["existing"]["name"] if m["existing"] else None,
-            })
-        else:
-            new_items.append({"label": label})
 
-    return jsonify({
-        "ok": True,
-        "token": token,
-        "source": parsed["source"],
-        "schema_version": parsed["schema_version"],
-        "counts": {
-            "total": len(parsed["wines"]),
-            "new": len(new_items),
-            "duplicates": len(duplicates),
-            "images": len(parsed.get("images") or {}),
-        },
-        "new": new_items[:500],  # cap for payload size
-        "duplicates": duplicates[:500],
-    })
+# Deadline per operation in seconds, retries included. Each provider of the
+# fallback chain gets the full deadline.
+AI_DEADLINES = {"scan": 90, "chat": 120}
 
+_ai_breaker = ai_resilience.CircuitBreaker()
 
-@app.route("/import/commit", methods=["POST"])
-def import_commit():
-    """Apply a previously previewed import given its token + strategy."""
-    if AUTH_ENABLED and session.get("role") == "readonly":
-        return jsonify({"ok": False, "error": "forbidden"}), 403
 
-    payload = request.get_json(silent=True) or {}
-    token = (payload.get("token") or "").strip()
-    strategy = (payload.get("strategy") or "skip").strip()
+def _ai_provider_chain(provider, opts):
+    """``provider``, then ``ai_fallback_provider`` if that one is set up."""
+    chain = [provider]
+    fallback = str(opts.get("ai_fallback_provider", "none")).strip().lower()
+    if (fallback in AI_PROVIDERS and fallback != provider
+            and _is_ai_configured({**opts, "ai_provider": fallback})):
+        chain.append(fallback)
+    return chain
 
-    # Token must be a bare identifier — no path traversal.
-    if not token or "/" in token or "\\" in token or ".." in token:
-        return jsonify({"ok": False, "error": "Ungültiger Token"}), 400
-    if strategy not in ("skip", "overwrite"):
-        return jsonify({"ok": False, "error": "Ungültige Strategie"}), 400
 
-    path = None
-    for ext in ("zip", "csv"):
-        candidate = os.path.join(IMPORT_TMP_DIR, f"{token}.{ext}")
-        if os.path.isfile(candidate):
-            path = candidate
-            break
-    if not path:
-        return jsonify({"ok": False, "error": "Import-Datei abgelaufen — bitte erneut hochladen"}), 404
+def _ai_execute(operation, provider, opts, fn):
+    """``fn(name)`` under the deadline, retry and circuit breaker policy.
 
-    with open(path, "rb") as fh:
-        raw = fh.read()
+    When ``provider`` is down (or its circuit is open) the fallback
+    provider is tried. Returns ``(result, provider that answered)``.
+    """
+    chain = _ai_provider_chain(provider, opts)
+    for i, name in enumerate(chain):
+        try:
+            return ai_resilience.call(
+                name, lambda: fn(name), timeout=AI_DEADLINES[operation], breaker=_ai_breaker,
+            ), name
+        except ai_resilience.ProviderError as e:
+            if i + 1 == len(chain):
+                raise
+            app.logger.warning("AI provider %s failed (%s), falling back to %s", name, e.kind, chain[i + 1])
 
-    try:
-        parsed = parse_import_file(raw, filename=os.path.basename(path))
-    except WineImportError as e:
-        return jsonify({"ok": False, "error": str(e)}), 400
 
-    db = get_db()
-    matches = match_wines(parsed["wines"], db)
-    result = apply_import(parsed, matches, db, UPLOAD_DIR, strategy=strategy)
+def _ai_error_code(e):
+    """API error code for a failed provider call: ``timeout`` or ``api_error``."""
+    return "timeout" if ai_resilience.classify(e) == "timeout" else "api_error"
 
-    # Clean up the token file now that we're done
-    try:
-        os.remove(path)
-    except OSError:
-        pass
 
-    return jsonify({"ok": True, **result})
+class _SystemPrompt(str):
+    """System prompt text that knows where its stable, cacheable prefix ends.
 
+    Behaves like the plain string for every provider; only the Anthropic
+    calls use ``stable_len`` to place a cache breakpoint.
+    """
 
-@app.route("/uploads/<filename>")
-def uploaded_file(filename):
-    # Only serve files matching our naming pattern (uuid hex + allowed extension)
-    if not filename or "/" in filename or "\\" in filename:
-        return "Not found", 404
-    parts = filename.rsplit(".", 1)
-    if len(parts) != 2 or parts[1].lower() not in ALLOWED_EXT:
-        return "Not found", 404
-    return send_from_directory(UPLOAD_DIR, filename)
+    def __new__(cls, text, stable_len=None):
+        obj = super().__new__(cls, text)
+        obj.stable_len = len(text) if stable_len is None else stable_len
+        return obj
 
 
-# ── AI Provider Functions ─────────────────────────────────────────────────────
+def _anthropic_system(system_prompt):
+    """System prompt as text blocks, cached up to the end of its stable prefix.
 
-def _call_anthropic(image_b64, media_type, prompt, opts):
-    """Call Anthropic Claude API (vision or text-only)."""
-    import anthropic
-    api_key = opts.get("anthropic_api_key", "").strip()
-    model = opts.get("anthropic_model", "claude-opus-4-6").strip() or "claude-opus-4-6"
-    client = anthropic.Anthropic(api_key=api_key)
+    Prompts below the model's minimum cacheable length are simply not cached.
+    """
+    cut = getattr(system_prompt, "stable_len", len(system_prompt))
+    blocks = [{"type": "text", "text": system_prompt[:cut], "cache_control": {"type": "ephemeral"}}]
+    if system_prompt[cut:].strip():
+        blocks.append({"type": "text", "text": system_prompt[cut:].strip()})
+    return blocks
+
+
+def _anthropic_messages(messages, image_b64=None, media_type=None):
+    """Chat messages with the image attached and a cache breakpoint on the
+    last turn, so the next turn of the conversation can reuse the history."""
+    messages = _with_chat_image(messages, image_b64, media_type, "anthropic")
+    if not messages:
+        return messages
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = content[:-1] + [{**content[-1], "cache_control": {"type": "ephemeral"}}]
+    return messages[:-1] + [{**last, "content": content}]
+
+
+def _anthropic_params(image_b64, media_type, prompt, opts):
+    """Messages API parameters for a single-prompt request (also used in batches)."""
+    model = _ai_model("anthropic", opts)
     content = []
     if image_b64:
         content.append({"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_b64}})
     content.append({"type": "text", "text": prompt})
-    message = client.messages.create(
-        model=model,
-        max_tokens=1024,
-        messages=[{"role": "user", "content": content}],
-    )
+    return {"model": model, "max_tokens": 1024, "messages": [{"role": "user", "content": content}]}
+
+
+def _call_anthropic(image_b64, media_type, prompt, opts):
+    """Call Anthropic Claude API (vision or text-only)."""
+    client = _ai_client("anthropic", opts)
+    message = client.messages.create(**_anthropic_params(image_b64, media_type, prompt, opts),
+                                     timeout=ai_resilience.remaining())
     return message.content[0].text
 
 
 def _call_openai(image_b64, media_type, prompt, opts):
     """Call OpenAI API (vision or text-only)."""
-    from openai import OpenAI
-    api_key = opts.get("openai_api_key", "").strip()
-    model = opts.get("openai_model", "gpt-5.2").strip() or "gpt-5.2"
-    client = OpenAI(api_key=api_key)
+    model = _ai_model("openai", opts)
+    client = _ai_client("openai", opts)
     content = []
     if image_b64:
         content.append({"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{image_b64}"}})
@@ -1477,19 +2656,15 @@ def _call_openai(image_b64, media_type, prompt, opts):
         model=model,
         messages=[{"role": "user", "content": content}],
         max_completion_tokens=1024,
+        timeout=ai_resilience.remaining(),
     )
     return response.choices[0].message.content
 
 
 def _call_openrouter(image_b64, media_type, prompt, opts):
     """Call OpenRouter API (OpenAI-compatible with custom base_url)."""
-    from openai import OpenAI
-    api_key = opts.get("openrouter_api_key", "").strip()
-    model = opts.get("openrouter_model", "anthropic/claude-opus-4.6").strip() or "anthropic/claude-opus-4.6"
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://openrouter.ai/api/v1",
-    )
+    model = _ai_model("openrouter", opts)
+    client = _ai_client("openrouter", opts)
     content = []
     if image_b64:
         content.append({"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{image_b64}"}})
@@ -1498,22 +2673,22 @@ def _call_openrouter(image_b64, media_type, prompt, opts):
         model=model,
         messages=[{"role": "user", "content": content}],
         max_completion_tokens=1024,
+        timeout=ai_resilience.remaining(),
     )
     return response.choices[0].message.content
 
 
 def _call_ollama(image_b64, media_type, prompt, opts):
     """Call local Ollama API (vision or text-only)."""
-    import requests as req
     host = opts.get("ollama_host", "http://localhost:11434").strip().rstrip("/")
-    model = opts.get("ollama_model", "llava").strip() or "llava"
+    model = _ai_model("ollama", opts)
     msg = {"role": "user", "content": prompt}
     if image_b64:
         msg["images"] = [image_b64]
-    response = req.post(
+    response = _ai_client("ollama", opts).post(
         f"{host}/api/chat",
         json={"model": model, "messages": [msg], "stream": False},
-        timeout=120,
+        timeout=ai_resilience.remaining(),
     )
     response.raise_for_status()
     return response.json()["message"]["content"]
@@ -1521,10 +2696,8 @@ def _call_ollama(image_b64, media_type, prompt, opts):
 
 def _call_minimax(image_b64, media_type, prompt, opts):
     """Call MiniMax API (OpenAI-compatible, vision or text-only)."""
-    from openai import OpenAI
-    api_key = opts.get("minimax_api_key", "").strip()
-    model = opts.get("minimax_model", "MiniMax-Text-01").strip() or "MiniMax-Text-01"
-    client = OpenAI(api_key=api_key, base_url="https://api.minimaxi.chat/v1")
+    model = _ai_model("minimax", opts)
+    client = _ai_client("minimax", opts)
     content = []
     if image_b64:
         content.append({"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{image_b64}"}})
@@ -1533,16 +2706,15 @@ def _call_minimax(image_b64, media_type, prompt, opts):
         model=model,
         messages=[{"role": "user", "content": content}],
         max_tokens=1024,
+        timeout=ai_resilience.remaining(),
     )
     return response.choices[0].message.content
 
 
 def _call_mistral(image_b64, media_type, prompt, opts):
     """Call Mistral AI API (OpenAI-compatible, vision via Pixtral models)."""
-    from openai import OpenAI
-    api_key = opts.get("mistral_api_key", "").strip()
-    model = opts.get("mistral_model", "pixtral-large-latest").strip() or "pixtral-large-latest"
-    client = OpenAI(api_key=api_key, base_url="https://api.mistral.ai/v1")
+    model = _ai_model("mistral", opts)
+    client = _ai_client("mistral", opts)
     content = []
     if image_b64:
         content.append({"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{image_b64}"}})
@@ -1551,6 +2723,7 @@ def _call_mistral(image_b64, media_type, prompt, opts):
         model=model,
         messages=[{"role": "user", "content": content}],
         max_tokens=1024,
+        timeout=ai_resilience.remaining(),
     )
     return response.choices[0].message.content
 
@@ -1559,33 +2732,21 @@ def _call_mistral(image_b64, media_type, prompt, opts):
 
 def _call_chat_anthropic(messages, system_prompt, opts, image_b64=None, media_type=None):
     """Chat via Anthropic Claude (multi-turn, with optional image)."""
-    import anthropic
-    api_key = opts.get("anthropic_api_key", "").strip()
-    model = opts.get("anthropic_model", "claude-opus-4-6").strip() or "claude-opus-4-6"
-    client = anthropic.Anthropic(api_key=api_key)
-    # Attach image to the last user message if provided
-    if image_b64 and messages:
-        last = messages[-1]
-        if last["role"] == "user":
-            messages = messages[:-1] + [{"role": "user", "content": [
-                {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_b64}},
-                {"type": "text", "text": last["content"]},
-            ]}]
+    model = _ai_model("anthropic", opts)
+    client = _ai_client("anthropic", opts)
     message = client.messages.create(
         model=model,
         max_tokens=2048,
-        system=system_prompt,
-        messages=messages,
+        system=_anthropic_system(system_prompt),
+        messages=_anthropic_messages(messages, image_b64, media_type),
     )
     return message.content[0].text
 
 
 def _call_chat_openai(messages, system_prompt, opts, image_b64=None, media_type=None):
     """Chat via OpenAI (multi-turn, with optional image)."""
-    from openai import OpenAI
-    api_key = opts.get("openai_api_key", "").strip()
-    model = opts.get("openai_model", "gpt-5.2").strip() or "gpt-5.2"
-    client = OpenAI(api_key=api_key)
+    model = _ai_model("openai", opts)
+    client = _ai_client("openai", opts)
     if image_b64 and messages:
         last = messages[-1]
         if last["role"] == "user":
@@ -1598,19 +2759,15 @@ def _call_chat_openai(messages, system_prompt, opts, image_b64=None, media_type=
         model=model,
         messages=full_messages,
         max_completion_tokens=2048,
+        timeout=ai_resilience.remaining(),
     )
     return response.choices[0].message.content
 
 
 def _call_chat_openrouter(messages, system_prompt, opts, image_b64=None, media_type=None):
     """Chat via OpenRouter (multi-turn, with optional image)."""
-    from openai import OpenAI
-    api_key = opts.get("openrouter_api_key", "").strip()
-    model = opts.get("openrouter_model", "anthropic/claude-opus-4.6").strip() or "anthropic/claude-opus-4.6"
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://openrouter.ai/api/v1",
-    )
+    model = _ai_model("openrouter", opts)
+    client = _ai_client("openrouter", opts)
     if image_b64 and messages:
         last = messages[-1]
         if last["role"] == "user":
@@ -1623,24 +2780,24 @@ def _call_chat_openrouter(messages, system_prompt, opts, image_b64=None, media_t
         model=model,
         messages=full_messages,
         max_completion_tokens=2048,
+        timeout=ai_resilience.remaining(),
     )
     return response.choices[0].message.content
 
 
 def _call_chat_ollama(messages, system_prompt, opts, image_b64=None, media_type=None):
     """Chat via local Ollama (multi-turn, with optional image)."""
-    import requests as req
     host = opts.get("ollama_host", "http://localhost:11434").strip().rstrip("/")
-    model = opts.get("ollama_model", "llava").strip() or "llava"
+    model = _ai_model("ollama", opts)
     if image_b64 and messages:
         last = messages[-1]
         if last["role"] == "user":
             messages = messages[:-1] + [{"role": "user", "content": last["content"], "images": [image_b64]}]
     full_messages = [{"role": "system", "content": system_prompt}] + messages
-    response = req.post(
+    response = _ai_client("ollama", opts).post(
         f"{host}/api/chat",
         json={"model": model, "messages": full_messages, "stream": False},
-        timeout=120,
+        timeout=ai_resilience.remaining(),
     )
     response.raise_for_status()
     return response.json()["message"]["content"]
@@ -1648,10 +2805,8 @@ def _call_chat_ollama(messages, system_prompt, opts, image_b64=None, media_type=
 
 def _call_chat_minimax(messages, system_prompt, opts, image_b64=None, media_type=None):
     """Chat via MiniMax (OpenAI-compatible, multi-turn, with optional image)."""
-    from openai import OpenAI
-    api_key = opts.get("minimax_api_key", "").strip()
-    model = opts.get("minimax_model", "MiniMax-Text-01").strip() or "MiniMax-Text-01"
-    client = OpenAI(api_key=api_key, base_url="https://api.minimaxi.chat/v1")
+    model = _ai_model("minimax", opts)
+    client = _ai_client("minimax", opts)
     if image_b64 and messages:
         last = messages[-1]
         if last["role"] == "user":
@@ -1664,16 +2819,15 @@ def _call_chat_minimax(messages, system_prompt, opts, image_b64=None, media_type
         model=model,
         messages=full_messages,
         max_tokens=2048,
+        timeout=ai_resilience.remaining(),
     )
     return response.choices[0].message.content
 
 
 def _call_chat_mistral(messages, system_prompt, opts, image_b64=None, media_type=None):
     """Chat via Mistral AI (OpenAI-compatible, multi-turn, with optional image)."""
-    from openai import OpenAI
-    api_key = opts.get("mistral_api_key", "").strip()
-    model = opts.get("mistral_model", "pixtral-large-latest").strip() or "pixtral-large-latest"
-    client = OpenAI(api_key=api_key, base_url="https://api.mistral.ai/v1")
+    model = _ai_model("mistral", opts)
+    client = _ai_client("mistral", opts)
     if image_b64 and messages:
         last = messages[-1]
         if last["role"] == "user":
@@ -1686,62 +2840,217 @@ def _call_chat_mistral(messages, system_prompt, opts, image_b64=None, media_type
         model=model,
         messages=full_messages,
         max_tokens=2048,
+        timeout=ai_resilience.remaining(),
     )
     return response.choices[0].message.content
 
 
 def _call_chat(provider, messages, system_prompt, opts, image_b64=None, media_type=None):
-    """Dispatch chat to the configured AI provider."""
-    dispatch = {
-        "anthropic": _call_chat_anthropic,
-        "openai": _call_chat_openai,
-        "openrouter": _call_chat_openrouter,
-        "ollama": _call_chat_ollama,
-        "minimax": _call_chat_minimax,
-        "mistral": _call_chat_mistral,
-    }
-    fn = dispatch.get(provider)
-    if not fn:
+    """Dispatch chat to the configured AI provider (or its fallback)."""
+    if not _provider_call(provider, chat=True):
+        raise ValueError(f"Unknown chat provider: {provider}")
+    return _ai_execute("chat", provider, opts, lambda name: _provider_call(name, chat=True)(
+        messages, system_prompt, opts, image_b64=image_b64, media_type=media_type,
+    ))[0]
+
+
+# ── AI Chat Streaming ─────────────────────────────────────────────────────────
+# Generators yielding the reply text piece by piece as the provider sends it.
+
+def _with_chat_image(messages, image_b64, media_type, sdk):
+    """Attach an image to the last user message in the format of ``sdk``."""
+    if not image_b64 or not messages or messages[-1]["role"] != "user":
+        return messages
+    text = messages[-1]["content"]
+    if sdk == "anthropic":
+        content = [
+            {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": image_b64}},
+            {"type": "text", "text": text},
+        ]
+    elif sdk == "http":
+        return messages[:-1] + [{"role": "user", "content": text, "images": [image_b64]}]
+    else:
+        content = [
+            {"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{image_b64}"}},
+            {"type": "text", "text": text},
+        ]
+    return messages[:-1] + [{"role": "user", "content": content}]
+
+
+def _stream_chat_anthropic(messages, system_prompt, opts, image_b64=None, media_type=None):
+    """Stream a chat reply from Anthropic Claude."""
+    model = _ai_model("anthropic", opts)
+    client = _ai_client("anthropic", opts)
+    with client.messages.stream(
+        model=model,
+        max_tokens=2048,
+        system=_anthropic_system(system_prompt),
+        messages=_anthropic_messages(messages, image_b64, media_type),
+        timeout=ai_resilience.remaining(),
+    ) as stream:
+        yield from stream.text_stream
+
+
+def _stream_openai_compatible(provider, model, token_param, messages, system_prompt, opts,
+                              image_b64, media_type):
+    client = _ai_client(provider, opts)
+    full_messages = [{"role": "system", "content": system_prompt}] + \
+        _with_chat_image(messages, image_b64, media_type, "openai")
+    stream = client.chat.completions.create(
+        model=model, messages=full_messages, stream=True, **{token_param: 2048},
+        timeout=ai_resilience.remaining(),
+    )
+    try:
+        for chunk in stream:
+            # Some gateways (OpenRouter) send keep-alive / usage chunks without choices
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
+
+def _stream_chat_openai(messages, system_prompt, opts, image_b64=None, media_type=None):
+    """Stream a chat reply from OpenAI."""
+    model = _ai_model("openai", opts)
+    return _stream_openai_compatible("openai", model, "max_completion_tokens",
+                                     messages, system_prompt, opts, image_b64, media_type)
+
+
+def _stream_chat_openrouter(messages, system_prompt, opts, image_b64=None, media_type=None):
+    """Stream a chat reply from OpenRouter."""
+    model = _ai_model("openrouter", opts)
+    return _stream_openai_compatible("openrouter", model, "max_completion_tokens",
+                                     messages, system_prompt, opts, image_b64, media_type)
+
+
+def _stream_chat_minimax(messages, system_prompt, opts, image_b64=None, media_type=None):
+    """Stream a chat reply from MiniMax."""
+    model = _ai_model("minimax", opts)
+    return _stream_openai_compatible("minimax", model, "max_tokens",
+                                     messages, system_prompt, opts, image_b64, media_type)
+
+
+def _stream_chat_mistral(messages, system_prompt, opts, image_b64=None, media_type=None):
+    """Stream a chat reply from Mistral AI."""
+    model = _ai_model("mistral", opts)
+    return _stream_openai_compatible("mistral", model, "max_tokens",
+                                     messages, system_prompt, opts, image_b64, media_type)
+
+
+def _stream_chat_ollama(messages, system_prompt, opts, image_b64=None, media_type=None):
+    """Stream a chat reply from a local Ollama (newline-delimited JSON)."""
+    host = opts.get("ollama_host", "http://localhost:11434").strip().rstrip("/")
+    model = _ai_model("ollama", opts)
+    full_messages = [{"role": "system", "content": system_prompt}] + \
+        _with_chat_image(messages, image_b64, media_type, "http")
+    response = _ai_client("ollama", opts).post(
+        f"{host}/api/chat",
+        json={"model": model, "messages": full_messages, "stream": True},
+        stream=True,
+        timeout=ai_resilience.remaining(),
+    )
+    with response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            part = json.loads(line)
+            if part.get("error"):
+                raise RuntimeError(part["error"])
+            text = (part.get("message") or {}).get("content")
+            if text:
+                yield text
+            if part.get("done"):
+                break
+
+
+def _stream_chat(provider, messages, system_prompt, opts, image_b64=None, media_type=None):
+    """Stream chat from the configured AI provider (yields text pieces).
+
+    Falls back to the next provider only while nothing has been sent yet.
+    """
+    if not _provider_call(provider, stream=True):
         raise ValueError(f"Unknown chat provider: {provider}")
-    return fn(messages, system_prompt, opts, image_b64=image_b64, media_type=media_type)
+    return _stream_chat_chain(_ai_provider_chain(provider, opts), messages, system_prompt, opts,
+                              image_b64, media_type)
+
+
+def _stream_chat_chain(chain, messages, system_prompt, opts, image_b64, media_type):
+    for i, name in enumerate(chain):
+        started = False
+        try:
+            for piece in ai_resilience.stream(
+                name,
+                lambda: _provider_call(name, stream=True)(
+                    messages, system_prompt, opts, image_b64=image_b64, media_type=media_type,
+                ),
+                timeout=AI_DEADLINES["chat"], breaker=_ai_breaker,
+            ):
+                started = True
+                yield piece
+            return
+        except ai_resilience.ProviderError as e:
+            if started or i + 1 == len(chain):
+                raise
+            app.logger.warning("AI provider %s failed (%s), falling back to %s", name, e.kind, chain[i + 1])
+
+
+_cellar_context = cellar_context.CellarContext()
+
+# Wines listed per chat turn in retrieval mode (large cellars)
+CHAT_RETRIEVAL_TOP_K = 40
 
 
 def _build_wine_cellar_context():
-    """Fetch all in-stock wines and format as structured text for the AI system prompt."""
+    """In-stock wines formatted for the AI system prompt: ``(text, count)``.
 
+    Served from ``_cellar_context`` until the next write to ``wines``.
+    """
     labels = WINE_LABELS.get(LANG, WINE_LABELS['en'])
     db = get_db()
-    wines = db.execute(
-        "SELECT * FROM wines WHERE quantity > 0 ORDER BY type, name, year"
-    ).fetchall()
-    if not wines:
-        return "", 0
-    lines = []
-    for w in wines:
-        w = dict(w)
-        parts = [f"- [ID:{w['id']}] {w['name']}"]
-        if w.get("year"):
-            parts.append(f"{labels['vintage']} {w['year']}")
-        if w.get("type"):
-            parts.append(f"{labels['type']}: {w['type']}")
-        if w.get("region"):
-            parts.append(f"{labels['region']}: {w['region']}")
-        if w.get("grape"):
-            parts.append(f"{labels['grape']}: {w['grape']}")
-        if w.get("quantity"):
-            parts.append(f"{labels['quantity']}: {w['quantity']} {labels['bottles']}")
-        if w.get("rating"):
-            parts.append(f"{labels['rating']}: {w['rating']}/5")
-        if w.get("location"):
-            parts.append(f"{labels['location']}: {w['location']}")
-        if w.get("drink_from") or w.get("drink_until"):
-            parts.append(
-                f"{labels['drink_window']}: {w.get('drink_from', '?')}-{w.get('drink_until', '?')}"
-            )
-        if w.get("notes"):
-            parts.append(f"{labels['notes']}: {w['notes']}")
-        lines.append(" | ".join(parts))
-    return "\n".join(lines), len(wines)
+    return _cellar_context.get(db, DB_PATH, cellar_revision(db), LANG, labels)
+
+
+def _chat_cellar_prompt(db, opts, message, history):
+    """Cellar part of the chat system prompt as ``(stable, this_turn)``.
+
+    Up to ``chat_retrieval_threshold`` in-stock wines (0 = no limit) all
+    of them are listed. Larger cellars get an overview plus the wines
+    relevant to this turn (see ``cellar_retrieval``); only the overview
+    belongs to the cacheable prefix.
+    """
+    try:
+        threshold = max(0, int(opts.get("chat_retrieval_threshold", 200)))
+    except (TypeError, ValueError):
+        threshold = 200
+    in_stock = cellar_stats.totals(db)["in_stock_wines"]
+    if not threshold or in_stock <= threshold:
+        cellar_text, wine_count = _build_wine_cellar_context()
+        return (
+            f"\n\nThe user's wine cellar currently contains {wine_count} wines (only in-stock bottles):\n"
+            f"{cellar_text if cellar_text else '(The cellar is currently empty.)'}"
+        ), ""
+
+    ids = cellar_retrieval.relevant_ids(
+        db, message, [m["content"] for m in history], k=CHAT_RETRIEVAL_TOP_K, weights=_FTS_WEIGHTS,
+    )
+    labels = WINE_LABELS.get(LANG, WINE_LABELS['en'])
+    rows = {r["id"]: dict(r) for r in db.execute(
+        f"SELECT {', '.join(cellar_context.COLUMNS)} FROM wines WHERE id IN ({','.join('?' * len(ids))})",
+        ids,
+    )} if ids else {}
+    lines = "\n".join(cellar_context.format_wine(rows[i], labels) for i in ids if i in rows)
+    stable = (
+        f"\n\nThe user's wine cellar currently contains {in_stock} wines (only in-stock bottles), "
+        f"too many to list here. Overview:\n{cellar_retrieval.summary(db)}"
+    )
+    this_turn = (
+        f"\n\nThe {len(rows)} wines from the cellar that best match this conversation "
+        f"(picked by a search, not the complete cellar):\n{lines}\n"
+        f"If the user asks about a wine that is not listed, ask for its name, producer or region – "
+        f"matching wines will be listed with the next message."
+    )
+    return stable, this_turn
 
 # ── AI Wine Label Analysis ───────────────────────────────────────────────────
 
@@ -1765,7 +3074,8 @@ def analyze_wine():
     if not image_filename:
         return jsonify({"ok": False, "error": "no_image"}), 400
 
-    # Read saved file as base64
+    # Read saved file as base64 (the provider gets the downscaled version)
+    wait_for_image(image_filename)
     image_path = os.path.join(UPLOAD_DIR, image_filename)
     with open(image_path, "rb") as f:
         image_data = base64.standard_b64encode(f.read()).decode("utf-8")
@@ -1819,45 +3129,22 @@ Rules:
 - The "notes" and "food_pairings" fields MUST be written in {lang_name}
 - Return ONLY the JSON object, no markdown, no explanation"""
 
-    # Dispatch to the selected provider
+    # Dispatch to the selected provider (or answer from the analysis cache)
     try:
-        dispatch = {
-            "anthropic": _call_anthropic,
-            "openai": _call_openai,
-            "openrouter": _call_openrouter,
-            "ollama": _call_ollama,
-            "minimax": _call_minimax,
-            "mistral": _call_mistral,
-        }
-        call_fn = dispatch.get(provider)
-        if not call_fn:
-            return jsonify({"ok": False, "error": "invalid_provider", "image_filename": image_filename}), 400
-
-        raw = call_fn(image_data, media_type, prompt, opts).strip()
-
-        # Strip markdown fences if present
-        if raw.startswith("```"):
-            raw = raw.split("\n", 1)[-1]
-            if raw.endswith("```"):
-                raw = raw[:-3].strip()
-
-        fields = json.loads(raw)
-
-        # Validate wine_type
-        if fields.get("wine_type") and fields["wine_type"] not in WINE_TYPES:
-            fields["wine_type"] = ""
-
-        return jsonify({"ok": True, "fields": fields, "image_filename": image_filename})
+        fields, cached = _run_analysis(opts, image_data, media_type, prompt,
+                                       refresh=request.form.get("refresh") == "1")
+        return jsonify({"ok": True, "fields": fields, "image_filename": image_filename, "cached": cached})
 
     except json.JSONDecodeError:
         app.logger.exception("AI analyze-wine JSON parse error")
         return jsonify({"ok": False, "error": "parse_error", "image_filename": image_filename}), 500
     except Exception as e:
+        if isinstance(e, ValueError) and str(e) == "invalid_provider":
+            return jsonify({"ok": False, "error": "invalid_provider", "image_filename": image_filename}), 400
         app.logger.exception("AI analyze-wine error: %s", e)
-        error_msg = str(e)
-        if "timeout" in error_msg.lower():
+        if _ai_error_code(e) == "timeout":
             return jsonify({"ok": False, "error": "timeout", "image_filename": image_filename}), 500
-        return jsonify({"ok": False, "error": "api_error", "message": error_msg, "image_filename": image_filename}), 500
+        return jsonify({"ok": False, "error": "api_error", "message": str(e), "image_filename": image_filename}), 500
 
 
 # ── Vivino Wine Search ──────────────────────────────────────────────────────
@@ -2050,11 +3337,9 @@ def vivino_image():
             ext = "png"
         elif "webp" in ct:
             ext = "webp"
-        filename = f"{uuid.uuid4().hex}.{ext}"
-        filepath = os.path.join(UPLOAD_DIR, filename)
-        with open(filepath, "wb") as f:
-            f.write(resp.content)
-        _downscale(filepath)
+        filename, created = image_store.store_bytes(UPLOAD_DIR, resp.content, ext)
+        if created:
+            queue_downscale(os.path.join(UPLOAD_DIR, filename))
         return jsonify({"ok": True, "filename": filename})
     except Exception as e:
         app.logger.exception("Vivino image download error: %s", e)
@@ -2118,13 +3403,64 @@ def _load_image_b64(image_filename):
     return image_b64, media_type
 
 
-def _analyze_wine_from_context(opts, image_b64, media_type, wine_context):
-    """Call the configured AI provider to extract/enrich wine fields.
+def _analysis_cache_ttl(opts):
+    """Analysis cache lifetime in seconds; 0 disables the cache."""
+    try:
+        return max(0.0, float(opts.get("analysis_cache_days", 30))) * 86400
+    except (TypeError, ValueError):
+        return 30 * 86400
 
-    Returns a dict of wine fields (may be partial), or raises on error.
-    Accepts image, text context, or both. Used by both the /api/reanalyze-wine
-    HTTP endpoint and the chat ADD_WINE enrichment pass.
+
+def _parse_analysis(raw):
+    """Wine fields from a provider answer; raises ``json.JSONDecodeError``."""
+    raw = raw.strip()
+    # Strip markdown fences if present
+    if raw.startswith("```"):
+        raw = raw.split("\n", 1)[-1]
+        if raw.endswith("```"):
+            raw = raw[:-3].strip()
+
+    fields = json.loads(raw)
+
+    # Validate wine_type
+    if fields.get("wine_type") and fields["wine_type"] not in WINE_TYPES:
+        fields["wine_type"] = ""
+    return fields
+
+
+def _run_analysis(opts, image_b64, media_type, prompt, refresh=False, db=None):
+    """Send an analysis prompt to the configured provider; ``(fields, cached)``.
+
+    Results are cached per image, prompt, provider and model (see
+    ``analysis_cache``). ``refresh`` skips the lookup – the answer replaces
+    the cached one. ``db`` is needed outside a request (background jobs).
     """
+    provider = opts.get("ai_provider", "none").strip().lower()
+    call_fn = _provider_call(provider)
+    if not call_fn:
+        raise ValueError("invalid_provider")
+
+    ttl = _analysis_cache_ttl(opts)
+    key = None
+    if ttl:
+        db = db if db is not None else get_db()
+        key = analysis_cache.cache_key(image_b64, prompt, provider, _ai_model(provider, opts))
+        if not refresh:
+            fields = analysis_cache.get(db, key, ttl)
+            if fields is not None:
+                return fields, True
+
+    raw, answered_by = _ai_execute(
+        "scan", provider, opts, lambda name: _provider_call(name)(image_b64, media_type, prompt, opts),
+    )
+    fields = _parse_analysis(raw)
+    if key and answered_by == provider:
+        analysis_cache.put(db, key, fields, ttl)
+    return fields, False
+
+
+def _context_prompt(image_b64, wine_context):
+    """Analysis prompt for an image, known wine details, or both."""
     context_parts = []
     if wine_context.get("name"):   context_parts.append(f"Name: {wine_context['name']}")
     if wine_context.get("year"):   context_parts.append(f"Vintage: {wine_context['year']}")
@@ -2146,33 +3482,18 @@ def _analyze_wine_from_context(opts, image_b64, media_type, wine_context):
     else:
         ctx = "\n".join(context_parts)
         prompt = f"Based on the following wine information, fill in as many missing details as possible using your wine expertise. Known information:\n{ctx}\n\nReturn ONLY valid JSON with these fields (fill in what you can determine):\n{schema}\n{rules}"
+    return prompt
 
-    provider = opts.get("ai_provider", "none").strip().lower()
-    dispatch = {
-        "anthropic": _call_anthropic,
-        "openai": _call_openai,
-        "openrouter": _call_openrouter,
-        "ollama": _call_ollama,
-        "minimax": _call_minimax,
-        "mistral": _call_mistral,
-    }
-    call_fn = dispatch.get(provider)
-    if not call_fn:
-        raise ValueError("invalid_provider")
-
-    raw = call_fn(image_b64, media_type, prompt, opts).strip()
-
-    if raw.startswith("```"):
-        raw = raw.split("\n", 1)[-1]
-        if raw.endswith("```"):
-            raw = raw[:-3].strip()
-
-    fields = json.loads(raw)
 
-    if fields.get("wine_type") and fields["wine_type"] not in WINE_TYPES:
-        fields["wine_type"] = ""
+def _analyze_wine_from_context(opts, image_b64, media_type, wine_context, refresh=False, db=None):
+    """Call the configured AI provider to extract/enrich wine fields.
 
-    return fields
+    Returns a dict of wine fields (may be partial), or raises on error.
+    Accepts image, text context, or both. Used by both the /api/reanalyze-wine
+    HTTP endpoint and the chat ADD_WINE enrichment pass.
+    """
+    prompt = _context_prompt(image_b64, wine_context)
+    return _run_analysis(opts, image_b64, media_type, prompt, refresh=refresh, db=db)[0]
 
 
 @app.route("/api/reanalyze-wine", methods=["POST"])
@@ -2191,7 +3512,8 @@ def reanalyze_wine():
     image_b64, media_type = _load_image_b64(image_filename)
 
     try:
-        fields = _analyze_wine_from_context(opts, image_b64, media_type, wine_context)
+        fields = _analyze_wine_from_context(opts, image_b64, media_type, wine_context,
+                                            refresh=bool(body.get("refresh")))
         return jsonify({"ok": True, "fields": fields})
 
     except ValueError as e:
@@ -2204,10 +3526,9 @@ def reanalyze_wine():
         return jsonify({"ok": False, "error": "parse_error"}), 500
     except Exception as e:
         app.logger.exception("AI reanalyze-wine error: %s", e)
-        error_msg = str(e)
-        if "timeout" in error_msg.lower():
+        if _ai_error_code(e) == "timeout":
             return jsonify({"ok": False, "error": "timeout"}), 500
-        return jsonify({"ok": False, "error": "api_error", "message": error_msg}), 500
+        return jsonify({"ok": False, "error": "api_error", "message": str(e)}), 500
 
 
 
@@ -2285,14 +3606,16 @@ def api_chat_session_detail(session_id):
     ).fetchone()
     if not sess:
         return jsonify(ok=False, error="not_found"), 404
-    # Delete chat image folder
-    import shutil
-    chat_img_dir = os.path.join(UPLOAD_DIR, "chat", str(session_id))
-    if os.path.isdir(chat_img_dir):
-        shutil.rmtree(chat_img_dir, ignore_errors=True)
-    db.execute("PRAGMA foreign_keys = ON")
+    images = [r[0] for r in db.execute(
+        "SELECT DISTINCT image_path FROM chat_messages WHERE session_id = ? AND image_path IS NOT NULL",
+        (session_id,),
+    )]
     db.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
     db.commit()
+    for name in images:
+        image_store.release(db, UPLOAD_DIR, name)
+    # Sessions from before the content-addressed store kept their own folder
+    shutil.rmtree(os.path.join(UPLOAD_DIR, "chat", str(session_id)), ignore_errors=True)
     return jsonify(ok=True)
 
 
@@ -2300,10 +3623,9 @@ def api_chat_session_detail(session_id):
 
 
 def _process_chat_add_wine(response_text, session_id, session_images, db):
-    """Parse [ADD_WINE] block from AI response, create the wine, copy the image."""
+    """Parse [ADD_WINE] block from AI response, create the wine, reuse the image."""
     import json as _json
     import re as _re
-    import shutil
 
     match = _re.search(r'\[ADD_WINE\]\s*(\{.*?\})\s*\[/ADD_WINE\]', response_text, _re.DOTALL)
     if not match:
@@ -2322,18 +3644,19 @@ def _process_chat_add_wine(response_text, session_id, session_images, db):
     if wine_type not in WINE_TYPES:
         wine_type = "Anderes"
 
-    # Handle image: copy from chat uploads to wine uploads
+    # Handle image: the wine references the chat photo's stored file
     wine_image = None
     image_index = data.get("image_index")
     if image_index and session_images:
         idx = int(image_index) - 1  # 0-based
         if 0 <= idx < len(session_images):
-            src_path = os.path.join(UPLOAD_DIR, session_images[idx]["image_path"])
+            image_path = session_images[idx]["image_path"]
+            src_path = os.path.join(UPLOAD_DIR, image_path)
             if os.path.isfile(src_path):
-                ext = os.path.splitext(src_path)[1] or ".jpg"
-                wine_image = uuid.uuid4().hex + ext
-                dst_path = os.path.join(UPLOAD_DIR, wine_image)
-                shutil.copy2(src_path, dst_path)
+                if _is_upload_name(image_path):
+                    wine_image = image_path
+                else:  # legacy chat/<session>/<file> path
+                    wine_image = image_store.store_file(UPLOAD_DIR, src_path)[0]
 
     now = str(date.today())
     year = data.get("year")
@@ -2591,12 +3914,6 @@ def _process_chat_delete_wine(response_text, db):
     wine_year = wine["year"]
     wine_qty = wine["quantity"] or 0
 
-    # Delete wine image if exists
-    if wine["image"]:
-        img_path = os.path.join(UPLOAD_DIR, wine["image"])
-        if os.path.isfile(img_path):
-            os.remove(img_path)
-
     db.execute("DELETE FROM wines WHERE id = ?", (wine_id,))
     # Log to timeline
     if wine_qty > 0:
@@ -2605,17 +3922,21 @@ def _process_chat_delete_wine(response_text, db):
             (wine_id, "removed", wine_qty, datetime.now().isoformat()),
         )
     db.commit()
+    image_store.release(db, UPLOAD_DIR, wine["image"])
 
     return {"action": "deleted", "id": wine_id, "name": wine_name, "year": wine_year}
 
 
-@app.route("/api/chat", methods=["POST"])
-def api_chat():
-    """Wine sommelier chat – AI answers questions about the user's wine cellar."""
+def _chat_request():
+    """Parse a chat request, store the user message and build the prompt.
+
+    Shared by ``/api/chat`` and ``/api/chat/stream``. Returns ``(chat, None)``
+    with everything needed to call the provider, or ``(None, response)``.
+    """
     opts = load_options()
     provider = opts.get("ai_provider", "none").strip().lower()
     if provider == "none" or not _is_ai_configured(opts):
-        return jsonify({"ok": False, "error": "ai_not_configured"}), 400
+        return None, (jsonify({"ok": False, "error": "ai_not_configured"}), 400)
 
     # Support both JSON and multipart/form-data (for image uploads)
     image_b64 = None
@@ -2642,7 +3963,7 @@ def api_chat():
         edit_wines = body.get("edit_wines", False)
 
     if not user_message:
-        return jsonify({"ok": False, "error": "empty_message"}), 400
+        return None, (jsonify({"ok": False, "error": "empty_message"}), 400)
 
     db = get_db()
     now = datetime.now().isoformat()
@@ -2667,7 +3988,7 @@ def api_chat():
             # Verify session exists
             sess = db.execute("SELECT id, title FROM chat_sessions WHERE id = ?", (session_id,)).fetchone()
             if not sess:
-                return jsonify({"ok": False, "error": "session_not_found"}), 404
+                return None, (jsonify({"ok": False, "error": "session_not_found"}), 404)
             # Auto-generate title from first user message if title is empty
             if not sess["title"]:
                 db.execute(
@@ -2682,13 +4003,7 @@ def api_chat():
             ext_map = {"image/jpeg": ".jpg", "image/png": ".png",
                        "image/webp": ".webp", "image/gif": ".gif"}
             ext = ext_map.get(media_type, ".jpg")
-            chat_dir = os.path.join(UPLOAD_DIR, "chat", str(session_id))
-            os.makedirs(chat_dir, exist_ok=True)
-            fname = uuid.uuid4().hex + ext
-            fpath = os.path.join(chat_dir, fname)
-            with open(fpath, "wb") as f:
-                f.write(_b64.b64decode(image_b64))
-            saved_image_path = f"chat/{session_id}/{fname}"
+            saved_image_path, _ = image_store.store_bytes(UPLOAD_DIR, _b64.b64decode(image_b64), ext)
         db.execute(
             "INSERT INTO chat_messages (session_id, role, content, timestamp, image_path) VALUES (?, ?, ?, ?, ?)",
             (session_id, "user", user_message, now, saved_image_path),
@@ -2713,21 +4028,18 @@ def api_chat():
         if isinstance(msg, dict) and msg.get("role") in ("user", "assistant") and msg.get("content"):
             valid_history.append({"role": msg["role"], "content": msg["content"]})
 
-    # Build wine cellar context
-    cellar_text, wine_count = _build_wine_cellar_context()
-
     lang_map = {
         "de": "German", "en": "English", "fr": "French", "it": "Italian",
         "es": "Spanish", "pt": "Portuguese", "nl": "Dutch",
     }
     lang_name = lang_map.get(LANG, "English")
 
+    # Ordered from most to least stable (instructions, cellar, this session's
+    # images) so provider-side prompt caching can reuse the longest prefix.
     system_prompt = (
         f"You are an expert wine sommelier and personal wine advisor. "
         f"You have deep knowledge of the user's wine cellar.\n\n"
         f"ALWAYS respond in {lang_name}.\n\n"
-        f"The user's wine cellar currently contains {wine_count} wines (only in-stock bottles):\n"
-        f"{cellar_text if cellar_text else '(The cellar is currently empty.)'}\n\n"
         f"Your capabilities:\n"
         f"- Recommend wines from the cellar for specific dishes, occasions, or moods\n"
         f"- Suggest food pairings for specific wines in the cellar\n"
@@ -2748,9 +4060,10 @@ def api_chat():
     )
 
     # Extend system prompt with wine editing capabilities
+    session_images = []
+    images_info = ""
     if edit_wines and not (AUTH_ENABLED and session.get("role") == "readonly"):
         # List images uploaded in this chat session
-        session_images = []
         if session_id:
             img_rows = db.execute(
                 "SELECT id, image_path, content FROM chat_messages "
@@ -2771,7 +4084,6 @@ def api_chat():
                 "context": user_message[:80],
             })
 
-        images_info = ""
         if session_images:
             img_lines = []
             for img in session_images:
@@ -2811,58 +4123,152 @@ def api_chat():
             f"[DELETE_WINE]\n"
             f'{{"id": 42}}\n'
             f"[/DELETE_WINE]"
-            f"{images_info}"
         )
 
-    messages = valid_history + [{"role": "user", "content": user_message}]
+    cellar_stable, cellar_turn = _chat_cellar_prompt(db, opts, user_message, valid_history)
+    system_prompt += cellar_stable
+    system_prompt = _SystemPrompt(system_prompt + cellar_turn + images_info, stable_len=len(system_prompt))
 
-    try:
-        response_text = _call_chat(provider, messages, system_prompt, opts,
-                                    image_b64=image_b64, media_type=media_type)
-
-        # Check if AI wants to perform wine actions
-        wine_action = None
-        if edit_wines:
-            import re as _re
-            if "[ADD_WINE]" in response_text and "[/ADD_WINE]" in response_text:
-                wine_action = _process_chat_add_wine(
-                    response_text, session_id, session_images, db
-                )
-            elif "[EDIT_WINE]" in response_text and "[/EDIT_WINE]" in response_text:
-                wine_action = _process_chat_edit_wine(response_text, db)
-            elif "[DELETE_WINE]" in response_text and "[/DELETE_WINE]" in response_text:
-                wine_action = _process_chat_delete_wine(response_text, db)
-
-            # Remove any action blocks from the displayed response
-            response_text = _re.sub(
-                r'\[(ADD|EDIT|DELETE)_WINE\].*?\[/\1_WINE\]', '', response_text, flags=_re.DOTALL
-            ).strip()
-
-        if save:
-            # Save assistant response to DB
-            db.execute(
-                "INSERT INTO chat_messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
-                (session_id, "assistant", response_text, datetime.now().isoformat()),
-            )
-            # Update session timestamp
-            db.execute(
-                "UPDATE chat_sessions SET updated = ? WHERE id = ?",
-                (datetime.now().isoformat(), session_id),
+    messages = valid_history + [{"role": "user", "content": user_message}]
+    return {
+        "provider": provider,
+        "opts": opts,
+        "messages": messages,
+        "system_prompt": system_prompt,
+        "image_b64": image_b64,
+        "media_type": media_type,
+        "save": save,
+        "session_id": session_id,
+        "edit_wines": edit_wines,
+        "session_images": session_images,
+    }, None
+
+
+def _chat_reply(chat, response_text):
+    """Run the wine action in a finished reply, store it; returns the JSON body."""
+    db = get_db()
+    edit_wines, save, session_id = chat["edit_wines"], chat["save"], chat["session_id"]
+
+    # Check if AI wants to perform wine actions
+    wine_action = None
+    if edit_wines:
+        import re as _re
+        if "[ADD_WINE]" in response_text and "[/ADD_WINE]" in response_text:
+            wine_action = _process_chat_add_wine(
+                response_text, session_id, chat["session_images"], db
             )
-            db.commit()
+        elif "[EDIT_WINE]" in response_text and "[/EDIT_WINE]" in response_text:
+            wine_action = _process_chat_edit_wine(response_text, db)
+        elif "[DELETE_WINE]" in response_text and "[/DELETE_WINE]" in response_text:
+            wine_action = _process_chat_delete_wine(response_text, db)
 
-        result = {"ok": True, "response": response_text}
-        if save and session_id:
-            result["session_id"] = session_id
-        if wine_action:
-            result["wine_action"] = wine_action
-        return jsonify(result)
+        # Remove any action blocks from the displayed response
+        response_text = _re.sub(
+            r'\[(ADD|EDIT|DELETE)_WINE\].*?\[/\1_WINE\]', '', response_text, flags=_re.DOTALL
+        ).strip()
+
+    if save:
+        # Save assistant response to DB
+        db.execute(
+            "INSERT INTO chat_messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+            (session_id, "assistant", response_text, datetime.now().isoformat()),
+        )
+        # Update session timestamp
+        db.execute(
+            "UPDATE chat_sessions SET updated = ? WHERE id = ?",
+            (datetime.now().isoformat(), session_id),
+        )
+        db.commit()
+
+    result = {"ok": True, "response": response_text}
+    if save and session_id:
+        result["session_id"] = session_id
+    if wine_action:
+        result["wine_action"] = wine_action
+    return result
+
+
+def _chat_error(e):
+    app.logger.exception("Chat error: %s", e)
+    if _ai_error_code(e) == "timeout":
+        return {"ok": False, "error": "timeout"}
+    return {"ok": False, "error": "api_error", "message": str(e)}
+
+
+@app.route("/api/chat", methods=["POST"])
+def api_chat():
+    """Wine sommelier chat – AI answers questions about the user's wine cellar."""
+    chat, error = _chat_request()
+    if error:
+        return error
+    try:
+        response_text = _call_chat(chat["provider"], chat["messages"], chat["system_prompt"], chat["opts"],
+                                   image_b64=chat["image_b64"], media_type=chat["media_type"])
+        return jsonify(_chat_reply(chat, response_text))
     except Exception as e:
-        app.logger.exception("Chat error: %s", e)
-        error_msg = str(e)
-        if "timeout" in error_msg.lower():
-            return jsonify({"ok": False, "error": "timeout"}), 500
-        return jsonify({"ok": False, "error": "api_error", "message": error_msg}), 500
+        return jsonify(_chat_error(e)), 500
+
+
+# Start of an action block; streamed text is held back from here on
+_CHAT_ACTION_MARKERS = ("[ADD_WINE]", "[EDIT_WINE]", "[DELETE_WINE]")
+
+
+def _streamable_length(text):
+    """How much of a partial reply can be shown: everything before an action
+    block, minus a trailing piece that might be the start of one."""
+    cut = len(text)
+    for marker in _CHAT_ACTION_MARKERS:
+        pos = text.find(marker)
+        if pos != -1:
+            cut = min(cut, pos)
+        for n in range(len(marker) - 1, 0, -1):
+            if text.endswith(marker[:n]):
+                cut = min(cut, len(text) - n)
+                break
+    return cut
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/api/chat/stream", methods=["POST"])
+def api_chat_stream():
+    """Like ``/api/chat``, but the reply is sent as Server-Sent Events.
+
+    ``delta`` events carry the next piece of text (``{"text": ...}``) as the
+    provider produces it; wine action blocks are held back. The stream ends
+    with a ``done`` event holding the same body ``/api/chat`` returns, after
+    the reply was stored and its action run, or with an ``error`` event.
+    Request errors are answered with plain JSON before the stream starts.
+    """
+    chat, error = _chat_request()
+    if error:
+        return error
+
+    def events():
+        text, shown, stream = "", 0, None
+        try:
+            stream = _stream_chat(chat["provider"], chat["messages"], chat["system_prompt"], chat["opts"],
+                                  image_b64=chat["image_b64"], media_type=chat["media_type"])
+            for piece in stream:
+                text += piece
+                visible = _streamable_length(text) if chat["edit_wines"] else len(text)
+                if visible > shown:
+                    yield _sse("delta", {"text": text[shown:visible]})
+                    shown = visible
+            yield _sse("done", _chat_reply(chat, text))
+        except Exception as e:
+            yield _sse("error", _chat_error(e))
+        finally:
+            # Also reached when the client goes away: stop the upstream request
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+
+    resp = Response(stream_with_context(events()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # no proxy buffering (HA ingress / nginx)
+    return resp
 
 # ── API for Home Assistant sensors ───────────────────────────────────────────
 
@@ -2872,21 +4278,50 @@ def api_get_wine(wine_id):
     wine = db.execute("SELECT * FROM wines WHERE id = ?", (wine_id,)).fetchone()
     if not wine:
         return jsonify({"ok": False, "error": "not found"}), 404
-    return jsonify({"ok": True, "wine": wine_json(wine_id)})
+    # A finished background downscale does not bump the cellar revision
+    etag = revision_etag("wine", wine_id, cellar_revision(db), image_pending(wine["image"]))
+    return conditional_json(etag, lambda: jsonify({"ok": True, "wine": wine_json(wine_id)}))
+
+
+@app.route("/api/stats/drink-window/<int:year>")
+def api_drink_window_year(year):
+    """Wines drinkable in ``year``, grouped by type (drink-window tooltip)."""
+    db = get_db()
+    rows = db.execute(
+        "SELECT id, name, year, type, quantity, drink_from, drink_until FROM wines "
+        + DRINK_WINDOW_WHERE + " AND CAST(drink_until AS INTEGER) >= ? ORDER BY id",
+        (year,),
+    )
+    by_type = defaultdict(list)
+    for w in rows:
+        window = cellar_stats.drink_window(w)
+        if window and window[0] <= year <= window[1]:
+            by_type[w["type"] or "Anderes"].append(
+                {"n": w["name"], "y": w["year"], "q": w["quantity"], "id": w["id"]}
+            )
+    return jsonify(ok=True, year=year, wines=by_type)
 
 
 @app.route("/api/summary")
 def api_summary():
     db = get_db()
-    rows = db.execute(
-        "SELECT type, COUNT(*) as cnt, SUM(quantity) as total FROM wines GROUP BY type"
-    ).fetchall()
-    total = db.execute("SELECT SUM(quantity) FROM wines WHERE quantity > 0").fetchone()[0] or 0
-    return jsonify({"total_bottles": total, "by_type": [dict(r) for r in rows]})
+
+    def build():
+        by_type = [
+            {"type": g["key"], "cnt": g["wines"], "total": g["bottles"]}
+            for g in cellar_stats.groups(db, "type")
+        ]
+        total = cellar_stats.totals(db)["in_stock_bottles"]
+        return jsonify({"total_bottles": total, "by_type": by_type})
+
+    return conditional_json(revision_etag("summary", cellar_revision(db)), build)
 
 
 # ── Main ──────────────────────────────────────────────────────────────────────
 
+# Production: ``gunicorn --config gunicorn.conf.py app:app`` (see Dockerfile).
+# Running this file directly starts the Flask dev server for local development.
+
 if __name__ == "__main__":
     init_db()
-    app.run(host="0.0.0.0", port=5050, debug=False)
+    app.run(host="0.0.0.0", port=5050, debug=False, threaded=True)
@@ -0,0 +1,95 @@
+"""
+Cellar listing for the sommelier chat's system prompt.
+
+Every chat turn sends the in-stock wines to the AI provider. Building that
+text from scratch meant a full ``SELECT`` and formatting every bottle on
+each message, although the cellar rarely changes between two turns.
+
+``CellarContext`` keeps the last listing per process, keyed by the
+``cellar_rev`` counter (bumped by a trigger on every write to ``wines``):
+as long as it is unchanged the cached text is returned without touching
+the table. After a write only the rows whose values differ are formatted
+again; the lines of unchanged wines are reused.
+
+Wines are listed by id. New wines are appended at the end, so the start
+of the prompt stays byte-identical across turns – which is what provider
+side prompt caching (explicit for Anthropic, automatic for OpenAI) keys on.
+"""
+
+from __future__ import annotations
+
+import threading
+
+COLUMNS = (
+    "id", "name", "year", "type", "region", "grape", "quantity", "rating",
+    "location", "drink_from", "drink_until", "notes",
+)
+
+_QUERY = f"SELECT {', '.join(COLUMNS)} FROM wines WHERE quantity > 0 ORDER BY id"
+
+
+def format_wine(w: dict, labels: dict) -> str:
+    """One wine as a single ``|``-separated line."""
+    parts = [f"- [ID:{w['id']}] {w['name']}"]
+    if w.get("year"):
+        parts.append(f"{labels['vintage']} {w['year']}")
+    if w.get("type"):
+        parts.append(f"{labels['type']}: {w['type']}")
+    if w.get("region"):
+        parts.append(f"{labels['region']}: {w['region']}")
+    if w.get("grape"):
+        parts.append(f"{labels['grape']}: {w['grape']}")
+    if w.get("quantity"):
+        parts.append(f"{labels['quantity']}: {w['quantity']} {labels['bottles']}")
+    if w.get("rating"):
+        parts.append(f"{labels['rating']}: {w['rating']}/5")
+    if w.get("location"):
+        parts.append(f"{labels['location']}: {w['location']}")
+    if w.get("drink_from") or w.get("drink_until"):
+        parts.append(
+            f"{labels['drink_window']}: {w.get('drink_from', '?')}-{w.get('drink_until', '?')}"
+        )
+    if w.get("notes"):
+        parts.append(f"{labels['notes']}: {w['notes']}")
+    return " | ".join(parts)
+
+
+class CellarContext:
+    """Per-process cache of the formatted cellar listing."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._text = ""
+        self._count = 0
+        self._lines = {}  # wine id -> (row values, formatted line)
+        self.rebuilt_lines = 0  # lines formatted by the last refresh
+
+    def get(self, db, source: str, revision: int, lang: str, labels: dict) -> tuple[str, int]:
+        """``(text, number of wines)`` for the cellar at ``revision``.
+
+        ``source`` identifies the database (its path) and ``lang`` the
+        label set, so neither a different database nor a language switch
+        can be served from the cache.
+        """
+        key = (source, revision, lang)
+        with self._lock:
+            if key == self._key:
+                return self._text, self._count
+            if self._key is None or self._key[0] != source or self._key[2] != lang:
+                self._lines = {}
+            lines = {}
+            rebuilt = 0
+            for row in db.execute(_QUERY):
+                values = tuple(row)
+                cached = self._lines.get(values[0])
+                if cached is None or cached[0] != values:
+                    cached = (values, format_wine(dict(zip(COLUMNS, values)), labels))
+                    rebuilt += 1
+                lines[values[0]] = cached
+            self._lines = lines
+            self._text = "\n".join(line for _, line in lines.values())
+            self._count = len(lines)
+            self._key = key
+            self.rebuilt_lines = rebuilt
+            return self._text, self._count
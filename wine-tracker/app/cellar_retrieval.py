@@ -0,0 +1,206 @@
+"""
+Retrieval mode for the sommelier chat on large cellars.
+
+Up to a configurable size the chat prompt lists every in-stock wine
+(``cellar_context``). Beyond that the prompt would outgrow the provider's
+context window and every turn would get slower, so instead it carries
+
+* a compact overview of the whole cellar (``summary()``: counts per type,
+  top regions and grapes, vintage range) and
+* the ``k`` wines most relevant to the conversation (``relevant_ids()``).
+
+Relevance comes from the local FTS5 index the cellar search already keeps
+(``wines_fts``, BM25-ranked), with a LIKE scan when SQLite has no FTS5.
+Wines referenced earlier in the conversation (``wine:42`` links, ``[ID:42]``)
+come first. A wine type named in the message ("red", "Schaumwein", ...)
+narrows the search to that type, and bottles in their drinking window fill
+up the remaining slots. Nothing
+leaves the machine – no embedding service is involved.
+
+``scripts/eval_chat_retrieval.py`` measures how many of the wines a
+question needs end up in the prompt, compared with the full listing.
+"""
+
+from __future__ import annotations
+
+import re
+from datetime import date
+
+from migrations import FTS_COLUMNS
+
+DEFAULT_TOP_K = 40
+
+# Words that say nothing about which wine is meant
+STOPWORDS = frozenset("""
+    the and for with what which who how this that have has are was were you your can could should
+    would will please tell about some any from into more most best good bottle bottles wine wines
+    der die das und oder mit was welche welcher welchen wie ich habe hast ist sind ein eine einen einem
+    für zum zur auf aus von bitte noch mir mich wein weine weins flasche flaschen
+    les des une pour avec quel quelle quels dans est vin vins bouteille
+    il lo la gli che con per del della quale vino vini bottiglia
+    los las una con para que cual del vinho vinhos garrafa
+    het een met voor wat welke van wijn wijnen fles
+""".split())
+
+# Words (in the supported languages) that name a wine type
+TYPE_KEYWORDS = {
+    "Rotwein": ("red", "reds", "rot", "rote", "roten", "roter", "rotwein", "rotweine",
+                "rouge", "rouges", "rosso", "rossi", "tinto", "tintos", "rode", "rood"),
+    "Weisswein": ("white", "whites", "weiss", "weisse", "weissen", "weisser", "weisswein",
+                  "weißwein", "weiße", "blanc", "blancs", "bianco", "bianchi", "blanco",
+                  "blancos", "branco", "wit", "witte"),
+    "Rosé": ("rosé", "rose", "rosado", "rosato"),
+    "Schaumwein": ("sparkling", "schaumwein", "sekt", "champagne", "champagner", "crémant",
+                   "cremant", "prosecco", "cava", "mousseux", "spumante", "espumoso",
+                   "espumante", "mousserende"),
+    "Dessertwein": ("dessert", "dessertwein", "süsswein", "sweet", "postre", "sobremesa",
+                    "dessertwijn"),
+    "Likörwein": ("fortified", "likörwein", "port", "porto", "sherry", "madeira", "marsala",
+                  "muté", "liquoroso", "generoso", "versterkte"),
+}
+
+_REFERENCE_RE = re.compile(r"(?:wine:|\[ID:)(\d+)")
+
+
+def terms(text: str, limit: int = 20) -> list[str]:
+    """Search words of a chat message: lowercased, no stopwords, no repeats."""
+    seen = []
+    for word in re.findall(r"\w+", text.lower()):
+        if (len(word) >= 3 or not word.isalpha()) and word not in STOPWORDS and word not in seen:
+            seen.append(word)
+    return seen[:limit]
+
+
+def referenced_ids(texts) -> list[int]:
+    """Wine ids linked in earlier messages, most recent first."""
+    ids = []
+    for text in reversed(list(texts)):
+        for match in reversed(_REFERENCE_RE.findall(text or "")):
+            if int(match) not in ids:
+                ids.append(int(match))
+    return ids
+
+
+def mentioned_types(words) -> list[str]:
+    words = set(words)
+    return [t for t, keys in TYPE_KEYWORDS.items() if words.intersection(keys)]
+
+
+def _has_fts(db) -> bool:
+    return db.execute("SELECT 1 FROM sqlite_master WHERE name = 'wines_fts'").fetchone() is not None
+
+
+def _type_filter(types, column="type"):
+    if not types:
+        return "", []
+    return f" AND {column} IN ({','.join('?' * len(types))})", list(types)
+
+
+def _search(db, words, limit, weights, types=()):
+    """In-stock wine ids matching any of ``words``, best first.
+
+    ``types`` restricts the result to these wine types.
+    """
+    if not words:
+        return []
+    if _has_fts(db):
+        where, params = _type_filter(types, "w.type")
+        match = " OR ".join(f'"{w}"*' for w in words)
+        return [r[0] for r in db.execute(
+            f"SELECT w.id FROM wines_fts JOIN wines w ON w.id = wines_fts.rowid "
+            f"WHERE wines_fts MATCH ? AND w.quantity > 0{where} "
+            f"ORDER BY bm25(wines_fts, {weights}) LIMIT ?",
+            (match, *params, limit),
+        )]
+    # Without FTS5: rank by the number of words that occur anywhere
+    where, type_params = _type_filter(types)
+    hits = " + ".join(
+        "(" + " OR ".join(f"{c} LIKE ?" for c in FTS_COLUMNS) + ")" for _ in words
+    )
+    params = [f"%{w}%" for w in words for _ in FTS_COLUMNS]
+    return [r[0] for r in db.execute(
+        f"SELECT id FROM (SELECT id, rating, {hits} AS hits FROM wines WHERE quantity > 0{where}) "
+        f"WHERE hits > 0 ORDER BY hits DESC, rating DESC, id LIMIT ?",
+        (*params, *type_params, limit),
+    )]
+
+
+def _ready_to_drink(db, types, limit, year):
+    """In-stock wines in their drinking window (best rated first), then the rest."""
+    where, params = _type_filter(types)
+    return [r[0] for r in db.execute(
+        f"SELECT id FROM wines WHERE quantity > 0{where} "
+        f"ORDER BY (COALESCE(drink_from, 0) <= ? AND COALESCE(drink_until, 9999) >= ?) DESC, "
+        f"rating DESC, quantity DESC, id LIMIT ?",
+        (*params, year, year, limit),
+    )]
+
+
+def relevant_ids(db, message: str, history=(), k: int = DEFAULT_TOP_K,
+                 weights: str = "1.0", today: date | None = None) -> list[int]:
+    """Up to ``k`` in-stock wine ids for a chat turn, most relevant first.
+
+    ``history`` holds the earlier message texts; wines linked there and the
+    words of the previous user question help with follow-ups ("and the
+    second one?"). ``weights`` are the BM25 column weights of ``wines_fts``.
+    """
+    history = list(history)
+    year = (today or date.today()).year
+    words = terms(message)
+    previous = terms(" ".join(history[-2:]))
+
+    picked = []
+
+    def add(ids):
+        for wine_id in ids:
+            if len(picked) >= k:
+                return
+            if wine_id not in picked:
+                picked.append(wine_id)
+
+    refs = referenced_ids(history + [message])
+    if refs:
+        in_stock = {r[0] for r in db.execute(
+            f"SELECT id FROM wines WHERE quantity > 0 AND id IN ({','.join('?' * len(refs))})", refs
+        )}
+        add([i for i in refs if i in in_stock][: max(1, k // 4)])
+    # A named type ("a red with lamb") narrows the search before anything else
+    types = mentioned_types(words) or mentioned_types(previous)
+    if types:
+        add(_search(db, words, k, weights, types))
+        add(_ready_to_drink(db, types, k, year))
+    add(_search(db, words, k, weights))
+    add(_search(db, [w for w in previous if w not in words], k // 4, weights))
+    add(_ready_to_drink(db, [], k, year))
+    return picked
+
+
+def summary(db, top: int = 8, today: date | None = None) -> str:
+    """A few lines describing the whole in-stock cellar."""
+    year = (today or date.today()).year
+    lines = []
+    by_type = db.execute(
+        "SELECT type, COUNT(*), SUM(quantity) FROM wines WHERE quantity > 0 "
+        "GROUP BY type ORDER BY COUNT(*) DESC, type"
+    ).fetchall()
+    if by_type:
+        lines.append("- By type: " + ", ".join(
+            f"{t or '?'} {n} wines / {b} bottles" for t, n, b in by_type
+        ))
+    for label, col in (("Top regions", "region"), ("Top grapes", "grape"), ("Top locations", "location")):
+        rows = db.execute(
+            f"SELECT {col}, COUNT(*) FROM wines WHERE quantity > 0 AND {col} IS NOT NULL AND {col} != '' "
+            f"GROUP BY {col} ORDER BY COUNT(*) DESC, {col} LIMIT ?", (top,)
+        ).fetchall()
+        if rows:
+            lines.append(f"- {label}: " + ", ".join(f"{v} ({n})" for v, n in rows))
+    oldest, newest, ready = db.execute(
+        "SELECT MIN(year), MAX(year), "
+        "SUM(drink_from IS NOT NULL AND drink_from <= ? AND COALESCE(drink_until, 9999) >= ?) "
+        "FROM wines WHERE quantity > 0", (year, year)
+    ).fetchone()
+    if oldest:
+        lines.append(f"- Vintages: {oldest}–{newest}")
+    if ready:
+        lines.append(f"- In their drinking window this year: {ready} wines")
+    return "\n".join(lines)
@@ -0,0 +1,224 @@
+"""
+Materialized cellar statistics.
+
+The ``cellar_stats`` table holds additive aggregates (wines, bottles, liters,
+value, price and vintage sums, …) per wine type and per region. Triggers on
+``wines`` apply each INSERT / UPDATE / DELETE as a delta, so every write path
+– the routes, imports, chat actions or a hand-edited database – keeps it
+current and reading the totals never scans ``wines``.
+
+``check(db)`` recomputes the aggregates from scratch and lists every group
+that drifted; ``rebuild(db)`` restores the table from ``wines``.
+
+``drink_window_histogram()`` turns drink windows into per-year bottle counts
+for the stats chart.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+
+
+# Dimensions the aggregates are grouped by (each is a `wines` column).
+DIMENSIONS = ("type", "region")
+
+# What a single wine row (alias ``{r}``) contributes to each counter.
+# Mirrors the WHERE clauses of the original stats queries.
+CONTRIBUTIONS = {
+    "wines":            "1",
+    "bottles":          "IFNULL({r}.quantity, 0)",
+    "in_stock_bottles": "CASE WHEN {r}.quantity > 0 THEN {r}.quantity ELSE 0 END",
+    "in_stock_wines":   "CASE WHEN {r}.quantity > 0 THEN 1 ELSE 0 END",
+    "empty_wines":      "CASE WHEN {r}.quantity = 0 THEN 1 ELSE 0 END",
+    "liters":           "IFNULL({r}.quantity, 0) * COALESCE({r}.bottle_format, 0.75)",
+    "value":            "CASE WHEN {r}.price > 0 THEN IFNULL({r}.quantity, 0) * {r}.price ELSE 0 END",
+    "price_sum":        "CASE WHEN {r}.price > 0 THEN {r}.price ELSE 0 END",
+    "price_count":      "CASE WHEN {r}.price > 0 THEN 1 ELSE 0 END",
+    "year_sum":         "CASE WHEN {r}.year > 0 THEN {r}.year ELSE 0 END",
+    "year_count":       "CASE WHEN {r}.year > 0 THEN 1 ELSE 0 END",
+}
+
+COUNTERS = tuple(CONTRIBUTIONS)
+_REAL_COUNTERS = {"liters", "value", "price_sum"}
+
+# Columns whose change can move a wine between groups or change a counter
+_TRACKED_COLUMNS = ("type", "region", "quantity", "bottle_format", "price", "year")
+
+# Float sums (liters, value) accumulate rounding noise over many deltas
+_TOLERANCE = 1e-6
+
+
+def _contrib(r, sign=""):
+    return ", ".join(f"{sign}({expr.format(r=r)})" for expr in CONTRIBUTIONS.values())
+
+
+def _apply(r, sign):
+    """Statements adding (sign "") or removing (sign "-") row ``r``."""
+    cols = ", ".join(COUNTERS)
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in COUNTERS)
+    return "\n".join(
+        f"INSERT INTO cellar_stats (dim, key, is_null, {cols}) "
+        f"VALUES ('{dim}', IFNULL({r}.{dim}, ''), {r}.{dim} IS NULL, {_contrib(r, sign)}) "
+        f"ON CONFLICT (dim, key, is_null) DO UPDATE SET {updates};"
+        for dim in DIMENSIONS
+    )
+
+
+def install(db):
+    """Create the table and its triggers, then fill it from ``wines``."""
+    counters = ",\n".join(
+        f"            {c} {'REAL' if c in _REAL_COUNTERS else 'INTEGER'} NOT NULL DEFAULT 0"
+        for c in COUNTERS
+    )
+    db.execute(f"""
+        CREATE TABLE IF NOT EXISTS cellar_stats (
+            dim     TEXT NOT NULL,
+            key     TEXT NOT NULL,
+            is_null INTEGER NOT NULL,
+{counters},
+            PRIMARY KEY (dim, key, is_null)
+        ) WITHOUT ROWID
+    """)
+    prune = "DELETE FROM cellar_stats WHERE wines = 0;"
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cellar_stats_insert AFTER INSERT ON wines BEGIN
+            {_apply("new", "")}
+        END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cellar_stats_delete AFTER DELETE ON wines BEGIN
+            {_apply("old", "-")}
+            {prune}
+        END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cellar_stats_update
+        AFTER UPDATE OF {", ".join(_TRACKED_COLUMNS)} ON wines BEGIN
+            {_apply("old", "-")}
+            {_apply("new", "")}
+            {prune}
+        END
+    """)
+    rebuild(db)
+
+
+def _fresh(db):
+    """Aggregates computed from scratch: {(dim, key, is_null): {counter: value}}."""
+    sums = ", ".join(f"SUM({expr.format(r='w')})" for expr in CONTRIBUTIONS.values())
+    result = {}
+    for dim in DIMENSIONS:
+        for row in db.execute(
+            f"SELECT IFNULL(w.{dim}, ''), w.{dim} IS NULL, {sums} FROM wines w GROUP BY 1, 2"
+        ):
+            result[(dim, row[0], row[1])] = dict(zip(COUNTERS, row[2:]))
+    return result
+
+
+def _stored(db):
+    result = {}
+    for row in db.execute(f"SELECT dim, key, is_null, {', '.join(COUNTERS)} FROM cellar_stats"):
+        result[(row[0], row[1], row[2])] = dict(zip(COUNTERS, row[3:]))
+    return result
+
+
+def rebuild(db):
+    """Replace the aggregates with a fresh computation from ``wines``."""
+    db.execute("DELETE FROM cellar_stats")
+    cols = ", ".join(COUNTERS)
+    for (dim, key, is_null), counters in _fresh(db).items():
+        db.execute(
+            f"INSERT INTO cellar_stats (dim, key, is_null, {cols}) "
+            f"VALUES (?, ?, ?, {', '.join('?' * len(COUNTERS))})",
+            (dim, key, is_null, *counters.values()),
+        )
+
+
+def check(db) -> list[str]:
+    """Compare the materialized aggregates with ``wines``.
+
+    Returns a human-readable line per drifted group (empty list when
+    consistent).
+    """
+    fresh, stored = _fresh(db), _stored(db)
+    problems = []
+    for group in sorted(set(fresh) | set(stored), key=str):
+        want, have = fresh.get(group), stored.get(group)
+        label = f"{group[0]}={None if group[2] else group[1]!r}"
+        if want is None:
+            problems.append(f"{label}: stale group")
+        elif have is None:
+            problems.append(f"{label}: missing")
+        else:
+            for c in COUNTERS:
+                if abs((want[c] or 0) - (have[c] or 0)) > _TOLERANCE:
+                    problems.append(f"{label}: {c} is {have[c]}, expected {want[c]}")
+    return problems
+
+
+# ── Reads ─────────────────────────────────────────────────────────────────────
+
+def totals(db) -> dict:
+    """Cellar-wide sums of every counter (0 for an empty cellar)."""
+    row = db.execute(
+        f"SELECT {', '.join(f'IFNULL(SUM({c}), 0)' for c in COUNTERS)} FROM cellar_stats WHERE dim = 'type'"
+    ).fetchone()
+    return dict(zip(COUNTERS, row))
+
+
+def groups(db, dim) -> list[dict]:
+    """One dict per group of ``dim`` (``key`` is None for NULL), by key."""
+    rows = db.execute(
+        f"SELECT CASE WHEN is_null THEN NULL ELSE key END, {', '.join(COUNTERS)} "
+        f"FROM cellar_stats WHERE dim = ? AND wines > 0 ORDER BY is_null DESC, key",
+        (dim,),
+    ).fetchall()
+    return [dict(key=r[0], **dict(zip(COUNTERS, r[1:]))) for r in rows]
+
+
+# ── Drink windows ─────────────────────────────────────────────────────────────
+
+def drink_window(row):
+    """``(from, until)`` years of a wine's drink window, or None if unusable.
+
+    A missing ``drink_from`` means the wine is only drinkable in ``drink_until``.
+    """
+    try:
+        until = int(row["drink_until"])
+        frm = int(row["drink_from"]) if row["drink_from"] else until
+    except (ValueError, TypeError):
+        return None
+    return (frm, until) if frm <= until else None
+
+
+def drink_window_histogram(rows, default_type="Anderes"):
+    """Bottles drinkable per year, stacked by wine type.
+
+    ``rows`` need ``type``, ``quantity``, ``drink_from`` and ``drink_until``.
+    Each window becomes two events (+quantity in its first year, -quantity
+    after its last); a sweep over the sorted event years gives the counts
+    without walking every year of every window, so a typo like 2999 costs one
+    event instead of a thousand entries per wine.
+
+    Returns ``(chart, type_order)``: one ``{"year", "counts"}`` per year from
+    the earliest start to the latest end, and the sorted type names.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for row in rows:
+        window = drink_window(row)
+        if window is None:
+            continue
+        t = row["type"] or default_type
+        deltas[window[0]][t] += row["quantity"]
+        deltas[window[1] + 1][t] -= row["quantity"]
+    if not deltas:
+        return [], []
+
+    years = sorted(deltas)
+    running = defaultdict(int)
+    chart = []
+    for year, next_year in zip(years, years[1:]):
+        for t, delta in deltas[year].items():
+            running[t] += delta
+        counts = {t: qty for t, qty in running.items() if qty}
+        chart.extend({"year": y, "counts": dict(counts)} for y in range(year, next_year))
+    return chart, sorted(running)
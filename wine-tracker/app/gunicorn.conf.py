@@ -0,0 +1,42 @@
+"""
+Gunicorn settings for the production server.
+
+Started by the Dockerfiles as ``gunicorn --config gunicorn.conf.py app:app``.
+Worker and thread counts come from the add-on options / ENV through
+``load_options()`` (``server_workers`` / ``server_threads``).
+
+The app is preloaded in the master so ``init_db()`` runs exactly once before
+any worker is forked. ``kill -HUP <master>`` re-reads this file and replaces
+the workers gracefully; in-flight requests are allowed to finish.
+"""
+from app import init_db, reap_jobs, server_settings
+
+_settings = server_settings()
+
+bind = "0.0.0.0:5050"
+worker_class = "gthread"
+workers = _settings["workers"]
+threads = _settings["threads"]
+preload_app = True
+
+# AI calls (label scan, chat) can legitimately take up to two minutes.
+timeout = 180
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = None
+errorlog = "-"
+loglevel = "info"
+
+
+def on_starting(server):
+    """Create / migrate the database once, before the workers fork."""
+    init_db()
+    server.log.info(
+        "Wine Tracker: %d worker(s) x %d thread(s)", workers, threads
+    )
+
+
+def post_fork(server, worker):
+    """Fail jobs a killed or recycled worker left queued or running."""
+    reap_jobs()
@@ -0,0 +1,221 @@
+"""
+Content-addressed image store for uploads.
+
+Every image in the uploads folder is named after the SHA-256 of its bytes
+as received: ``<first 32 hex digits>.<ext>``. Storing the same photo again
+– duplicating a wine, adding a wine from a chat photo – yields the same
+name, so it is kept on disk only once.
+
+The references are the rows pointing at a file (``wines.image`` and
+``chat_messages.image_path``); there is no separate counter to drift.
+``release()`` deletes a file when its last reference is gone (and it was
+not written or reused recently), ``collect_garbage()`` sweeps everything
+unreferenced, and
+``migrate_uploads()`` converts an uploads folder from the older one-copy-
+per-wine UUID layout.
+
+The name identifies the upload, not the current bytes: uploads are
+downscaled in place after they have been stored. A backup therefore holds
+bytes that hash to a different name – ``reuse()`` lets an import keep the
+archived name when that file is still in the store.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+import re
+import secrets
+import shutil
+import time
+
+log = logging.getLogger(__name__)
+
+HASH_LEN = 32
+CHUNK_SIZE = 64 * 1024
+
+_NAME_RE = re.compile(rf"[0-9a-f]{{{HASH_LEN}}}\.[A-Za-z0-9]+")
+
+# Columns holding an upload filename
+REFERENCES = (("wines", "image"), ("chat_messages", "image_path"))
+
+# collect_garbage() keeps files written or reused this recently: a request
+# may be about to reference them (e.g. a label photo analysed before saving).
+GRACE_SECONDS = 3600
+
+# app_state flag set once migrate_uploads() has run
+_MIGRATED_KEY = "image_store"
+
+
+def _commit(upload_dir: str, tmp: str, digest: str, ext: str) -> tuple[str, bool]:
+    name = f"{digest[:HASH_LEN]}.{ext.lower().lstrip('.')}"
+    final = os.path.join(upload_dir, name)
+    if os.path.isfile(final):
+        os.remove(tmp)
+        os.utime(final)  # restart the GC grace period for the new reference
+        return name, False
+    os.replace(tmp, final)
+    return name, True
+
+
+def store_stream(upload_dir: str, stream, ext: str) -> tuple[str, bool]:
+    """Store the bytes of a binary stream; returns ``(name, created)``.
+
+    ``created`` is False when an identical file already existed.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    tmp = os.path.join(upload_dir, f".{secrets.token_hex(8)}.part")
+    digest = hashlib.sha256()
+    try:
+        with open(tmp, "wb") as out:
+            while chunk := stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+        return _commit(upload_dir, tmp, digest.hexdigest(), ext)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def store_bytes(upload_dir: str, data: bytes, ext: str) -> tuple[str, bool]:
+    return store_stream(upload_dir, io.BytesIO(data), ext)
+
+
+def store_file(upload_dir: str, path: str) -> tuple[str, bool]:
+    """Store a copy of an existing file (its extension is kept)."""
+    with open(path, "rb") as src:
+        return store_stream(upload_dir, src, os.path.splitext(path)[1] or ".jpg")
+
+
+def reuse(upload_dir: str, name: str) -> bool:
+    """True if ``name`` is a store name already present in ``upload_dir``.
+
+    Restarts its GC grace period, like storing identical bytes would.
+    """
+    path = os.path.join(upload_dir, name)
+    if not _NAME_RE.fullmatch(name) or not os.path.isfile(path):
+        return False
+    os.utime(path)
+    return True
+
+
+# ── References ────────────────────────────────────────────────────────────────
+
+def ref_count(db, name: str) -> int:
+    return sum(
+        db.execute(f"SELECT COUNT(*) FROM {table} WHERE {col} = ?", (name,)).fetchone()[0]
+        for table, col in REFERENCES
+    )
+
+
+def referenced(db) -> set[str]:
+    names = set()
+    for table, col in REFERENCES:
+        names.update(r[0] for r in db.execute(
+            f"SELECT DISTINCT {col} FROM {table} WHERE {col} IS NOT NULL AND {col} != ''"
+        ))
+    return names
+
+
+def _recent(path: str, now: float) -> bool:
+    try:
+        return now - os.path.getmtime(path) < GRACE_SECONDS
+    except OSError:
+        return False
+
+
+def release(db, upload_dir: str, name: str | None) -> bool:
+    """Delete ``name`` if no row references it anymore.
+
+    Call after the referencing row was changed or deleted (the count sees
+    the caller's uncommitted writes). Files younger than ``GRACE_SECONDS``
+    are left to ``collect_garbage()``: an identical upload may have been
+    handed the same name and not be saved yet. Returns True if the file
+    was removed.
+    """
+    if not name or "/" in name or "\\" in name or ref_count(db, name):
+        return False
+    path = os.path.join(upload_dir, name)
+    if _recent(path, time.time()):
+        return False
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def collect_garbage(db, upload_dir: str, dry_run: bool = False) -> list[str]:
+    """Remove unreferenced files (and stale temp files) from ``upload_dir``.
+
+    Files younger than ``GRACE_SECONDS`` are kept. Subfolders are left
+    alone. Returns the names that were (or, with ``dry_run``, would be)
+    removed.
+    """
+    keep = referenced(db)
+    now = time.time()
+    removed = []
+    try:
+        entries = os.listdir(upload_dir)
+    except FileNotFoundError:
+        return removed
+    for entry in sorted(entries):
+        path = os.path.join(upload_dir, entry)
+        if entry in keep or entry.endswith(".pending") or not os.path.isfile(path):
+            continue
+        if _recent(path, now):
+            continue
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        removed.append(entry)
+    return removed
+
+
+# ── Migration ─────────────────────────────────────────────────────────────────
+
+def migrate_uploads(db, upload_dir: str) -> int:
+    """Rename referenced uploads to their content hash, once per database.
+
+    Identical files collapse into one, references are rewritten in place
+    and the old per-session ``chat/<id>/`` folders are emptied. Files
+    nobody references are left for ``collect_garbage()``. Returns the
+    number of references rewritten. Commits.
+    """
+    row = db.execute("SELECT value FROM app_state WHERE key = ?", (_MIGRATED_KEY,)).fetchone()
+    if row and row[0]:
+        return 0
+
+    renamed = {}
+    for old in sorted(referenced(db)):
+        path = os.path.join(upload_dir, old)
+        if os.path.isfile(path):
+            renamed[old] = store_file(upload_dir, path)[0]
+
+    rewritten = 0
+    for old, new in renamed.items():
+        for table, col in REFERENCES:
+            rewritten += db.execute(
+                f"UPDATE {table} SET {col} = ? WHERE {col} = ?", (new, old)
+            ).rowcount
+    db.execute(
+        "INSERT OR REPLACE INTO app_state (key, value) VALUES (?, 1)", (_MIGRATED_KEY,)
+    )
+    db.commit()
+
+    # Only now that the references point at the new names
+    for old, new in renamed.items():
+        if old != new:
+            try:
+                os.remove(os.path.join(upload_dir, old))
+            except OSError:
+                pass
+    shutil.rmtree(os.path.join(upload_dir, "chat"), ignore_errors=True)
+    if rewritten:
+        log.info("Moved %d upload reference(s) to content-addressed names", rewritten)
+    return rewritten
@@ -0,0 +1,158 @@
+"""
+Derived image sizes for wine photos.
+
+Uploads are stored once, downscaled to ``MAX_IMAGE_PX``. Cards, the wine
+detail panel and chat bubbles only need a fraction of that, so smaller
+variants are generated on first request and cached as files:
+
+    <cache_dir>/<source filename>.<size>.<webp|jpg>
+
+A variant is regenerated when its source is newer, and ``prune()`` removes
+variants whose source is gone. Everything here works on plain paths; the
+Flask routes live in ``app.py``.
+
+``load_scaled()`` is the shared decode path for every resize (uploads,
+variants, AI payloads): JPEGs are decoded at a reduced DCT scale instead of
+full resolution, so a 48 MP phone photo never becomes a 140 MB pixel buffer.
+"""
+
+from __future__ import annotations
+
+import os
+import secrets
+
+# Longest edge in pixels per size name ("full" is the stored upload itself)
+SIZES = {
+    "thumb": 480,
+    "modal": 1000,
+}
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpg": ("JPEG", "image/jpeg"),
+}
+
+QUALITY = 80
+
+# ``resize`` first shrinks by an integer factor with ``reduce()`` while the
+# image is at least this multiple of the target, then finishes with LANCZOS
+# (same default as ``Image.thumbnail``).
+REDUCING_GAP = 2.0
+
+# Refuse to decode more pixels than this. JPEGs are checked after draft
+# mode has scaled them down, so only other formats can realistically hit it.
+MAX_DECODE_PIXELS = 50_000_000
+
+_ORIENTATION_TAG = 0x0112
+
+
+def fit(size, max_px):
+    """``size`` scaled down so its longest edge is at most ``max_px``."""
+    w, h = size
+    if max(w, h) <= max_px:
+        return size
+    ratio = max_px / max(w, h)
+    return max(1, int(w * ratio)), max(1, int(h * ratio))
+
+
+def is_final(img, max_px) -> bool:
+    """True if an opened image is small enough and upright (nothing to do)."""
+    return max(img.size) <= max_px and img.getexif().get(_ORIENTATION_TAG, 1) == 1
+
+
+def load_scaled(img, max_px):
+    """Decode a freshly opened image upright, longest edge ≤ ``max_px``.
+
+    JPEGs use draft mode to decode at the smallest DCT scale (1/2, 1/4 or
+    1/8) that is still at least the target size; the scaled IDCT averages
+    like a box filter, so little quality is lost. The remaining factor is
+    done by ``resize`` with ``reducing_gap``, i.e. a cheap ``reduce()``
+    followed by LANCZOS. Raises ``ValueError`` above ``MAX_DECODE_PIXELS``.
+    """
+    from PIL import Image, ImageOps
+
+    target = fit(img.size, max_px)
+    if target != img.size:
+        img.draft(None, target)
+    if img.size[0] * img.size[1] > MAX_DECODE_PIXELS:
+        raise ValueError(f"image too large to decode: {img.size[0]}x{img.size[1]}")
+    img = ImageOps.exif_transpose(img)
+    target = fit(img.size, max_px)
+    if target != img.size:
+        img = img.resize(target, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+    return img
+
+
+def variant_name(filename: str, size: str, fmt: str) -> str:
+    return f"{filename}.{size}.{fmt}"
+
+
+def source_name(variant: str) -> str | None:
+    """Inverse of ``variant_name()``; None for foreign files."""
+    parts = variant.rsplit(".", 2)
+    if len(parts) != 3 or parts[1] not in SIZES or parts[2] not in FORMATS:
+        return None
+    return parts[0]
+
+
+def _render(source: str, target: str, size: str, fmt: str) -> None:
+    from PIL import Image
+
+    with Image.open(source) as img:
+        img = load_scaled(img, SIZES[size])
+        if fmt == "jpg" and img.mode != "RGB":
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        tmp = f"{target}.{secrets.token_hex(4)}.part"
+        try:
+            img.save(tmp, format=FORMATS[fmt][0], quality=QUALITY)
+            os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def get_variant(upload_dir: str, cache_dir: str, filename: str, size: str, fmt: str) -> str | None:
+    """Path of the cached variant, generating it if missing or stale.
+
+    Returns None when the source does not exist. Decoding errors propagate
+    so the caller can fall back to the original file.
+    """
+    source = os.path.join(upload_dir, filename)
+    try:
+        source_mtime = os.path.getmtime(source)
+    except OSError:
+        return None
+    target = os.path.join(cache_dir, variant_name(filename, size, fmt))
+    try:
+        if os.path.getmtime(target) >= source_mtime:
+            return target
+    except OSError:
+        pass
+    os.makedirs(cache_dir, exist_ok=True)
+    _render(source, target, size, fmt)
+    return target
+
+
+def prune(upload_dir: str, cache_dir: str) -> int:
+    """Delete cached variants whose source image no longer exists.
+
+    Also removes leftover ``.part`` files. Returns the number of files removed.
+    """
+    removed = 0
+    try:
+        entries = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        source = source_name(entry)
+        if source is not None and os.path.isfile(os.path.join(upload_dir, source)):
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, entry))
+            removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,323 @@
+"""
+Background jobs for Wine Tracker.
+
+Long-running work (backup export / import, bulk AI re-analysis) runs in a
+small per-process thread pool instead of the request thread, so a large
+restore no longer holds a web worker until the HA ingress proxy times out.
+
+Every job has a row in the ``jobs`` table of a separate SQLite file next
+to the wine database. Keeping it separate means progress can be written
+while the job itself holds the write lock on ``wine.db`` (the import runs
+in one big transaction), and any worker process can answer
+``/api/jobs/<id>`` polls.
+
+Status flow: ``queued`` → ``running`` → ``done`` | ``failed``. Each
+unfinished job records the pid of the worker that owns it, and that worker
+refreshes its ``heartbeat`` every ``HEARTBEAT_INTERVAL`` seconds. A worker
+killed by a Gunicorn timeout, recycled by ``max_requests`` or replaced on
+SIGHUP takes its jobs with it; ``reap()`` marks them ``failed`` when their
+status is read or a new worker starts. ``recover()`` fails all of them when
+the whole server restarts.
+
+``WorkerPool`` is the bare per-process thread pool underneath; it is also
+used for fire-and-forget work that needs no job record (image downscaling).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+# Minimum seconds between two progress writes of the same job.
+PROGRESS_INTERVAL = 0.5
+
+# Finished jobs (and their files) are kept this long.
+KEEP_DAYS = 7
+
+# Seconds between two heartbeats of the jobs a worker owns, and the silence
+# after which a job is considered orphaned even if its pid is still in use.
+HEARTBEAT_INTERVAL = 10
+STALE_AFTER = 60
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id          TEXT PRIMARY KEY,
+        kind        TEXT NOT NULL,
+        status      TEXT NOT NULL,
+        stage       TEXT,
+        done        INTEGER NOT NULL DEFAULT 0,
+        total       INTEGER NOT NULL DEFAULT 0,
+        result      TEXT,
+        error       TEXT,
+        created     TEXT NOT NULL,
+        updated     TEXT NOT NULL,
+        pid         INTEGER,
+        heartbeat   TEXT
+    )
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open the jobs database, creating the table on first use."""
+    conn = sqlite3.connect(path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(_SCHEMA)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(jobs)")}
+    for col, decl in (("pid", "INTEGER"), ("heartbeat", "TEXT")):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {col} {decl}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, updated)")
+    conn.commit()
+    return conn
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _reap(conn: sqlite3.Connection, job_id: str | None = None) -> list[str]:
+    cutoff = (datetime.now() - timedelta(seconds=STALE_AFTER)).isoformat(timespec="seconds")
+    sql = "SELECT id, pid, heartbeat FROM jobs WHERE status IN ('queued', 'running')"
+    params = ()
+    if job_id is not None:
+        sql += " AND id = ?"
+        params = (job_id,)
+    stale = [r["id"] for r in conn.execute(sql, params)
+             if r["heartbeat"] is None or r["heartbeat"] < cutoff or not _alive(r["pid"])]
+    for sid in stale:
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'interrupted', updated = ? "
+            "WHERE id = ? AND status IN ('queued', 'running')", (_now(), sid)
+        )
+    conn.commit()
+    return stale
+
+
+def _update(path: str, job_id: str, **fields) -> None:
+    fields["updated"] = _now()
+    sets = ", ".join(f"{k} = ?" for k in fields)
+    conn = connect(path)
+    try:
+        conn.execute(f"UPDATE jobs SET {sets} WHERE id = ?", (*fields.values(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get(path: str, job_id: str) -> dict | None:
+    """The job as a JSON-ready dict, or None if unknown.
+
+    An unfinished job whose worker is gone is marked failed first, so
+    pollers see the outcome instead of waiting forever.
+    """
+    conn = connect(path)
+    try:
+        _reap(conn, job_id)
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def reap(path: str) -> list[str]:
+    """Fail unfinished jobs whose worker died or stopped sending heartbeats.
+
+    Safe to call while other workers run jobs. Returns the ids it failed.
+    """
+    conn = connect(path)
+    try:
+        return _reap(conn)
+    finally:
+        conn.close()
+
+
+def recover(path: str) -> list[str]:
+    """Fail jobs a previous process left unfinished; prune old ones.
+
+    Returns the ids of the jobs that were marked as interrupted.
+    """
+    conn = connect(path)
+    try:
+        stale = [r[0] for r in conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running')"
+        )]
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'interrupted', updated = ? "
+            "WHERE status IN ('queued', 'running')", (_now(),)
+        )
+        cutoff = (datetime.now() - timedelta(days=KEEP_DAYS)).isoformat(timespec="seconds")
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (cutoff,))
+        conn.commit()
+    finally:
+        conn.close()
+    return stale
+
+
+class JobContext:
+    """Handed to a job function as its first argument."""
+
+    def __init__(self, path: str, job_id: str):
+        self.path = path
+        self.id = job_id
+        self._last_write = 0.0
+        self._stage = None
+
+    def progress(self, stage: str, done: int, total: int) -> None:
+        """Report progress; writes are throttled to ``PROGRESS_INTERVAL``."""
+        now = time.monotonic()
+        if stage == self._stage and done < total and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._stage, self._last_write = stage, now
+        _update(self.path, self.id, stage=stage, done=done, total=total)
+
+
+class WorkerPool:
+    """A ``ThreadPoolExecutor`` created lazily in each process.
+
+    Threads do not survive the fork of a preloaded Gunicorn master, so the
+    executor is (re)created on first use in every worker.
+    """
+
+    def __init__(self, max_workers: int = 2, name: str = "worker"):
+        self.max_workers = max_workers
+        self.name = name
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=self.name)
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor().submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+class JobRunner:
+    """Bounded thread pool that runs job functions and records their outcome."""
+
+    def __init__(self, max_workers: int = 2):
+        self._pool = WorkerPool(max_workers, "job")
+        self._futures = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+        self._beat_pid = None
+        self._stop = threading.Event()
+
+    def submit(self, path: str, kind: str, fn, *args, **kwargs) -> str:
+        """Queue ``fn(ctx, *args, **kwargs)`` and return the new job id.
+
+        Whatever ``fn`` returns (JSON-serializable) becomes the job result;
+        an exception marks the job as failed with its message.
+        """
+        job_id = secrets.token_urlsafe(12)
+        now = _now()
+        conn = connect(path)
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, created, updated, pid, heartbeat) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, now, now, os.getpid(), now),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self._start_heartbeat()
+        self._paths[job_id] = path
+        future = self._pool.submit(self._run, path, job_id, fn, args, kwargs)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return job_id
+
+    def _forget(self, job_id: str) -> None:
+        self._futures.pop(job_id, None)
+        self._paths.pop(job_id, None)
+
+    def _start_heartbeat(self) -> None:
+        # Like the pool, the thread does not survive a fork
+        with self._lock:
+            if self._beat_pid == os.getpid():
+                return
+            self._beat_pid = os.getpid()
+            self._stop = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(self._stop,),
+                             name="job-heartbeat", daemon=True).start()
+
+    def _heartbeat(self, stop: threading.Event) -> None:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            by_path = {}
+            for job_id, path in list(self._paths.items()):
+                by_path.setdefault(path, []).append(job_id)
+            for path, ids in by_path.items():
+                try:
+                    conn = connect(path)
+                    try:
+                        conn.executemany(
+                            "UPDATE jobs SET heartbeat = ? WHERE id = ?",
+                            [(_now(), job_id) for job_id in ids],
+                        )
+                        conn.commit()
+                    finally:
+                        conn.close()
+                except sqlite3.Error:
+                    log.warning("Job heartbeat failed", exc_info=True)
+
+    @staticmethod
+    def _run(path, job_id, fn, args, kwargs):
+        _update(path, job_id, status="running")
+        try:
+            result = fn(JobContext(path, job_id), *args, **kwargs)
+        except Exception as e:
+            log.exception("Job %s failed", job_id)
+            _update(path, job_id, status="failed", error=str(e) or type(e).__name__)
+            return
+        _update(path, job_id, status="done", result=json.dumps(result, default=str))
+
+    def wait(self, job_id: str, timeout: float | None = None) -> None:
+        """Block until a job submitted by this process has finished."""
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait)
+        with self._lock:
+            self._stop.set()
+            self._beat_pid = None
@@ -0,0 +1,432 @@
+"""
+Versioned schema migrations for Wine Tracker.
+
+The schema version is stored in ``PRAGMA user_version``. ``migrate(db)``
+runs every step in ``MIGRATIONS`` above the stored version, each inside its
+own transaction together with the version bump, so a failed step leaves the
+database at the previous version and is retried on the next start.
+
+Append new steps to the end of ``MIGRATIONS`` – never edit or reorder a
+step that has already been released.
+
+``check_query_plans(db)`` runs ``EXPLAIN QUERY PLAN`` for the hot queries of
+the app and reports whether each one is served by the index it was built for.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import time
+
+import cellar_stats
+
+
+# Columns added to `wines` after the first release, in the order they were
+# introduced. Only used to adopt databases created before user_version.
+_LEGACY_WINE_COLUMNS = {
+    "purchased_at":   "TEXT",
+    "price":          "REAL",
+    "drink_from":     "INTEGER",
+    "drink_until":    "INTEGER",
+    "location":       "TEXT",
+    "grape":          "TEXT",
+    "vivino_id":      "INTEGER",
+    "bottle_format":  "REAL DEFAULT 0.75",
+    "maturity_data":  "TEXT",
+    "taste_profile":  "TEXT",
+    "food_pairings":  "TEXT",
+}
+
+_TIMELINE_DDL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id        INTEGER PRIMARY KEY AUTOINCREMENT,
+        wine_id   INTEGER NOT NULL,
+        action    TEXT NOT NULL,
+        quantity  INTEGER DEFAULT 1,
+        timestamp TEXT NOT NULL
+    )
+"""
+
+
+def _m001_baseline(db):
+    """Create the base schema, adopting databases from before user_version."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS wines (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            name          TEXT    NOT NULL,
+            year          INTEGER,
+            type          TEXT,
+            region        TEXT,
+            quantity      INTEGER DEFAULT 1,
+            rating        INTEGER DEFAULT 0,
+            notes         TEXT,
+            image         TEXT,
+            added         TEXT
+        )
+    """)
+    existing = {row[1] for row in db.execute("PRAGMA table_info(wines)")}
+    for col, dtype in _LEGACY_WINE_COLUMNS.items():
+        if col not in existing:
+            db.execute(f"ALTER TABLE wines ADD COLUMN {col} {dtype}")
+
+    db.execute(_TIMELINE_DDL.format(name="timeline"))
+    # Timeline rows outlive their wine (deleted wines stay in the history,
+    # chat entries use wine_id 0), so older DBs lose the FOREIGN KEY on
+    # wine_id – it would reject both now that foreign_keys is ON.
+    if db.execute("PRAGMA foreign_key_list(timeline)").fetchall():
+        db.execute(_TIMELINE_DDL.format(name="timeline_new"))
+        db.execute(
+            "INSERT INTO timeline_new (id, wine_id, action, quantity, timestamp) "
+            "SELECT id, wine_id, action, quantity, timestamp FROM timeline"
+        )
+        db.execute("DROP TABLE timeline")
+        db.execute("ALTER TABLE timeline_new RENAME TO timeline")
+
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            title     TEXT,
+            created   TEXT NOT NULL,
+            updated   TEXT NOT NULL
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            role       TEXT NOT NULL,
+            content    TEXT NOT NULL,
+            timestamp  TEXT NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE
+        )
+    """)
+    chat_cols = {row[1] for row in db.execute("PRAGMA table_info(chat_messages)")}
+    if "image_path" not in chat_cols:
+        db.execute("ALTER TABLE chat_messages ADD COLUMN image_path TEXT")
+
+
+def _m002_indexes(db):
+    """Secondary indexes for the list, stats, timeline, chat and import queries."""
+    # index(): ORDER BY type, name, year (+ type filter, DISTINCT type)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_type_name_year ON wines(type, name, year)")
+    # stats_page() / inject_globals(): per-region sums and DISTINCT region
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_region_quantity ON wines(region, quantity)")
+    # inject_globals(): datalists
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_grape ON wines(grape)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_location ON wines(location)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_purchased_at ON wines(purchased_at)")
+    # stats_page() / api_summary(): WHERE quantity > 0 / = 0
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_quantity ON wines(quantity)")
+    # match_wines(): covering index, avoids reading notes / AI blobs
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_match ON wines(vivino_id, name, year)")
+    # api_timeline() / stats_page(): timestamp range, covering for the stock chart
+    db.execute("CREATE INDEX IF NOT EXISTS idx_timeline_timestamp ON timeline(timestamp, action, quantity)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_timeline_wine ON timeline(wine_id)")
+    # api_chat_sessions_list() and the chat history lookups
+    db.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages(session_id, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions(updated)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_created ON chat_sessions(created)")
+
+
+def _m003_cellar_revision(db):
+    """Add a revision counter that every write to `wines` bumps.
+
+    In-process caches (datalists, summaries) key on it, so a write from any
+    worker process – or any code path – invalidates them everywhere.
+    """
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS app_state (
+            key   TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    db.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES ('cellar_rev', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS wines_rev_{event.lower()}
+            AFTER {event} ON wines
+            BEGIN
+                UPDATE app_state SET value = value + 1 WHERE key = 'cellar_rev';
+            END
+        """)
+
+
+# ── Full-text search ──────────────────────────────────────────────────────────
+
+# Columns of `wines` mirrored into the FTS5 index (external content, so the
+# text itself is only stored once, in `wines`).
+FTS_COLUMNS = ("name", "region", "grape", "location", "notes", "food_pairings", "year")
+
+
+def fts5_available(db) -> bool:
+    """Whether this SQLite build ships the FTS5 extension."""
+    try:
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp._fts5_probe USING fts5(x)")
+        db.execute("DROP TABLE temp._fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def create_search_index(db) -> bool:
+    """Create ``wines_fts`` and its sync triggers. Returns False without FTS5.
+
+    ``remove_diacritics 2`` folds accents on both sides ("Rhone" finds
+    "Rhône"), the prefix indexes keep search-as-you-type queries cheap.
+    """
+    if not fts5_available(db):
+        return False
+    cols = ", ".join(FTS_COLUMNS)
+    new_vals = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_vals = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    db.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS wines_fts USING fts5(
+            {cols},
+            content='wines', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS wines_fts_insert AFTER INSERT ON wines BEGIN
+            INSERT INTO wines_fts (rowid, {cols}) VALUES (new.id, {new_vals});
+        END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS wines_fts_delete AFTER DELETE ON wines BEGIN
+            INSERT INTO wines_fts (wines_fts, rowid, {cols}) VALUES ('delete', old.id, {old_vals});
+        END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS wines_fts_update AFTER UPDATE OF {cols} ON wines BEGIN
+            INSERT INTO wines_fts (wines_fts, rowid, {cols}) VALUES ('delete', old.id, {old_vals});
+            INSERT INTO wines_fts (rowid, {cols}) VALUES (new.id, {new_vals});
+        END
+    """)
+    return True
+
+
+def rebuild_search_index(db) -> bool:
+    """Re-index every wine from scratch. Returns False if there is no index."""
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'wines_fts'").fetchone():
+        return False
+    db.execute("INSERT INTO wines_fts (wines_fts) VALUES ('rebuild')")
+    db.execute("INSERT INTO wines_fts (wines_fts) VALUES ('optimize')")
+    return True
+
+
+def _m004_search_index(db):
+    """FTS5 index over the searchable wine columns, populated from `wines`.
+
+    Without FTS5 this is a no-op and search falls back to LIKE; the
+    ``rebuild-search`` command creates the index later if FTS5 shows up.
+    """
+    if create_search_index(db):
+        rebuild_search_index(db)
+
+
+def _m005_cellar_stats(db):
+    """Materialized statistics (see cellar_stats.py) and a timeline revision.
+
+    The stats page snapshot depends on the timeline as well (stock history),
+    so timeline writes bump their own counter in app_state.
+    """
+    cellar_stats.install(db)
+    db.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES ('timeline_rev', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS timeline_rev_{event.lower()}
+            AFTER {event} ON timeline
+            BEGIN
+                UPDATE app_state SET value = value + 1 WHERE key = 'timeline_rev';
+            END
+        """)
+    # Remaining stats_page() lookups: cheapest / priciest, oldest / newest,
+    # best rated
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_price ON wines(price)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_year ON wines(year)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_wines_rating_name ON wines(rating, name)")
+
+
+def _m006_chat_revision(db):
+    """Revision counter for chat sessions.
+
+    Timeline responses show chat session titles, so their ETag has to
+    change when a session is created, renamed or deleted.
+    """
+    db.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES ('chat_rev', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS chat_sessions_rev_{event.lower()}
+            AFTER {event} ON chat_sessions
+            BEGIN
+                UPDATE app_state SET value = value + 1 WHERE key = 'chat_rev';
+            END
+        """)
+
+
+def _m007_analysis_cache(db):
+    """Cache of AI label analyses (see analysis_cache.py)."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            key       TEXT PRIMARY KEY,
+            fields    TEXT NOT NULL,
+            created   REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache(last_used)")
+
+
+def _m008_wine_list_order(db):
+    """Expression index for the keyset-paginated cellar list.
+
+    Matches ``WINE_LIST_ORDER`` in app.py; the NULL-safe keys let the next
+    page start right after the previous one instead of at an OFFSET.
+    """
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_wines_list_order "
+        "ON wines(COALESCE(type, ''), name, COALESCE(year, 0))"
+    )
+
+
+MIGRATIONS = [
+    _m001_baseline,
+    _m002_indexes,
+    _m003_cellar_revision,
+    _m004_search_index,
+    _m005_cellar_stats,
+    _m006_chat_revision,
+    _m007_analysis_cache,
+    _m008_wine_list_order,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db) -> list[int]:
+    """Bring ``db`` up to ``SCHEMA_VERSION``. Returns the versions applied.
+
+    A database with a newer version than this code knows about is left
+    untouched (downgrades are not supported).
+    """
+    applied = []
+    current = schema_version(db)
+    for version, step in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            step(db)
+            db.execute(f"PRAGMA user_version = {version}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+# ── Query plan check ──────────────────────────────────────────────────────────
+
+# (label, sql, params, index expected in the plan). Keep these in sync with
+# the queries in app.py / export_import.py they stand in for.
+HOT_QUERIES = [
+    ("index: list page",
+     "SELECT id, name, quantity FROM wines WHERE 1=1 "
+     "ORDER BY COALESCE(type, '') ASC, name ASC, COALESCE(year, 0) ASC, id ASC LIMIT ?",
+     (61,), "idx_wines_list_order"),
+    ("index: in-stock page",
+     "SELECT id, name, quantity FROM wines WHERE 1=1 AND quantity > 0 "
+     "ORDER BY COALESCE(type, '') ASC, name ASC, COALESCE(year, 0) ASC, id ASC LIMIT ?",
+     (61,), "idx_wines_list_order"),
+    ("index: type filter",
+     "SELECT id, name, quantity FROM wines WHERE 1=1 AND COALESCE(type, '') = ? "
+     "AND (name, COALESCE(year, 0), id) > (?, ?, ?) AND name >= ? "
+     "ORDER BY name ASC, COALESCE(year, 0) ASC, id ASC LIMIT ?",
+     ("Rotwein", "M", 2015, 40, "M", 61), "idx_wines_list_order"),
+    ("index: next page",
+     "SELECT id, name, quantity FROM wines WHERE 1=1 AND quantity > 0 "
+     "AND (COALESCE(type, ''), name, COALESCE(year, 0), id) > (?, ?, ?, ?) AND COALESCE(type, '') >= ? "
+     "ORDER BY COALESCE(type, '') ASC, name ASC, COALESCE(year, 0) ASC, id ASC LIMIT ?",
+     ("Rotwein", "M", 2015, 40, "Rotwein", 61), "idx_wines_list_order"),
+    ("index: used types",
+     "SELECT DISTINCT type FROM wines WHERE type IS NOT NULL AND type != '' ORDER BY type",
+     (), "idx_wines_type_name_year"),
+    ("datalist: regions",
+     "SELECT DISTINCT region FROM wines WHERE region IS NOT NULL AND region != '' ORDER BY region",
+     (), "idx_wines_region_quantity"),
+    ("datalist: grapes",
+     "SELECT DISTINCT grape FROM wines WHERE grape IS NOT NULL AND grape != '' ORDER BY grape",
+     (), "idx_wines_grape"),
+    ("datalist: locations",
+     "SELECT DISTINCT location FROM wines WHERE location IS NOT NULL AND location != '' ORDER BY location",
+     (), "idx_wines_location"),
+    ("datalist: purchased_at",
+     "SELECT DISTINCT purchased_at FROM wines WHERE purchased_at IS NOT NULL AND purchased_at != '' ORDER BY purchased_at",
+     (), "idx_wines_purchased_at"),
+    ("stats: most expensive",
+     "SELECT id, name, year, type, price FROM wines WHERE price IS NOT NULL ORDER BY price DESC LIMIT 1",
+     (), "idx_wines_price"),
+    ("stats: cheapest",
+     "SELECT id, name, year, type, price FROM wines WHERE price IS NOT NULL AND price > 0 ORDER BY price ASC LIMIT 1",
+     (), "idx_wines_price"),
+    ("stats: oldest",
+     "SELECT name, year, type FROM wines WHERE year IS NOT NULL AND year > 0 ORDER BY year ASC LIMIT 1",
+     (), "idx_wines_year"),
+    ("stats: best rated",
+     "SELECT id, name, year, type, rating, quantity FROM wines WHERE rating > 0 ORDER BY rating DESC, name LIMIT 5",
+     (), "idx_wines_rating_name"),
+    ("stats: stock history",
+     "SELECT action, quantity, timestamp FROM timeline "
+     "WHERE action IN ('added','consumed','restocked','removed') AND timestamp >= ? ORDER BY timestamp",
+     ("2000-01-01",), "idx_timeline_timestamp"),
+    ("timeline: page",
+     "SELECT wl.id, MAX(wl.timestamp) AS ts FROM timeline wl "
+     "WHERE wl.timestamp >= ? AND wl.timestamp < ? "
+     "GROUP BY wl.wine_id, wl.action, substr(wl.timestamp, 1, 10), CASE WHEN wl.action = 'chat' THEN wl.id END "
+     "ORDER BY ts DESC, wl.id DESC LIMIT ?",
+     ("2000-01-01", "2100-01-01", 101), "idx_timeline_timestamp"),
+    ("timeline: chat session lookup",
+     "SELECT id, title FROM chat_sessions WHERE created <= ? ORDER BY created DESC LIMIT 1",
+     ("2100-01-01",), "idx_chat_sessions_created"),
+    ("chat: sessions list",
+     "SELECT cs.id, COUNT(cm.id) FROM chat_sessions cs "
+     "LEFT JOIN chat_messages cm ON cm.session_id = cs.id GROUP BY cs.id ORDER BY cs.updated DESC",
+     (), "idx_chat_messages_session"),
+    ("chat: history",
+     "SELECT role, content FROM chat_messages WHERE session_id = ? ORDER BY id",
+     (1,), "idx_chat_messages_session"),
+    ("import: match wines",
+     "SELECT id, name, year, vivino_id FROM wines",
+     (), "idx_wines_match"),
+]
+
+
+def check_query_plans(db, queries=None) -> list[dict]:
+    """Explain and time each hot query.
+
+    Returns one dict per query: ``label``, ``index`` (expected), ``ok``
+    (whether the plan mentions the index), ``plan`` (the plan details joined
+    by ``"; "``) and ``ms`` (wall time of running the query once).
+    """
+    results = []
+    for label, sql, params, index in (queries or HOT_QUERIES):
+        plan = "; ".join(
+            row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        )
+        start = time.perf_counter()
+        db.execute(sql, params).fetchall()
+        elapsed = (time.perf_counter() - start) * 1000
+        results.append({
+            "label": label,
+            "index": index,
+            "ok": index in plan,
+            "plan": plan,
+            "ms": round(elapsed, 2),
+        })
+    return results
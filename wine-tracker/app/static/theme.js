@@ -232,24 +232,139 @@ function confirmImport() {
       'Content-Type': 'application/json',
       'X-Requested-With': 'XMLHttpRequest',
     },
-    body: JSON.stringify({ token: _importToken, strategy: strategy }),
+    body: JSON.stringify({ token: _importToken, strategy: strategy, background: true }),
   })
     .then(function(r) { return r.json().then(function(j) { return { ok: r.ok, body: j }; }); })
     .then(function(res) {
-      if (!res.ok || !res.body.ok) {
-        _showImportError(res.body.error || 'Import fehlgeschlagen');
-        return;
-      }
+      if (!res.ok || !res.body.ok) throw new Error(res.body.error || 'Import fehlgeschlagen');
+      return waitForJob(res.body.job_id, function(job) {
+        if (btn && job.total) btn.textContent = Math.floor(100 * job.done / job.total) + ' %';
+      });
+    })
+    .then(function() {
       // Success — reload so the new wines appear.
       closeModal('importPreviewModal');
       location.reload();
     })
-    .catch(function(err) { _showImportError(String(err)); })
+    .catch(function(err) { _showImportError(err.message || String(err)); })
     .finally(function() {
       if (btn) { btn.disabled = false; btn.textContent = btn.getAttribute('data-label') || 'Import'; }
     });
 }
 
+// Fill in maturity / taste profile / food pairings for all wines lacking
+// them (background job); the button shows the progress.
+function startEnrichment(btn) {
+  var label = btn.querySelector('span');
+  var hint = document.getElementById('enrichHint');
+  btn.disabled = true;
+  label.textContent = '…';
+
+  fetch(_ingressPrefix() + '/api/jobs/enrich', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest' },
+    body: JSON.stringify({}),
+  })
+    .then(function(r) { return r.json(); })
+    .then(function(res) {
+      if (!res.ok) throw new Error(res.error || 'Job fehlgeschlagen');
+      if (!res.job_id) return null;
+      return waitForJob(res.job_id, function(job) {
+        if (job.total) label.textContent = Math.floor(100 * job.done / job.total) + ' %';
+      });
+    })
+    .then(function(job) {
+      if (!job) {
+        hint.textContent = btn.getAttribute('data-none');
+        return;
+      }
+      hint.textContent = btn.getAttribute('data-done')
+        .replace('{updated}', job.result.updated.length)
+        .replace('{failed}', Object.keys(job.result.failed).length);
+    })
+    .catch(function(err) { hint.textContent = err.message || String(err); })
+    .finally(function() {
+      btn.disabled = false;
+      label.textContent = btn.getAttribute('data-label');
+    });
+}
+
+// Poll /api/jobs/<id> until the job is done; resolves with the job,
+// rejects with its error. onProgress(job) is called on every poll.
+function waitForJob(jobId, onProgress) {
+  return new Promise(function(resolve, reject) {
+    function poll() {
+      fetch(_ingressPrefix() + '/api/jobs/' + encodeURIComponent(jobId), {
+          headers: { 'X-Requested-With': 'XMLHttpRequest' },
+        })
+        .then(function(r) { return r.json(); })
+        .then(function(res) {
+          if (!res.ok) return reject(new Error(res.error || 'Job fehlgeschlagen'));
+          var job = res.job;
+          if (onProgress) onProgress(job);
+          if (job.status === 'done') return resolve(job);
+          if (job.status === 'failed') return reject(new Error(job.error || 'Job fehlgeschlagen'));
+          setTimeout(poll, 1000);
+        })
+        .catch(reject);
+    }
+    poll();
+  });
+}
+
+// POST a chat message to /api/chat/stream and read the Server-Sent Events.
+// onText(text) is called with the reply so far on every delta; resolves
+// with the final body (same as /api/chat), also for JSON error responses.
+function streamChat(url, fetchOpts, onText) {
+  return fetch(url, fetchOpts).then(function(r) {
+    if ((r.headers.get('Content-Type') || '').indexOf('text/event-stream') !== 0) {
+      return r.json();
+    }
+    var text = '';
+    var result = null;
+    var buffer = '';
+    function handle(block) {
+      var event = 'message';
+      var data = '';
+      block.split('\n').forEach(function(line) {
+        if (line.indexOf('event:') === 0) event = line.slice(6).trim();
+        else if (line.indexOf('data:') === 0) data += line.slice(5).trim();
+      });
+      if (!data) return;
+      var payload = JSON.parse(data);
+      if (event === 'delta') {
+        text += payload.text;
+        if (onText) onText(text);
+      } else if (event === 'done' || event === 'error') {
+        result = payload;
+      }
+    }
+    function feed(chunk) {
+      buffer += chunk;
+      var parts = buffer.split('\n\n');
+      buffer = parts.pop();
+      parts.forEach(handle);
+    }
+    function finish() {
+      if (buffer.trim()) handle(buffer);
+      return result || {ok: false, error: 'stream_interrupted'};
+    }
+    if (!r.body || !r.body.getReader || typeof TextDecoder === 'undefined') {
+      return r.text().then(function(all) { feed(all); return finish(); });
+    }
+    var reader = r.body.getReader();
+    var decoder = new TextDecoder();
+    function pump() {
+      return reader.read().then(function(step) {
+        if (step.done) return finish();
+        feed(decoder.decode(step.value, {stream: true}));
+        return pump();
+      });
+    }
+    return pump();
+  });
+}
+
 // Apply theme name on load (mode is handled by inline script + OS listener)
 (function() {
   var name = localStorage.getItem('wine-theme-name') || 'homeassistant';
@@ -36,6 +36,11 @@ TRANSLATIONS = {
     "data_import_hint": "ZIP- oder CSV-Datei einspielen. Duplikate kannst du vor dem Import prüfen.",
     "btn_export_download": "Sicherung herunterladen",
     "btn_import_choose": "Datei wählen …",
+    "data_enrich": "KI-Anreicherung",
+    "data_enrich_hint": "Reifephasen, Geschmacksprofil und Speiseempfehlungen für alle Weine ergänzen, denen sie fehlen.",
+    "btn_enrich": "Weine anreichern",
+    "enrich_done": "{updated} Weine ergänzt, {failed} fehlgeschlagen.",
+    "enrich_none": "Alle Weine sind bereits angereichert.",
     "import_preview_title": "Import-Vorschau",
     "import_preview_loading": "Datei wird analysiert …",
     "import_summary_new": "neu",
@@ -325,6 +330,11 @@ TRANSLATIONS = {
     "data_import_hint": "Restore from a ZIP or CSV file. You can review duplicates before importing.",
     "btn_export_download": "Download backup",
     "btn_import_choose": "Choose file …",
+    "data_enrich": "AI enrichment",
+    "data_enrich_hint": "Fill in maturity phases, taste profile and food pairings for every wine that lacks them.",
+    "btn_enrich": "Enrich wines",
+    "enrich_done": "{updated} wines enriched, {failed} failed.",
+    "enrich_none": "All wines are already enriched.",
     "import_preview_title": "Import preview",
     "import_preview_loading": "Analysing file …",
     "import_summary_new": "new",
@@ -603,6 +613,11 @@ TRANSLATIONS = {
     "data_import_hint": "Restaurer depuis un fichier ZIP ou CSV. Les doublons peuvent être vérifiés avant l'import.",
     "btn_export_download": "Télécharger la sauvegarde",
     "btn_import_choose": "Choisir un fichier …",
+    "data_enrich": "Enrichissement IA",
+    "data_enrich_hint": "Compléter les phases de maturité, le profil gustatif et les accords mets-vins de tous les vins qui en manquent.",
+    "btn_enrich": "Enrichir les vins",
+    "enrich_done": "{updated} vins enrichis, {failed} en échec.",
+    "enrich_none": "Tous les vins sont déjà enrichis.",
     "import_preview_title": "Aperçu de l'import",
     "import_preview_loading": "Analyse du fichier …",
     "import_summary_new": "nouveaux",
@@ -881,6 +896,11 @@ TRANSLATIONS = {
     "data_import_hint": "Ripristina da un file ZIP o CSV. I duplicati possono essere verificati prima dell'import.",
     "btn_export_download": "Scarica backup",
     "btn_import_choose": "Scegli file …",
+    "data_enrich": "Arricchimento IA",
+    "data_enrich_hint": "Completa fasi di maturazione, profilo gustativo e abbinamenti per tutti i vini che ne sono privi.",
+    "btn_enrich": "Arricchisci vini",
+    "enrich_done": "{updated} vini arricchiti, {failed} non riusciti.",
+    "enrich_none": "Tutti i vini sono già arricchiti.",
     "import_preview_title": "Anteprima import",
     "import_preview_loading": "Analisi del file …",
     "import_summary_new": "nuovi",
@@ -1159,6 +1179,11 @@ TRANSLATIONS = {
     "data_import_hint": "Restaurar desde un archivo ZIP o CSV. Los duplicados se pueden revisar antes de importar.",
     "btn_export_download": "Descargar copia de seguridad",
     "btn_import_choose": "Elegir archivo …",
+    "data_enrich": "Enriquecimiento IA",
+    "data_enrich_hint": "Completa las fases de maduración, el perfil de sabor y los maridajes de todos los vinos que no los tienen.",
+    "btn_enrich": "Enriquecer vinos",
+    "enrich_done": "{updated} vinos enriquecidos, {failed} fallidos.",
+    "enrich_none": "Todos los vinos ya están enriquecidos.",
     "import_preview_title": "Vista previa de importación",
     "import_preview_loading": "Analizando archivo …",
     "import_summary_new": "nuevos",
@@ -1437,6 +1462,11 @@ TRANSLATIONS = {
     "data_import_hint": "Restaurar a partir de um arquivo ZIP ou CSV. Duplicatas podem ser revisadas antes de importar.",
     "btn_export_download": "Baixar backup",
     "btn_import_choose": "Escolher arquivo …",
+    "data_enrich": "Enriquecimento IA",
+    "data_enrich_hint": "Completa as fases de maturação, o perfil de sabor e as harmonizações de todos os vinhos que não os têm.",
+    "btn_enrich": "Enriquecer vinhos",
+    "enrich_done": "{updated} vinhos enriquecidos, {failed} com falha.",
+    "enrich_none": "Todos os vinhos já estão enriquecidos.",
     "import_preview_title": "Pré-visualização de importação",
     "import_preview_loading": "Analisando arquivo …",
     "import_summary_new": "novos",
@@ -1715,6 +1745,11 @@ TRANSLATIONS = {
     "data_import_hint": "Herstellen vanuit een ZIP- of CSV-bestand. Duplicaten kun je vóór het importeren controleren.",
     "btn_export_download": "Back-up downloaden",
     "btn_import_choose": "Bestand kiezen …",
+    "data_enrich": "AI-verrijking",
+    "data_enrich_hint": "Vul rijpingsfasen, smaakprofiel en spijscombinaties aan voor alle wijnen waarbij ze ontbreken.",
+    "btn_enrich": "Wijnen verrijken",
+    "enrich_done": "{updated} wijnen verrijkt, {failed} mislukt.",
+    "enrich_none": "Alle wijnen zijn al verrijkt.",
     "import_preview_title": "Import-voorbeeld",
     "import_preview_loading": "Bestand wordt geanalyseerd …",
     "import_summary_new": "nieuw",
@@ -21,18 +21,21 @@ sys.path.insert(0, APP_DIR)
 def _patch_env(tmp_path, monkeypatch):
     """
     Patch all global state in app.py so each test gets:
-    - A fresh temporary directory for DATA_DIR / UPLOAD_DIR / DB_PATH
+    - A fresh temporary directory for DATA_DIR / UPLOAD_DIR / IMPORT_TMP_DIR / DB_PATH
     - Default HA options (no AI, CHF, German)
     """
     data_dir = str(tmp_path / "data")
     upload_dir = os.path.join(data_dir, "uploads")
+    import_tmp_dir = os.path.join(data_dir, "import_tmp")
     db_path = os.path.join(data_dir, "wine.db")
     os.makedirs(upload_dir, exist_ok=True)
+    os.makedirs(import_tmp_dir, exist_ok=True)
 
     import app as wine_app
 
     monkeypatch.setattr(wine_app, "DATA_DIR", data_dir)
     monkeypatch.setattr(wine_app, "UPLOAD_DIR", upload_dir)
+    monkeypatch.setattr(wine_app, "IMPORT_TMP_DIR", import_tmp_dir)
     monkeypatch.setattr(wine_app, "DB_PATH", db_path)
 
     # Sensible default options for tests
@@ -50,6 +53,7 @@ def _patch_env(tmp_path, monkeypatch):
         "ollama_model": "llava",
     }
     monkeypatch.setattr(wine_app, "HA_OPTIONS", test_options)
+    wine_app._ai_breaker.reset()
 
 
 @pytest.fixture
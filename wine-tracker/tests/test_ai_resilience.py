@@ -0,0 +1,337 @@
+"""
+Tests for the resilient AI provider layer (ai_resilience.py and its use in app.py).
+
+The policy itself is tested with a fake clock; the integration tests run the
+real provider functions (Ollama over requests, OpenRouter over the OpenAI
+SDK) against a scripted local HTTP server.
+"""
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import ai_resilience
+import app as wine_app
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class HttpError(Exception):
+    """Looks like an SDK status error to ``classify``."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = type("Response", (), {"status_code": status, "headers": headers or {}})()
+
+
+def _flaky(*outcomes):
+    """A callable returning/raising ``outcomes`` in order; counts calls."""
+    outcomes = list(outcomes)
+
+    def fn():
+        fn.calls += 1
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    fn.calls = 0
+    return fn
+
+
+# ── Policy ────────────────────────────────────────────────────────────────────
+
+class TestClassify:
+    def test_transient_errors(self):
+        assert ai_resilience.classify(HttpError(429)) == "rate_limited"
+        assert ai_resilience.classify(HttpError(503)) == "unavailable"
+        assert ai_resilience.classify(HttpError(408)) == "timeout"
+        assert ai_resilience.classify(requests.exceptions.ReadTimeout()) == "timeout"
+        assert ai_resilience.classify(requests.exceptions.ConnectionError()) == "unavailable"
+
+    def test_other_errors_are_not_transient(self):
+        assert ai_resilience.classify(HttpError(400)) is None
+        assert ai_resilience.classify(HttpError(401)) is None
+        assert ai_resilience.classify(ValueError("timeout in the message")) is None
+
+    def test_retry_after(self):
+        assert ai_resilience.retry_after(HttpError(429, {"retry-after": "3"})) == 3.0
+        assert ai_resilience.retry_after(HttpError(429, {"retry-after": "Wed, 21 Oct"})) is None
+        assert ai_resilience.retry_after(HttpError(429)) is None
+
+
+class TestCall:
+    def _call(self, fn, clock, breaker=None, **kwargs):
+        return ai_resilience.call(
+            "p", fn, timeout=kwargs.pop("timeout", 60), breaker=breaker or ai_resilience.CircuitBreaker(),
+            sleep=clock.sleep, rand=lambda: 1.0, clock=clock, **kwargs,
+        )
+
+    def test_retries_transient_errors_with_backoff(self):
+        clock = FakeClock()
+        fn = _flaky(HttpError(503), HttpError(500), "ok")
+        assert self._call(fn, clock) == "ok"
+        assert fn.calls == 3
+        assert clock.slept == [ai_resilience.RETRY_BASE_DELAY, ai_resilience.RETRY_BASE_DELAY * 2]
+
+    def test_honours_retry_after(self):
+        clock = FakeClock()
+        fn = _flaky(HttpError(429, {"retry-after": "4"}), "ok")
+        assert self._call(fn, clock) == "ok"
+        assert clock.slept == [4.0]
+
+    def test_gives_up_after_attempts(self):
+        fn = _flaky(*[HttpError(503)] * 3)
+        with pytest.raises(ai_resilience.ProviderError) as exc:
+            self._call(fn, FakeClock())
+        assert exc.value.kind == "unavailable"
+        assert fn.calls == ai_resilience.RETRY_ATTEMPTS
+
+    def test_does_not_wait_past_the_deadline(self):
+        clock = FakeClock()
+        fn = _flaky(HttpError(429, {"retry-after": "30"}), "ok")
+        with pytest.raises(ai_resilience.ProviderError) as exc:
+            self._call(fn, clock, timeout=10)
+        assert exc.value.kind == "rate_limited"
+        assert fn.calls == 1 and clock.slept == []
+
+    def test_timeouts_are_not_retried(self):
+        fn = _flaky(requests.exceptions.ReadTimeout("Read timed out"), "ok")
+        with pytest.raises(ai_resilience.ProviderError) as exc:
+            self._call(fn, FakeClock())
+        assert exc.value.kind == "timeout"
+        assert fn.calls == 1
+
+    def test_other_errors_are_raised_unchanged(self):
+        fn = _flaky(HttpError(401), "ok")
+        with pytest.raises(HttpError):
+            self._call(fn, FakeClock())
+        assert fn.calls == 1
+
+    def test_remaining_is_the_deadline_inside_a_call(self):
+        clock = FakeClock()
+        seen = []
+        self._call(lambda: seen.append(ai_resilience.remaining(clock)), clock, timeout=42)
+        assert seen == [42]
+        assert ai_resilience.remaining() == ai_resilience.DEFAULT_TIMEOUT
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold_and_fails_fast(self):
+        clock = FakeClock()
+        breaker = ai_resilience.CircuitBreaker(threshold=2, reset_seconds=30, clock=clock)
+        fn = _flaky(HttpError(503), HttpError(503), "ok")
+        with pytest.raises(ai_resilience.ProviderError):
+            ai_resilience.call("p", fn, timeout=60, breaker=breaker, attempts=2,
+                               sleep=clock.sleep, rand=lambda: 0.0, clock=clock)
+        assert breaker.state("p") == "open"
+        with pytest.raises(ai_resilience.CircuitOpen) as exc:
+            ai_resilience.call("p", fn, timeout=60, breaker=breaker, clock=clock)
+        assert exc.value.kind == "circuit_open"
+        assert fn.calls == 2
+        assert breaker.state("other") == "closed"
+
+    def test_half_open_trial_closes_or_reopens(self):
+        clock = FakeClock()
+        breaker = ai_resilience.CircuitBreaker(threshold=1, reset_seconds=30, clock=clock)
+        breaker.failure("p")
+        clock.now += 31
+        assert breaker.state("p") == "half_open"
+
+        breaker.check("p")  # the trial call may go out ...
+        with pytest.raises(ai_resilience.CircuitOpen):
+            breaker.check("p")  # ... but only one
+        breaker.failure("p")
+        assert breaker.state("p") == "open"
+
+        clock.now += 31
+        breaker.check("p")
+        breaker.success("p")
+        assert breaker.state("p") == "closed"
+
+    def test_non_transient_error_counts_as_an_answer(self):
+        breaker = ai_resilience.CircuitBreaker(threshold=2)
+        breaker.failure("p")
+        with pytest.raises(HttpError):
+            ai_resilience.call("p", _flaky(HttpError(400)), timeout=60, breaker=breaker)
+        breaker.failure("p")
+        assert breaker.state("p") == "closed"
+
+
+class TestStream:
+    def test_retries_until_the_first_chunk(self):
+        clock = FakeClock()
+        starts = _flaky(HttpError(503), iter(["a", "b"]))
+        out = ai_resilience.stream("p", starts, timeout=60, breaker=ai_resilience.CircuitBreaker(),
+                                   sleep=clock.sleep, rand=lambda: 0.0, clock=clock)
+        assert list(out) == ["a", "b"]
+        assert starts.calls == 2
+
+    def test_mid_stream_failure_is_a_provider_error(self):
+        def gen():
+            yield "a"
+            raise requests.exceptions.ChunkedEncodingError("connection broken")
+
+        out = ai_resilience.stream("p", gen, timeout=60, breaker=ai_resilience.CircuitBreaker())
+        assert next(out) == "a"
+        with pytest.raises(ai_resilience.ProviderError) as exc:
+            next(out)
+        assert exc.value.kind == "unavailable"
+
+
+# ── Against a local fake provider ─────────────────────────────────────────────
+
+class FakeProvider:
+    """Scripted HTTP server speaking the Ollama and OpenAI chat APIs.
+
+    ``script`` holds ``(status, body, headers, delay)`` answers, used in
+    order; once it is empty every request is answered with ``default``.
+    """
+
+    def __init__(self):
+        self.script = []
+        self.default = (200, "{}", {}, 0)
+        self.requests = []
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                provider.requests.append(self.path)
+                status, text, headers, delay = provider.script.pop(0) if provider.script else provider.default
+                time.sleep(delay)
+                if self.path.endswith("/chat/completions"):
+                    body = {"id": "x", "object": "chat.completion", "created": 0, "model": "m",
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": text}}]}
+                else:
+                    body = {"message": {"role": "assistant", "content": text}}
+                data = json.dumps(body if status == 200 else {"error": "fake"}).encode()
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up (deadline)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def answer(self, text, delay=0):
+        return (200, text, {}, delay)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_provider(monkeypatch):
+    server = FakeProvider()
+    monkeypatch.setattr(ai_resilience, "RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setitem(wine_app.AI_PROVIDERS, "openrouter", ("openai", "openrouter_api_key", server.url + "/v1"))
+    yield server
+    server.close()
+
+
+def _opts(fake_provider, **overrides):
+    return {
+        **wine_app.HA_OPTIONS,
+        "ai_provider": "ollama",
+        "ollama_host": fake_provider.url,
+        "openrouter_api_key": "sk-test",
+        "openrouter_model": "test/model",
+        "analysis_cache_days": 0,
+        **overrides,
+    }
+
+
+WINE = json.dumps({"name": "Fake Riesling", "wine_type": "Weisswein"})
+
+
+class TestFakeProvider:
+    def test_rate_limit_is_retried_after_retry_after(self, fake_provider):
+        fake_provider.script = [(429, "", {"Retry-After": "0"}, 0), fake_provider.answer(WINE)]
+        fields, cached = wine_app._run_analysis(_opts(fake_provider), None, None, "prompt")
+        assert fields["name"] == "Fake Riesling"
+        assert len(fake_provider.requests) == 2
+
+    def test_openai_sdk_path_is_retried(self, fake_provider):
+        fake_provider.script = [(500, "", {}, 0), (502, "", {}, 0), fake_provider.answer(WINE)]
+        opts = _opts(fake_provider, ai_provider="openrouter")
+        fields, _ = wine_app._run_analysis(opts, None, None, "prompt")
+        assert fields["name"] == "Fake Riesling"
+        assert fake_provider.requests == ["/v1/chat/completions"] * 3
+
+    def test_repeated_server_errors_open_the_circuit(self, fake_provider):
+        fake_provider.default = (500, "", {}, 0)
+        opts = _opts(fake_provider)
+        for _ in range(2):
+            with pytest.raises(ai_resilience.ProviderError):
+                wine_app._run_analysis(opts, None, None, "prompt")
+        sent = len(fake_provider.requests)
+        assert sent >= ai_resilience.FAILURE_THRESHOLD
+
+        with pytest.raises(ai_resilience.CircuitOpen):
+            wine_app._run_analysis(opts, None, None, "prompt")
+        assert len(fake_provider.requests) == sent  # failed fast
+
+    def test_slow_provider_hits_the_deadline(self, fake_provider, client, monkeypatch):
+        monkeypatch.setitem(wine_app.AI_DEADLINES, "scan", 0.3)
+        monkeypatch.setattr(wine_app, "load_options", lambda: _opts(fake_provider))
+        fake_provider.script = [fake_provider.answer(WINE, delay=1)]
+        image = (io.BytesIO(b"\x89PNG\r\n\x1a\n" + b"\x00" * 100), "label.png")
+        start = time.monotonic()
+        resp = client.post("/api/analyze-wine", data={"image": image}, content_type="multipart/form-data")
+        assert time.monotonic() - start < 1
+        assert resp.status_code == 500
+        assert resp.get_json()["error"] == "timeout"
+
+    def test_falls_back_to_second_provider(self, fake_provider, app):
+        fake_provider.script = [(503, "", {}, 0)] * ai_resilience.RETRY_ATTEMPTS + [fake_provider.answer(WINE)]
+        opts = _opts(fake_provider, ai_fallback_provider="openrouter", analysis_cache_days=30)
+        with app.test_request_context():
+            fields, cached = wine_app._run_analysis(opts, None, None, "prompt")
+            assert fields["name"] == "Fake Riesling" and not cached
+            assert fake_provider.requests[-1] == "/v1/chat/completions"
+            # Answers of the fallback are not cached under the primary's key
+            count = wine_app.get_db().execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        assert count == 0
+
+    def test_fallback_must_be_configured(self, fake_provider):
+        fake_provider.default = (503, "", {}, 0)
+        opts = _opts(fake_provider, ai_fallback_provider="openrouter", openrouter_api_key="")
+        with pytest.raises(ai_resilience.ProviderError):
+            wine_app._run_analysis(opts, None, None, "prompt")
+        assert "/v1/chat/completions" not in fake_provider.requests
+
+    def test_chat_falls_back(self, fake_provider):
+        fake_provider.script = [(503, "", {}, 0)] * ai_resilience.RETRY_ATTEMPTS + [fake_provider.answer("Prost!")]
+        opts = _opts(fake_provider, ai_fallback_provider="openrouter")
+        reply = wine_app._call_chat("ollama", [{"role": "user", "content": "Hallo"}], "system", opts)
+        assert reply == "Prost!"
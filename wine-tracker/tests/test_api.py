@@ -219,6 +219,88 @@ class TestAnalyzeWine:
         assert data["error"] == "parse_error"
 
 
+    def _scan(self, client, refresh=False):
+        fake_image = (io.BytesIO(b"\x89PNG\r\n\x1a\n" + b"\x00" * 100), "label.png")
+        data = {"image": fake_image}
+        if refresh:
+            data["refresh"] = "1"
+        resp = client.post("/api/analyze-wine", data=data, content_type="multipart/form-data")
+        assert resp.status_code == 200
+        return json.loads(resp.data)
+
+    @patch("app._call_anthropic")
+    @patch("app.load_options")
+    def test_same_label_is_answered_from_cache(self, mock_opts, mock_call, client):
+        """A second scan of the same photo must not call the provider again."""
+        opts = {**wine_app.HA_OPTIONS, "ai_provider": "anthropic", "anthropic_api_key": "sk-test"}
+        mock_opts.return_value = opts
+        mock_call.return_value = json.dumps({"name": "Château Margaux", "wine_type": "Rotwein"})
+
+        first = self._scan(client)
+        second = self._scan(client)
+        assert first["cached"] is False and second["cached"] is True
+        assert second["fields"] == first["fields"]
+        assert second["image_filename"] == first["image_filename"]
+        assert mock_call.call_count == 1
+
+        # The refresh flag skips the lookup and stores the new answer
+        mock_call.return_value = json.dumps({"name": "Château Margaux 2015", "wine_type": "Rotwein"})
+        assert self._scan(client, refresh=True)["cached"] is False
+        assert self._scan(client)["fields"]["name"] == "Château Margaux 2015"
+        assert mock_call.call_count == 2
+
+        # Another model is another cache entry
+        mock_opts.return_value = {**opts, "anthropic_model": "claude-other"}
+        assert self._scan(client)["cached"] is False
+        assert mock_call.call_count == 3
+
+    @patch("app._call_anthropic")
+    @patch("app.load_options")
+    def test_cache_disabled(self, mock_opts, mock_call, client):
+        mock_opts.return_value = {**wine_app.HA_OPTIONS, "ai_provider": "anthropic",
+                                  "anthropic_api_key": "sk-test", "analysis_cache_days": 0}
+        mock_call.return_value = json.dumps({"name": "Test"})
+        self._scan(client)
+        assert self._scan(client)["cached"] is False
+        assert mock_call.call_count == 2
+
+    @patch("app._call_anthropic")
+    @patch("app.load_options")
+    def test_parse_errors_are_not_cached(self, mock_opts, mock_call, client):
+        mock_opts.return_value = {**wine_app.HA_OPTIONS, "ai_provider": "anthropic", "anthropic_api_key": "sk-test"}
+        mock_call.side_effect = ["no json", json.dumps({"name": "Test"})]
+        fake_image = (io.BytesIO(b"\x89PNG\r\n\x1a\n" + b"\x00" * 100), "label.png")
+        resp = client.post("/api/analyze-wine", data={"image": fake_image}, content_type="multipart/form-data")
+        assert resp.status_code == 500
+        assert self._scan(client)["fields"] == {"name": "Test"}
+
+
+    @patch("app._call_anthropic")
+    @patch("app.load_options")
+    def test_cache_key_uses_default_model(self, mock_opts, mock_call, client, monkeypatch):
+        """With the model option empty, a new default model must not get the old model's answers."""
+        mock_opts.return_value = {**wine_app.HA_OPTIONS, "ai_provider": "anthropic",
+                                  "anthropic_api_key": "sk-test", "anthropic_model": ""}
+        mock_call.return_value = json.dumps({"name": "Test"})
+        assert self._scan(client)["cached"] is False
+        assert self._scan(client)["cached"] is True
+        monkeypatch.setitem(wine_app.AI_DEFAULT_MODELS, "anthropic", "claude-newer")
+        assert self._scan(client)["cached"] is False
+        assert mock_call.call_count == 2
+
+    @patch("app._call_anthropic")
+    @patch("app.load_options")
+    def test_other_value_errors_are_api_errors(self, mock_opts, mock_call, client):
+        """Only invalid_provider is a 400; any other ValueError keeps the JSON error body."""
+        mock_opts.return_value = {**wine_app.HA_OPTIONS, "ai_provider": "anthropic", "anthropic_api_key": "sk-test"}
+        mock_call.side_effect = UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+        fake_image = (io.BytesIO(b"\x89PNG\r\n\x1a\n" + b"\x00" * 100), "label.png")
+        resp = client.post("/api/analyze-wine", data={"image": fake_image}, content_type="multipart/form-data")
+        assert resp.status_code == 500
+        data = resp.get_json()
+        assert data["error"] == "api_error"
+        assert data["image_filename"]
+
 # ── POST /api/reanalyze-wine ─────────────────────────────────────────────────
 
 class TestReanalyzeWine:
@@ -231,6 +313,26 @@ class TestReanalyzeWine:
         data = json.loads(resp.data)
         assert data.get("ok") is False or resp.status_code >= 400
 
+    @patch("app._call_anthropic")
+    @patch("app.load_options")
+    def test_reload_bypasses_cache(self, mock_opts, mock_call, client):
+        mock_opts.return_value = {**wine_app.HA_OPTIONS, "ai_provider": "anthropic", "anthropic_api_key": "sk-test"}
+        mock_call.return_value = json.dumps({"name": "Barolo", "wine_type": "Rotwein"})
+
+        def reanalyze(**extra):
+            resp = client.post(
+                "/api/reanalyze-wine",
+                data=json.dumps({"wine_context": {"name": "Barolo"}, **extra}),
+                content_type="application/json",
+            )
+            assert json.loads(resp.data)["fields"]["name"] == "Barolo"
+
+        reanalyze()
+        reanalyze()
+        assert mock_call.call_count == 1
+        reanalyze(refresh=True)
+        assert mock_call.call_count == 2
+
 
 # ── GET /api/vivino-search ────────────────────────────────────────────────────
 
@@ -472,6 +574,294 @@ class TestUploadServing:
         assert resp.status_code == 404
 
 
+# ── GET /uploads/<size>/<filename> ────────────────────────────────────────────
+
+class TestImageVariants:
+    WEBP = {"Accept": "image/webp,image/*,*/*;q=0.8"}
+
+    @staticmethod
+    def _photo(upload_dir, name="label.jpg", size=(1600, 1200)):
+        from PIL import Image
+        Image.new("RGB", size, (120, 20, 40)).save(os.path.join(upload_dir, name), quality=90)
+        return name
+
+    def test_thumb_is_webp_when_accepted(self, client, upload_dir):
+        from PIL import Image
+        name = self._photo(upload_dir)
+        resp = client.get(f"/uploads/thumb/{name}", headers=self.WEBP)
+        assert resp.status_code == 200
+        assert resp.mimetype == "image/webp"
+        assert "Accept" in resp.headers["Vary"]
+        with Image.open(io.BytesIO(resp.data)) as img:
+            assert img.format == "WEBP"
+            assert img.size == (480, 360)
+
+    def test_jpeg_fallback(self, client, upload_dir):
+        from PIL import Image
+        name = self._photo(upload_dir, "label.png")
+        resp = client.get(f"/uploads/modal/{name}", headers={"Accept": "image/png,image/*"})
+        assert resp.mimetype == "image/jpeg"
+        with Image.open(io.BytesIO(resp.data)) as img:
+            assert img.size == (1000, 750)
+
+    def test_variant_is_cached_until_source_changes(self, client, upload_dir):
+        name = self._photo(upload_dir)
+        client.get(f"/uploads/thumb/{name}", headers=self.WEBP)
+        cached = os.path.join(wine_app._image_cache_dir(), f"{name}.thumb.webp")
+        first = os.path.getmtime(cached)
+        client.get(f"/uploads/thumb/{name}", headers=self.WEBP)
+        assert os.path.getmtime(cached) == first
+
+        self._photo(upload_dir, size=(800, 1600))
+        os.utime(os.path.join(upload_dir, name), (first + 10, first + 10))
+        from PIL import Image
+        resp = client.get(f"/uploads/thumb/{name}", headers=self.WEBP)
+        with Image.open(io.BytesIO(resp.data)) as img:
+            assert img.size == (240, 480)
+
+    def test_unknown_size_or_missing_source(self, client, upload_dir):
+        name = self._photo(upload_dir)
+        assert client.get(f"/uploads/huge/{name}").status_code == 404
+        assert client.get("/uploads/thumb/missing.jpg").status_code == 404
+        assert client.get("/uploads/thumb/notes.txt").status_code == 404
+
+    def test_undecodable_source_served_as_is(self, client, upload_dir):
+        with open(os.path.join(upload_dir, "broken.jpg"), "wb") as f:
+            f.write(b"not an image")
+        resp = client.get("/uploads/thumb/broken.jpg")
+        assert resp.status_code == 200
+        assert resp.data == b"not an image"
+        # The full-size original must not be pinned under the variant URL
+        assert resp.headers["Cache-Control"] == "no-cache"
+        name = self._photo(upload_dir)
+        assert client.get(f"/uploads/thumb/{name}").headers["Cache-Control"] == wine_app.IMMUTABLE_CACHE
+
+    def test_prune_removes_orphaned_variants(self, client, upload_dir):
+        import image_variants
+        keep = self._photo(upload_dir, "keep.jpg")
+        gone = self._photo(upload_dir, "gone.jpg")
+        for name in (keep, gone):
+            client.get(f"/uploads/thumb/{name}", headers=self.WEBP)
+        os.remove(os.path.join(upload_dir, gone))
+
+        cache = wine_app._image_cache_dir()
+        assert image_variants.prune(upload_dir, cache) == 1
+        assert os.listdir(cache) == ["keep.jpg.thumb.webp"]
+
+    def test_cards_use_thumbnails(self, client, sample_wine, db, upload_dir):
+        name = self._photo(upload_dir)
+        db.execute("UPDATE wines SET image = ?", (name,))
+        db.commit()
+        html = client.get("/").data.decode()
+        assert f"/uploads/thumb/{name}" in html
+
+
+# ── Background downscaling ────────────────────────────────────────────────────
+
+class TestBackgroundDownscale:
+    @staticmethod
+    def _jpeg(size=(3000, 2000)):
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.new("RGB", size, (90, 10, 30)).save(buf, format="JPEG")
+        buf.seek(0)
+        return buf
+
+    def test_upload_is_downscaled_in_background(self, client, upload_dir):
+        from PIL import Image
+        resp = client.post(
+            "/add",
+            data={"name": "Foto", "quantity": "1", "image": (self._jpeg(), "label.jpg")},
+            content_type="multipart/form-data",
+            headers=AJAX,
+        )
+        name = json.loads(resp.data)["wine"]["image"]
+        wine_app.wait_for_image(name)
+        path = os.path.join(upload_dir, name)
+        with Image.open(path) as img:
+            assert img.size == (1800, 1200)
+        assert sorted(os.listdir(upload_dir)) == [name]
+        assert client.get(f"/api/images/{name}").get_json() == {"ok": True, "pending": False}
+
+    def test_pending_flag_and_headers(self, client, upload_dir, sample_wine, db):
+        with open(os.path.join(upload_dir, "raw.jpg"), "wb") as f:
+            f.write(self._jpeg().read())
+        open(os.path.join(upload_dir, "raw.jpg.pending"), "w").close()
+        db.execute("UPDATE wines SET image = 'raw.jpg'")
+        db.commit()
+
+        assert client.get("/api/images/raw.jpg").get_json()["pending"] is True
+        assert client.get(f"/api/wine/{sample_wine['wine']['id']}").get_json()["wine"]["image_pending"] is True
+        assert client.get("/uploads/raw.jpg").headers["Cache-Control"] == "no-cache"
+        assert client.get("/api/images/missing.jpg").status_code == 404
+
+    def test_wine_etag_changes_when_downscale_finishes(self, client, upload_dir, sample_wine, db):
+        with open(os.path.join(upload_dir, "raw.jpg"), "wb") as f:
+            f.write(self._jpeg().read())
+        open(os.path.join(upload_dir, "raw.jpg.pending"), "w").close()
+        db.execute("UPDATE wines SET image = 'raw.jpg'")
+        db.commit()
+        url = f"/api/wine/{sample_wine['wine']['id']}"
+
+        first = client.get(url)
+        assert first.get_json()["wine"]["image_pending"] is True
+        wine_app._downscale_pending(os.path.join(upload_dir, "raw.jpg"))
+
+        again = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+        assert again.status_code == 200
+        assert again.get_json()["wine"]["image_pending"] is False
+
+    def test_startup_finishes_leftover_uploads(self, app, upload_dir):
+        from PIL import Image
+        with open(os.path.join(upload_dir, "left.jpg"), "wb") as f:
+            f.write(self._jpeg((2400, 2400)).read())
+        open(os.path.join(upload_dir, "left.jpg.pending"), "w").close()
+        open(os.path.join(upload_dir, "gone.jpg.pending"), "w").close()
+
+        wine_app.init_db()
+        assert sorted(os.listdir(upload_dir)) == ["left.jpg"]
+        with Image.open(os.path.join(upload_dir, "left.jpg")) as img:
+            assert img.size == (1800, 1800)
+
+    def test_failed_downscale_keeps_original(self, upload_dir):
+        path = os.path.join(upload_dir, "bad.jpg")
+        with open(path, "wb") as f:
+            f.write(b"not an image")
+        wine_app._downscale(path)
+        with open(path, "rb") as f:
+            assert f.read() == b"not an image"
+        assert os.listdir(upload_dir) == ["bad.jpg"]
+
+    @patch("app._call_anthropic")
+    @patch("app.load_options")
+    def test_analyze_sends_downscaled_image(self, mock_opts, mock_call, client):
+        import base64
+        from PIL import Image
+        mock_opts.return_value = {
+            **wine_app.HA_OPTIONS, "ai_provider": "anthropic", "anthropic_api_key": "sk-test",
+        }
+        mock_call.return_value = json.dumps({"name": "X"})
+        client.post(
+            "/api/analyze-wine",
+            data={"image": (self._jpeg(), "label.jpg")},
+            content_type="multipart/form-data",
+        )
+        sent = base64.b64decode(mock_call.call_args[0][0])
+        with Image.open(io.BytesIO(sent)) as img:
+            assert max(img.size) == 1800
+
+
+# ── Content-addressed image store ─────────────────────────────────────────────
+
+class TestImageStore:
+    @staticmethod
+    def _add(client, name, blob=b"\xff\xd8\xffsame-label"):
+        resp = client.post(
+            "/add",
+            data={"name": name, "quantity": "1", "image": (io.BytesIO(blob), "label.jpg")},
+            content_type="multipart/form-data",
+            headers=AJAX,
+        )
+        return json.loads(resp.data)["wine"]
+
+    @staticmethod
+    def _age(path, seconds=2 * 3600):
+        old = os.path.getmtime(path) - seconds
+        os.utime(path, (old, old))
+
+    def test_identical_uploads_share_one_file(self, client, upload_dir):
+        a = self._add(client, "A")
+        b = self._add(client, "B")
+        assert a["image"] == b["image"]
+        assert len(a["image"]) == 32 + len(".jpg")
+        wine_app.wait_for_image(a["image"])
+        assert sorted(os.listdir(upload_dir)) == [a["image"]]
+
+    def test_file_is_kept_until_last_reference_is_gone(self, client, db, upload_dir):
+        wine = self._add(client, "A")
+        client.post(f"/duplicate/{wine['id']}", data={"quantity": "1"}, headers=AJAX)
+        copy_id, copy_image = db.execute("SELECT id, image FROM wines WHERE id != ?", (wine["id"],)).fetchone()
+        assert copy_image == wine["image"]
+        path = os.path.join(upload_dir, wine["image"])
+
+        wine_app.wait_for_image(wine["image"])
+        self._age(path)
+        client.post(f"/delete/{wine['id']}", headers=AJAX)
+        assert os.path.isfile(path)
+        client.post(f"/edit/{copy_id}", data={"name": "A", "quantity": "1", "delete_image": "1"}, headers=AJAX)
+        assert not os.path.isfile(path)
+
+    @patch("app._call_anthropic")
+    @patch("app.load_options")
+    def test_recently_reused_file_survives_release(self, mock_opts, mock_call, client, db, upload_dir):
+        """A label analysed again gets the existing name; deleting its only wine must keep it."""
+        mock_opts.return_value = {**wine_app.HA_OPTIONS, "ai_provider": "anthropic", "anthropic_api_key": "sk-test"}
+        mock_call.return_value = json.dumps({"name": "Château Margaux"})
+        blob = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+        wine = self._add(client, "A", blob)
+        wine_app.wait_for_image(wine["image"])
+        path = os.path.join(upload_dir, wine["image"])
+        self._age(path)
+
+        resp = client.post("/api/analyze-wine", data={"image": (io.BytesIO(blob), "label.jpg")},
+                           content_type="multipart/form-data")
+        ai_image = json.loads(resp.data)["image_filename"]
+        assert ai_image == wine["image"]
+
+        client.post(f"/delete/{wine['id']}", headers=AJAX)
+        assert os.path.isfile(path)
+        resp = client.post("/add", data={"name": "B", "quantity": "1", "ai_image": ai_image}, headers=AJAX)
+        assert json.loads(resp.data)["wine"]["image"] == ai_image
+
+    def test_collect_garbage_spares_recent_and_referenced(self, db, sample_wine, upload_dir):
+        import image_store
+        for name in ("kept.jpg", "orphan.jpg", "fresh.jpg"):
+            with open(os.path.join(upload_dir, name), "wb") as f:
+                f.write(name.encode())
+        db.execute("UPDATE wines SET image = 'kept.jpg'")
+        db.commit()
+        self._age(os.path.join(upload_dir, "kept.jpg"))
+        self._age(os.path.join(upload_dir, "orphan.jpg"))
+
+        assert image_store.collect_garbage(db, upload_dir, dry_run=True) == ["orphan.jpg"]
+        assert os.path.isfile(os.path.join(upload_dir, "orphan.jpg"))
+        assert image_store.collect_garbage(db, upload_dir) == ["orphan.jpg"]
+        assert sorted(os.listdir(upload_dir)) == ["fresh.jpg", "kept.jpg"]
+
+    def test_gc_images_command(self, app, upload_dir):
+        path = os.path.join(upload_dir, "orphan.jpg")
+        open(path, "wb").close()
+        self._age(path)
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["gc-images", "--dry-run"])
+        assert "orphan.jpg" in result.output
+        assert "Would remove 1" in result.output
+        assert os.path.isfile(path)
+        runner.invoke(args=["gc-images"])
+        assert not os.path.isfile(path)
+
+    def test_migrates_legacy_uploads(self, db, sample_wine, upload_dir):
+        import image_store
+        os.makedirs(os.path.join(upload_dir, "chat", "1"))
+        for name in ("legacy-a.jpg", "legacy-b.jpg", os.path.join("chat", "1", "photo.jpg")):
+            with open(os.path.join(upload_dir, name), "wb") as f:
+                f.write(b"one label")
+        db.execute("UPDATE wines SET image = 'legacy-a.jpg'")
+        db.execute("INSERT INTO wines (name, image) VALUES ('Copy', 'legacy-b.jpg')")
+        db.execute("INSERT INTO chat_sessions (id, title, created, updated) VALUES (1, 't', 'x', 'x')")
+        db.execute("INSERT INTO chat_messages (session_id, role, content, timestamp, image_path) "
+                   "VALUES (1, 'user', 'hi', 'x', 'chat/1/photo.jpg')")
+        db.execute("UPDATE app_state SET value = 0 WHERE key = 'image_store'")
+        db.commit()
+
+        assert image_store.migrate_uploads(db, upload_dir) == 3
+        names = {r[0] for r in db.execute("SELECT image FROM wines")}
+        names.add(db.execute("SELECT image_path FROM chat_messages").fetchone()[0])
+        assert len(names) == 1
+        assert sorted(os.listdir(upload_dir)) == sorted(names)
+        assert image_store.migrate_uploads(db, upload_dir) == 0
+
+
 # ── SSRF Protection (Vivino Image Proxy) ─────────────────────────────────────
 
 class TestVivinoImageSSRF:
@@ -813,6 +1203,160 @@ class TestWineChat:
         assert "wine:" in system_prompt
         assert "markdown link" in system_prompt.lower() or "[Wine" in system_prompt
 
+    def _add_wines(self, client):
+        client.post("/add", data={"name": "Barolo Riserva", "type": "Rotwein",
+                                  "region": "Piemonte", "grape": "Nebbiolo", "quantity": "2"})
+        client.post("/add", data={"name": "Sancerre", "type": "Weisswein",
+                                  "region": "Loire", "grape": "Sauvignon Blanc", "quantity": "1"})
+
+    @patch("app._call_chat")
+    @patch("app.load_options")
+    def test_chat_large_cellar_uses_retrieval(self, mock_opts, mock_chat, client, sample_wine):
+        """Above chat_retrieval_threshold only an overview and matching wines are sent."""
+        mock_opts.return_value = {**self.CHAT_OPTS, "chat_retrieval_threshold": 2}
+        mock_chat.return_value = "Der Barolo."
+        self._add_wines(client)
+
+        resp = self._post_chat(client, message="Welcher Nebbiolo passt?")
+        assert resp.status_code == 200
+
+        system_prompt = mock_chat.call_args[0][2]
+        assert "3 wines" in system_prompt and "too many to list" in system_prompt
+        assert "Overview" in system_prompt
+        listed = system_prompt[system_prompt.index("best match"):]
+        assert listed.index("Barolo Riserva") < listed.index("Château Test")
+        # Only the overview belongs to the cached prefix
+        assert "Barolo Riserva" not in system_prompt[:system_prompt.stable_len]
+
+    @patch("app._call_chat")
+    @patch("app.load_options")
+    def test_chat_retrieval_threshold_zero_lists_everything(self, mock_opts, mock_chat, client, sample_wine):
+        mock_opts.return_value = {**self.CHAT_OPTS, "chat_retrieval_threshold": 0}
+        mock_chat.return_value = "Ok."
+        self._add_wines(client)
+
+        resp = self._post_chat(client, message="Welcher Nebbiolo passt?")
+        assert resp.status_code == 200
+
+        system_prompt = mock_chat.call_args[0][2]
+        assert "too many to list" not in system_prompt
+        for name in ("Château Test", "Barolo Riserva", "Sancerre"):
+            assert name in system_prompt[:system_prompt.stable_len]
+
+
+# ── POST /api/chat/stream (Server-Sent Events) ───────────────────────────────
+
+def _sse_events(resp):
+    """Parse an SSE response body into a list of (event, data) tuples."""
+    events = []
+    for block in resp.get_data(as_text=True).strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestChatStream:
+    CHAT_OPTS = TestWineChat.CHAT_OPTS
+
+    def _post(self, client, **payload):
+        return client.post("/api/chat/stream", json={"message": "Hallo", **payload})
+
+    @patch("app._stream_chat")
+    @patch("app.load_options")
+    def test_relays_deltas_and_stores_reply(self, mock_opts, mock_stream, client, db):
+        mock_opts.return_value = self.CHAT_OPTS
+        mock_stream.return_value = iter(["Ein ", "Pinot ", "Noir."])
+        resp = self._post(client)
+        assert resp.mimetype == "text/event-stream"
+        assert resp.headers["Cache-Control"] == "no-cache"
+        events = _sse_events(resp)
+        assert [e for e in events if e[0] == "delta"] == [
+            ("delta", {"text": "Ein "}), ("delta", {"text": "Pinot "}), ("delta", {"text": "Noir."}),
+        ]
+        assert events[-1] == ("done", {"ok": True, "response": "Ein Pinot Noir.", "session_id": 1})
+        rows = db.execute("SELECT role, content FROM chat_messages ORDER BY id").fetchall()
+        assert [tuple(r) for r in rows] == [("user", "Hallo"), ("assistant", "Ein Pinot Noir.")]
+
+    @patch("app._stream_chat")
+    @patch("app.load_options")
+    def test_action_block_is_held_back_and_run(self, mock_opts, mock_stream, client, db):
+        mock_opts.return_value = self.CHAT_OPTS
+        mock_stream.return_value = iter([
+            "Erfasst!", " [ADD", '_WINE]{"name": "Stream Wein", "wine_type": "Rotwein", ',
+            '"quantity": 2}[/ADD_WINE]',
+        ])
+        events = _sse_events(self._post(client, edit_wines=True))
+        streamed = "".join(e[1]["text"] for e in events if e[0] == "delta")
+        assert streamed == "Erfasst! "
+        event, done = events[-1]
+        assert event == "done"
+        assert done["response"] == "Erfasst!"
+        assert done["wine_action"]["name"] == "Stream Wein"
+        assert db.execute("SELECT quantity FROM wines WHERE name = 'Stream Wein'").fetchone()[0] == 2
+
+    @patch("app._stream_chat")
+    @patch("app.load_options")
+    def test_provider_error_ends_stream(self, mock_opts, mock_stream, client):
+        mock_opts.return_value = self.CHAT_OPTS
+
+        def failing(*args, **kwargs):
+            yield "Ein"
+            raise requests.exceptions.ReadTimeout("Read timed out")
+
+        mock_stream.side_effect = failing
+        events = _sse_events(self._post(client, save=False))
+        assert events == [("delta", {"text": "Ein"}), ("error", {"ok": False, "error": "timeout"})]
+
+    def test_request_errors_are_json(self, client):
+        resp = self._post(client)
+        assert resp.status_code == 400
+        assert resp.get_json()["error"] == "ai_not_configured"
+
+    def test_anthropic_stream(self, monkeypatch):
+        fake = MagicMock()
+        fake.messages.stream.return_value.__enter__.return_value.text_stream = iter(["a", "b"])
+        monkeypatch.setattr(wine_app, "_ai_client", lambda provider, opts: fake)
+        out = list(wine_app._stream_chat("anthropic", [{"role": "user", "content": "hi"}], "sys", self.CHAT_OPTS))
+        assert out == ["a", "b"]
+        assert fake.messages.stream.call_args.kwargs["system"][0]["text"] == "sys"
+
+    def test_openai_compatible_stream_skips_empty_chunks(self, monkeypatch):
+        def chunk(text):
+            c = MagicMock()
+            c.choices = [MagicMock()] if text is not None else []
+            if text is not None:
+                c.choices[0].delta.content = text
+            return c
+
+        stream = MagicMock()
+        stream.__iter__.return_value = iter([chunk("Hel"), chunk(None), chunk(""), chunk("lo")])
+        fake = MagicMock()
+        fake.chat.completions.create.return_value = stream
+        monkeypatch.setattr(wine_app, "_ai_client", lambda provider, opts: fake)
+        opts = {"mistral_api_key": "k"}
+        out = list(wine_app._stream_chat("mistral", [{"role": "user", "content": "hi"}], "sys", opts,
+                                         image_b64="QUJD", media_type="image/png"))
+        assert out == ["Hel", "lo"]
+        kwargs = fake.chat.completions.create.call_args.kwargs
+        assert kwargs["stream"] is True and kwargs["max_tokens"] == 2048
+        assert kwargs["messages"][-1]["content"][0]["image_url"]["url"] == "data:image/png;base64,QUJD"
+        stream.close.assert_called_once()
+
+    def test_ollama_stream(self, monkeypatch):
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = iter([
+            b'{"message": {"content": "Sal"}, "done": false}', b"",
+            b'{"message": {"content": "ut"}, "done": false}',
+            b'{"message": {"content": ""}, "done": true}',
+        ])
+        session = MagicMock()
+        session.post.return_value = response
+        monkeypatch.setattr(wine_app, "_ai_client", lambda provider, opts: session)
+        out = list(wine_app._stream_chat("ollama", [{"role": "user", "content": "hi"}], "sys", self.CHAT_OPTS))
+        assert out == ["Sal", "ut"]
+        assert session.post.call_args.kwargs["json"]["stream"] is True
+
 
 # ── Chat Image Upload ────────────────────────────────────────────────────────
 
@@ -891,7 +1435,7 @@ class TestChatImageUpload:
     @patch("app._call_chat")
     @patch("app.load_options")
     def test_chat_image_persisted_to_disk(self, mock_opts, mock_chat, client):
-        """Uploaded chat image should be saved to uploads/chat/<session_id>/."""
+        """Uploaded chat image should be saved content-addressed in uploads/."""
         mock_opts.return_value = self.CHAT_OPTS
         mock_chat.return_value = "Nice Bordeaux label!"
 
@@ -913,17 +1457,16 @@ class TestChatImageUpload:
         user_msg = sdata["messages"][0]
         assert user_msg["role"] == "user"
         assert user_msg.get("image_path") is not None
-        assert f"chat/{session_id}/" in user_msg["image_path"]
+        assert "/" not in user_msg["image_path"]
 
         # Verify file exists on disk
-        assert user_msg["image_path"] is not None
         fpath = os.path.join(wine_app.UPLOAD_DIR, user_msg["image_path"])
         assert os.path.isfile(fpath)
 
     @patch("app._call_chat")
     @patch("app.load_options")
     def test_chat_image_deleted_with_session(self, mock_opts, mock_chat, client):
-        """Deleting a chat session should remove its image folder."""
+        """Deleting a chat session should remove its images."""
         mock_opts.return_value = self.CHAT_OPTS
         mock_chat.return_value = "Looks great!"
 
@@ -937,16 +1480,19 @@ class TestChatImageUpload:
         )
         session_id = json.loads(resp.data)["session_id"]
 
-        # Verify image dir exists
-        chat_dir = os.path.join(wine_app.UPLOAD_DIR, "chat", str(session_id))
-        assert os.path.isdir(chat_dir)
+        messages = client.get(f"/api/chat/sessions/{session_id}").get_json()["messages"]
+        fpath = os.path.join(wine_app.UPLOAD_DIR, messages[0]["image_path"])
+        assert os.path.isfile(fpath)
+        wine_app.wait_for_image(messages[0]["image_path"])
+        old = os.path.getmtime(fpath) - 2 * 3600
+        os.utime(fpath, (old, old))
 
         # Delete session
         resp = client.delete(f"/api/chat/sessions/{session_id}")
         assert json.loads(resp.data)["ok"] is True
 
-        # Image dir should be gone
-        assert not os.path.isdir(chat_dir)
+        # Image should be gone
+        assert not os.path.isfile(fpath)
 
     @patch("app._call_chat")
     @patch("app.load_options")
@@ -220,6 +220,273 @@ class TestChatSessionTables:
         assert count == 0
 
 
+class TestConnectionPool:
+    def test_pragmas_applied(self, app):
+        """Connections should use WAL, NORMAL sync and enforce foreign keys."""
+        with app.app_context():
+            db = wine_app.get_db()
+            assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert db.execute("PRAGMA synchronous").fetchone()[0] == 1
+            assert db.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+            assert db.execute("PRAGMA busy_timeout").fetchone()[0] == wine_app.DB_BUSY_TIMEOUT_MS
+
+    def test_connection_reused_within_thread(self, app):
+        """Two requests on the same thread should share one connection."""
+        with app.app_context():
+            first = wine_app.get_db()
+        with app.app_context():
+            second = wine_app.get_db()
+        assert first is second
+
+    def test_separate_connection_per_thread(self, app):
+        """Each worker thread gets its own connection."""
+        import threading
+
+        seen = []
+
+        def worker():
+            with app.app_context():
+                seen.append(wine_app.get_db())
+
+        with app.app_context():
+            mine = wine_app.get_db()
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+        assert seen and seen[0] is not mine
+
+    def test_new_connection_when_db_path_changes(self, app, tmp_path, monkeypatch):
+        """Switching DB_PATH must not hand out the stale connection."""
+        with app.app_context():
+            first = wine_app.get_db()
+        monkeypatch.setattr(wine_app, "DB_PATH", str(tmp_path / "other.db"))
+        with app.app_context():
+            second = wine_app.get_db()
+        assert first is not second
+
+    def test_legacy_timeline_foreign_key_removed(self):
+        """Old timeline tables with a FK to wines are rebuilt without it."""
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        conn.executescript("""
+            CREATE TABLE wines (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
+                year INTEGER, type TEXT, region TEXT, quantity INTEGER DEFAULT 1,
+                rating INTEGER DEFAULT 0, notes TEXT, image TEXT, added TEXT
+            );
+            CREATE TABLE timeline (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                wine_id INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                quantity INTEGER DEFAULT 1,
+                timestamp TEXT NOT NULL,
+                FOREIGN KEY (wine_id) REFERENCES wines(id)
+            );
+            INSERT INTO wines (name) VALUES ('Old');
+            INSERT INTO timeline (wine_id, action, quantity, timestamp)
+                VALUES (1, 'added', 2, '2024-01-01');
+        """)
+        conn.close()
+
+        wine_app.init_db()
+
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        conn.execute("PRAGMA foreign_keys = ON")
+        assert conn.execute("PRAGMA foreign_key_list(timeline)").fetchall() == []
+        assert conn.execute("SELECT COUNT(*) FROM timeline").fetchone()[0] == 1
+        # Entries for deleted wines must still be accepted
+        conn.execute(
+            "INSERT INTO timeline (wine_id, action, quantity, timestamp) VALUES (999, 'removed', 1, '2024-02-01')"
+        )
+        conn.commit()
+        conn.close()
+
+
+class TestMigrations:
+    def test_fresh_db_at_current_version(self, app):
+        """A new database is stamped with the latest schema version."""
+        import migrations
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        conn.close()
+        assert version == migrations.SCHEMA_VERSION
+
+    def test_indexes_created(self, app):
+        """Secondary indexes for the hot queries should exist."""
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        conn.close()
+        for idx in ("idx_wines_type_name_year", "idx_wines_list_order", "idx_wines_region_quantity",
+                    "idx_wines_match", "idx_timeline_timestamp",
+                    "idx_chat_messages_session", "idx_chat_sessions_updated"):
+            assert idx in names
+
+    def test_migrate_is_idempotent(self, app):
+        """Running the migrations again applies nothing."""
+        import migrations
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        assert migrations.migrate(conn) == []
+        conn.close()
+
+    def test_legacy_db_is_adopted(self):
+        """A pre-versioning database (user_version 0) is upgraded in place."""
+        import migrations
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        conn.executescript("""
+            CREATE TABLE wines (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
+                year INTEGER, type TEXT, region TEXT, quantity INTEGER DEFAULT 1,
+                rating INTEGER DEFAULT 0, notes TEXT, image TEXT, added TEXT
+            );
+            INSERT INTO wines (name, quantity, added) VALUES ('Old', 3, '2023-05-01');
+        """)
+        conn.close()
+
+        wine_app.init_db()
+
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == migrations.SCHEMA_VERSION
+        assert conn.execute("SELECT name, quantity FROM wines").fetchone() == ("Old", 3)
+        assert conn.execute("SELECT COUNT(*) FROM timeline").fetchone()[0] == 1
+        conn.close()
+
+    def test_failed_step_rolls_back(self, app, monkeypatch):
+        """A failing migration leaves the version and schema untouched."""
+        import migrations
+
+        def broken(db):
+            db.execute("CREATE TABLE half_done (id INTEGER)")
+            raise RuntimeError("boom")
+
+        monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [broken])
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        with pytest.raises(RuntimeError):
+            migrations.migrate(conn)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == migrations.SCHEMA_VERSION
+        assert conn.execute(
+            "SELECT name FROM sqlite_master WHERE name='half_done'"
+        ).fetchone() is None
+        conn.close()
+
+
+class TestQueryPlans:
+    def test_hot_queries_use_indexes(self, app):
+        """Every hot query should be served by the index it was built for."""
+        import migrations
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        results = migrations.check_query_plans(conn)
+        conn.close()
+        misses = [(r["label"], r["plan"]) for r in results if not r["ok"]]
+        assert misses == []
+
+    def test_stats_queries_match_the_app(self):
+        """The checked stats queries are the ones _stats_context() runs, verbatim."""
+        import inspect
+        import migrations
+        source = inspect.getsource(wine_app._stats_context)
+        checked = [sql for label, sql, _, _ in migrations.HOT_QUERIES
+                   if label.startswith("stats:") and label != "stats: stock history"]
+        assert len(checked) == 4
+        assert [sql for sql in checked if f'"{sql}"' not in source] == []
+
+    def test_missing_index_is_reported(self, app):
+        """Dropping an index shows up as a miss."""
+        import migrations
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        conn.execute("DROP INDEX idx_chat_sessions_created")
+        results = migrations.check_query_plans(conn)
+        conn.close()
+        misses = {r["label"] for r in results if not r["ok"]}
+        assert misses == {"timeline: chat session lookup"}
+
+    def test_init_db_logs_misses(self, app, monkeypatch, caplog):
+        """init_db() warns about queries that fall back to a table scan."""
+        monkeypatch.setattr(wine_app, "check_query_plans", lambda db: [
+            {"label": "x", "index": "idx_x", "ok": False, "plan": "SCAN wines", "ms": 0.1},
+        ])
+        with caplog.at_level("WARNING"):
+            wine_app.init_db()
+        assert "idx_x" in caplog.text
+
+
+class TestCellarStats:
+    def _conn(self):
+        conn = sqlite3.connect(wine_app.DB_PATH)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def test_triggers_track_every_write(self, app):
+        """Inserts, updates and deletes keep the summary equal to a full scan."""
+        import cellar_stats
+        conn = self._conn()
+        conn.executemany(
+            "INSERT INTO wines (name, type, region, quantity, price, year, bottle_format) VALUES (?,?,?,?,?,?,?)",
+            [("A", "Rotwein", "Bordeaux", 3, 20.0, 2015, 0.75),
+             ("B", "Rotwein", None, 0, None, None, 1.5),
+             ("C", None, "Rioja", 2, 12.5, 2019, None)],
+        )
+        conn.execute("UPDATE wines SET type = 'Weisswein', quantity = 5 WHERE name = 'A'")
+        conn.execute("DELETE FROM wines WHERE name = 'B'")
+        assert cellar_stats.check(conn) == []
+        totals = cellar_stats.totals(conn)
+        assert totals["wines"] == 2
+        assert totals["in_stock_bottles"] == 7
+        assert totals["value"] == pytest.approx(5 * 20.0 + 2 * 12.5)
+        assert [g["key"] for g in cellar_stats.groups(conn, "type")] == [None, "Weisswein"]
+        conn.close()
+
+    def test_drift_is_detected_and_rebuilt(self, app):
+        import cellar_stats
+        conn = self._conn()
+        conn.execute("INSERT INTO wines (name, type, quantity) VALUES ('A', 'Rotwein', 4)")
+        conn.execute("UPDATE cellar_stats SET bottles = 99 WHERE dim = 'type'")
+        assert any("bottles" in p for p in cellar_stats.check(conn))
+        cellar_stats.rebuild(conn)
+        assert cellar_stats.check(conn) == []
+        conn.close()
+
+    def test_init_db_repairs_drift(self, app, caplog):
+        import cellar_stats
+        conn = self._conn()
+        conn.execute("INSERT INTO wines (name, type, quantity) VALUES ('A', 'Rotwein', 4)")
+        conn.execute("DELETE FROM cellar_stats")
+        conn.commit()
+        conn.close()
+        with caplog.at_level("WARNING"):
+            wine_app.init_db()
+        assert "out of sync" in caplog.text
+        conn = self._conn()
+        assert cellar_stats.check(conn) == []
+        conn.close()
+
+
+class TestAnalysisCache:
+    def test_ttl_and_lru_eviction(self, db, monkeypatch):
+        import analysis_cache
+        now = [1000.0]
+        monkeypatch.setattr(analysis_cache.time, "time", lambda: now[0])
+        for i in range(3):
+            analysis_cache.put(db, f"k{i}", {"name": f"Wine {i}"}, ttl_seconds=100, max_entries=3)
+            now[0] += 1
+        assert analysis_cache.get(db, "k0", 100) == {"name": "Wine 0"}  # k1 is now the oldest used
+        analysis_cache.put(db, "k3", {"name": "Wine 3"}, ttl_seconds=100, max_entries=3)
+        keys = {r[0] for r in db.execute("SELECT key FROM analysis_cache")}
+        assert keys == {"k0", "k2", "k3"}
+
+        now[0] += 100
+        assert analysis_cache.get(db, "k2", 100) is None
+        assert analysis_cache.get(db, "k3", 100) == {"name": "Wine 3"}
+
+    def test_key_covers_image_prompt_and_model(self):
+        import analysis_cache
+        base = analysis_cache.cache_key("QUJD", "prompt", "anthropic", "m1")
+        assert base == analysis_cache.cache_key("QUJD", "prompt", "anthropic", "m1")
+        assert len({base,
+                    analysis_cache.cache_key("QUJE", "prompt", "anthropic", "m1"),
+                    analysis_cache.cache_key("QUJD", "prompt2", "anthropic", "m1"),
+                    analysis_cache.cache_key("QUJD", "prompt", "openai", "m1"),
+                    analysis_cache.cache_key("QUJD", "prompt", "anthropic", "m2")}) == 5
+
+
 class TestDatabaseOperations:
     def test_insert_and_read(self, app, db):
         """Basic insert and read."""
@@ -161,6 +161,58 @@ class TestExportImages:
         assert image_entries == [f"images/{fname}"]
 
 
+# ── Export: streaming ─────────────────────────────────────────────────────────
+
+class TestStreamingExport:
+    def test_route_streams_without_length(self, client, sample_wine):
+        resp = client.get("/export", buffered=False)
+        assert resp.is_streamed
+        assert "Content-Length" not in resp.headers
+        zf = zipfile.ZipFile(io.BytesIO(b"".join(resp.response)))
+        assert json.loads(zf.read("manifest.json"))["wine_count"] == 1
+        resp.close()
+
+    def test_chunks_stay_bounded(self, app, db, upload_dir):
+        """A large image is copied block by block, never as one chunk."""
+        import app as wine_app
+        from export_import import iter_export_zip
+        payload = os.urandom(1024 * 1024)  # incompressible
+        with open(os.path.join(upload_dir, "big.jpg"), "wb") as f:
+            f.write(payload)
+        db.execute("INSERT INTO wines (name, image) VALUES ('Big', 'big.jpg')")
+        db.commit()
+
+        chunks = list(iter_export_zip(db, wine_app.UPLOAD_DIR, chunk_size=16 * 1024))
+        assert max(len(c) for c in chunks) < 64 * 1024
+        zf = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+        assert zf.testzip() is None
+        assert zf.read("images/big.jpg") == payload
+
+    def test_csv_chunks_stay_bounded(self, app, db):
+        """wines.csv is flushed while rows are written, like the JSON entries."""
+        import app as wine_app
+        from export_import import iter_export_zip
+        db.executemany("INSERT INTO wines (name, notes) VALUES (?, ?)",
+                       [(f"W{i}", os.urandom(300).hex()) for i in range(2000)])
+        db.commit()
+
+        chunks = list(iter_export_zip(db, wine_app.UPLOAD_DIR, chunk_size=16 * 1024))
+        assert max(len(c) for c in chunks) < 64 * 1024
+        zf = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+        assert zf.testzip() is None
+        assert zf.read("wines.csv").decode("utf-8").count("\r\n") == 2001
+
+    def test_json_matches_full_dump(self, client, db):
+        for i in range(3):
+            db.execute("INSERT INTO wines (name, notes) VALUES (?, ?)", (f"W{i}", "Zeile 1\nZeile 2"))
+        db.commit()
+        zf = zipfile.ZipFile(io.BytesIO(client.get("/export").data))
+        for name in ("wines.json", "timeline.json"):
+            text = zf.read(name).decode("utf-8")
+            assert text == json.dumps(json.loads(text), indent=2, ensure_ascii=False)
+        assert zf.read("wines.csv").decode("utf-8").count("\r\n") == 4
+
+
 # ── Module-level helpers ──────────────────────────────────────────────────────
 
 class TestModuleHelpers:
@@ -449,7 +501,7 @@ class TestImportRoutes:
             assert restored[col] == original[col], f"mismatch on {col}"
 
     def test_image_is_restored_on_import(self, client, db, upload_dir):
-        """Image file inside the ZIP is written into the uploads folder."""
+        """Image file inside the ZIP is stored in the uploads folder."""
         import zipfile as zf_mod
         img_name = "restored-img.jpg"
         img_bytes = b"\xFF\xD8\xFFFAKEJPEG"
@@ -471,12 +523,261 @@ class TestImportRoutes:
             content_type="application/json",
         )
 
-        dest = os.path.join(upload_dir, img_name)
+        image = db.execute("SELECT image FROM wines WHERE name = 'Imaged'").fetchone()[0]
+        dest = os.path.join(upload_dir, image)
         assert os.path.isfile(dest)
         with open(dest, "rb") as f:
             assert f.read() == img_bytes
 
 
+    def test_reimport_on_same_instance_does_not_duplicate_images(self, client, db, upload_dir):
+        """A backup holds downscaled bytes; importing it back must reuse the stored file."""
+        import app as wine_app
+        from PIL import Image
+        photo = io.BytesIO()
+        Image.new("RGB", (3000, 2000), (90, 10, 30)).save(photo, format="JPEG")
+        photo.seek(0)
+        resp = client.post(
+            "/add",
+            data={"name": "Foto", "quantity": "1", "image": (photo, "label.jpg")},
+            content_type="multipart/form-data",
+            headers=AJAX,
+        )
+        image = json.loads(resp.data)["wine"]["image"]
+        wine_app.wait_for_image(image)
+
+        preview = json.loads(self._upload(client, client.get("/export").data, "b.zip").data)
+        client.post(
+            "/import/commit",
+            data=json.dumps({"token": preview["token"], "strategy": "overwrite"}),
+            content_type="application/json",
+        )
+
+        assert os.listdir(upload_dir) == [image]
+        assert db.execute("SELECT image FROM wines WHERE name = 'Foto'").fetchone()[0] == image
+
+# ── Import: spooled upload, lazy archive, cached preview ──────────────────────
+
+class TestStreamingImport:
+    @staticmethod
+    def _archive(path, images):
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.writestr("manifest.json", json.dumps({"schema_version": 1}))
+            zf.writestr("wines.json", json.dumps([
+                {"id": i, "name": f"Wine {i}", "image": name} for i, name in enumerate(images)
+            ]))
+            for name, blob in images.items():
+                zf.writestr(f"images/{name}", blob)
+
+    def test_parse_from_path_keeps_images_in_archive(self, tmp_path):
+        from export_import import parse_import_file
+        path = str(tmp_path / "b.zip")
+        self._archive(path, {"a.jpg": b"A" * 1000})
+        parsed = parse_import_file(path)
+        assert parsed["images"] == {"a.jpg": "images/a.jpg"}
+        assert parsed["archive"] == path
+        json.dumps(parsed)  # cacheable as-is
+
+    def test_apply_extracts_images_from_archive(self, app, db, tmp_path, upload_dir):
+        from export_import import parse_import_file, match_wines, apply_import
+        path = str(tmp_path / "b.zip")
+        payload = os.urandom(300 * 1024)
+        self._archive(path, {"big.jpg": payload, "small.jpg": b"x"})
+        parsed = parse_import_file(path)
+        result = apply_import(parsed, match_wines(parsed["wines"], db), db, upload_dir)
+        assert result["inserted"] == 2
+        image = db.execute("SELECT image FROM wines WHERE name = 'Wine 0'").fetchone()[0]
+        with open(os.path.join(upload_dir, image), "rb") as f:
+            assert f.read() == payload
+        assert not [n for n in os.listdir(upload_dir) if n.endswith(".part")]
+
+    def test_commit_uses_cached_preview(self, client, db, tmp_path, monkeypatch):
+        import app as wine_app
+        tmp_path = tmp_path / "import_tmp"
+        tmp_path.mkdir()
+        monkeypatch.setattr(wine_app, "IMPORT_TMP_DIR", str(tmp_path))
+        path = tmp_path / "src.zip"
+        self._archive(str(path), {"c.jpg": b"C"})
+
+        preview = json.loads(client.post(
+            "/import/preview",
+            data={"file": (io.BytesIO(path.read_bytes()), "c.zip")},
+            content_type="multipart/form-data",
+        ).data)
+        token = preview["token"]
+        assert os.path.isfile(tmp_path / f"{token}.upload")
+        assert os.path.isfile(tmp_path / f"{token}.json")
+
+        def no_reparse(*a, **kw):
+            raise AssertionError("commit must not parse the archive again")
+        monkeypatch.setattr(wine_app, "parse_import_file", no_reparse)
+        body = json.loads(client.post(
+            "/import/commit",
+            data=json.dumps({"token": token, "strategy": "skip"}),
+            content_type="application/json",
+        ).data)
+        assert body["inserted"] == 1
+        image = db.execute("SELECT image FROM wines").fetchall()[-1][0]
+        assert os.path.isfile(os.path.join(wine_app.UPLOAD_DIR, image))
+        assert not list(tmp_path.glob(f"{token}.*"))
+
+    def test_csv_upload_is_not_kept(self, client, tmp_path, monkeypatch):
+        import app as wine_app
+        tmp_path = tmp_path / "import_tmp"
+        tmp_path.mkdir()
+        monkeypatch.setattr(wine_app, "IMPORT_TMP_DIR", str(tmp_path))
+        preview = json.loads(client.post(
+            "/import/preview",
+            data={"file": (io.BytesIO(b"name,year\nRioja,2019\n"), "w.csv")},
+            content_type="multipart/form-data",
+        ).data)
+        assert preview["counts"]["new"] == 1
+        assert [p.name for p in tmp_path.iterdir()] == [f"{preview['token']}.json"]
+
+    def test_expired_archive_is_rejected(self, client, tmp_path, monkeypatch):
+        import app as wine_app
+        tmp_path = tmp_path / "import_tmp"
+        tmp_path.mkdir()
+        monkeypatch.setattr(wine_app, "IMPORT_TMP_DIR", str(tmp_path))
+        path = tmp_path / "src.zip"
+        self._archive(str(path), {})
+        token = json.loads(client.post(
+            "/import/preview",
+            data={"file": (io.BytesIO(path.read_bytes()), "c.zip")},
+            content_type="multipart/form-data",
+        ).data)["token"]
+        os.remove(tmp_path / f"{token}.upload")
+        resp = client.post("/import/commit", data=json.dumps({"token": token}),
+                           content_type="application/json")
+        assert resp.status_code == 404
+
+
+# ── Import: batched writes ────────────────────────────────────────────────────
+
+class TestBulkApply:
+    @staticmethod
+    def _parsed(wines, timeline):
+        from export_import import _normalize_wine
+        return {
+            "wines": [_normalize_wine(w) for w in wines],
+            "original_ids": [w.get("id") for w in wines],
+            "timeline": timeline,
+            "images": {},
+            "archive": None,
+        }
+
+    def test_full_timeline_replayed_for_new_wines(self, app, db, upload_dir):
+        from export_import import match_wines, apply_import
+        db.execute("INSERT INTO wines (id, name, year) VALUES (50, 'Known', 2018)")
+        db.execute("INSERT INTO timeline (wine_id, action, quantity, timestamp) "
+                   "VALUES (50, 'added', 1, '2020-01-01')")
+        db.commit()
+        parsed = self._parsed(
+            [{"id": 1, "name": "New", "year": 2020}, {"id": 2, "name": "Known", "year": 2018}],
+            [{"wine_id": 1, "action": "added", "quantity": 6, "timestamp": "2021-01-01"},
+             {"wine_id": 1, "action": "consumed", "quantity": 2, "timestamp": "2021-06-01"},
+             {"wine_id": 2, "action": "consumed", "quantity": 1, "timestamp": "2021-06-01"},
+             {"wine_id": 99, "action": "added", "quantity": 1, "timestamp": "2021-06-01"}],
+        )
+        result = apply_import(parsed, match_wines(parsed["wines"], db), db, upload_dir,
+                              strategy="overwrite")
+        assert result == {"inserted": 1, "updated": 1, "skipped": 0}
+        new_id = db.execute("SELECT id FROM wines WHERE name = 'New'").fetchone()[0]
+        assert new_id > 50
+        rows = db.execute("SELECT wine_id, action FROM timeline ORDER BY id").fetchall()
+        assert [tuple(r) for r in rows] == [
+            (50, "added"), (new_id, "added"), (new_id, "consumed"),
+        ]
+
+    def test_progress_is_reported_per_batch(self, app, db, upload_dir):
+        from export_import import match_wines, apply_import
+        parsed = self._parsed(
+            [{"id": i, "name": f"W{i}"} for i in range(5)],
+            [{"wine_id": i, "action": "added", "quantity": 1} for i in range(5)],
+        )
+        calls = []
+        apply_import(parsed, match_wines(parsed["wines"], db), db, upload_dir,
+                     progress=lambda *a: calls.append(a), batch_size=2)
+        assert [c for c in calls if c[0] == "wines"] == [("wines", 2, 5), ("wines", 4, 5), ("wines", 5, 5)]
+        assert calls[-1] == ("timeline", 5, 5)
+
+    def test_failure_rolls_back_everything(self, app, db, upload_dir):
+        from export_import import match_wines, apply_import
+        parsed = self._parsed([{"id": i, "name": f"W{i}"} for i in range(4)], [])
+
+        def boom(stage, done, total):
+            if stage == "wines" and done >= 2:
+                raise RuntimeError("cancelled")
+        with pytest.raises(RuntimeError):
+            apply_import(parsed, match_wines(parsed["wines"], db), db, upload_dir,
+                         progress=boom, batch_size=2)
+        assert db.execute("SELECT COUNT(*) FROM wines").fetchone()[0] == 0
+
+    def test_failure_rolls_back_overwrites(self, app, db, upload_dir):
+        from export_import import match_wines, apply_import
+        db.execute("INSERT INTO wines (name, year, notes) VALUES ('Known', 2018, 'mine')")
+        db.commit()
+        parsed = self._parsed([{"id": 1, "name": "Known", "year": 2018, "notes": "theirs"},
+                               {"id": 2, "name": "New"}], [])
+
+        def boom(stage, done, total):
+            if stage == "wines" and done == total:
+                raise RuntimeError("cancelled")
+        with pytest.raises(RuntimeError):
+            apply_import(parsed, match_wines(parsed["wines"], db), db, upload_dir,
+                         strategy="overwrite", progress=boom, batch_size=1)
+        rows = db.execute("SELECT name, notes FROM wines").fetchall()
+        assert [tuple(r) for r in rows] == [("Known", "mine")]
+
+    def test_concurrent_edit_waits_for_import(self, app, db, upload_dir):
+        """An edit made while the import holds the write lock goes through once it commits."""
+        import threading
+        import time
+        import app as wine_app
+        from export_import import match_wines, apply_import
+        parsed = self._parsed([{"id": i, "name": f"W{i}"} for i in range(4)], [])
+        writing = threading.Event()
+
+        def slow(stage, done, total):
+            if stage == "wines":
+                writing.set()
+                time.sleep(0.3)
+        matches = match_wines(parsed["wines"], db)
+
+        def run():
+            conn = wine_app._connect()
+            apply_import(parsed, matches, conn, upload_dir, progress=slow, batch_size=2)
+            conn.close()
+        importer = threading.Thread(target=run)
+        importer.start()
+        assert writing.wait(5)
+        other = wine_app._connect()
+        other.execute("INSERT INTO wines (name) VALUES ('From the UI')")
+        other.commit()
+        other.close()
+        importer.join()
+        names = [r[0] for r in db.execute("SELECT name FROM wines ORDER BY id")]
+        assert names == ["W0", "W1", "W2", "W3", "From the UI"]
+
+    def test_import_job_waits_for_other_writers(self, app, db, monkeypatch):
+        """The job connection outwaits a writer that holds the lock longer than DB_BUSY_TIMEOUT_MS."""
+        import threading
+        import app as wine_app
+        monkeypatch.setattr(wine_app, "DB_BUSY_TIMEOUT_MS", 100)
+        parsed = self._parsed([{"id": 1, "name": "Imported"}], [])
+        writer = sqlite3.connect(wine_app.DB_PATH, check_same_thread=False)
+        writer.execute("BEGIN IMMEDIATE")
+        release = threading.Timer(0.5, writer.commit)
+        release.start()
+        job = type("Job", (), {"progress": staticmethod(lambda *a: None)})()
+        try:
+            result = wine_app._import_job(job, parsed, "no-token", "skip")
+        finally:
+            release.join()
+            writer.close()
+        assert result["inserted"] == 1
+
+
 # ── Auth: readonly user blocked ───────────────────────────────────────────────
 
 class TestImportAuth:
@@ -47,6 +47,39 @@ class TestLoadOptions:
         opts = wine_app.load_options()
         assert opts["currency"] == "CHF"
 
+    def test_file_parsed_once_until_changed(self, tmp_path, monkeypatch):
+        opts_file = tmp_path / "options.json"
+        opts_file.write_text('{"currency": "EUR"}')
+        monkeypatch.setattr(wine_app, "OPTIONS_PATH", str(opts_file))
+        calls = []
+        real_load = wine_app.json.load
+        monkeypatch.setattr(wine_app.json, "load", lambda f: calls.append(1) or real_load(f))
+
+        assert wine_app.load_options()["currency"] == "EUR"
+        assert wine_app.load_options()["currency"] == "EUR"
+        assert len(calls) == 1
+
+        opts_file.write_text('{"currency": "USD"}')
+        st = os.stat(opts_file)
+        os.utime(opts_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        assert wine_app.load_options()["currency"] == "USD"
+        assert len(calls) == 2
+
+    def test_cached_options_not_shared(self, tmp_path, monkeypatch):
+        opts_file = tmp_path / "options.json"
+        opts_file.write_text('{"currency": "EUR"}')
+        monkeypatch.setattr(wine_app, "OPTIONS_PATH", str(opts_file))
+        wine_app.load_options()["currency"] = "XXX"
+        assert wine_app.load_options()["currency"] == "EUR"
+
+    def test_env_override_applies_to_cached_file(self, tmp_path, monkeypatch):
+        opts_file = tmp_path / "options.json"
+        opts_file.write_text('{"currency": "EUR"}')
+        monkeypatch.setattr(wine_app, "OPTIONS_PATH", str(opts_file))
+        wine_app.load_options()
+        monkeypatch.setenv("CURRENCY", "GBP")
+        assert wine_app.load_options()["currency"] == "GBP"
+
 
 # ── _is_ai_configured() ──────────────────────────────────────────────────────
 
@@ -93,6 +126,100 @@ class TestIsAiConfigured:
         ) is False
 
 
+# ── AI provider clients ───────────────────────────────────────────────────────
+
+class TestAiClients:
+    OPTS = {"ai_provider": "openrouter", "openrouter_api_key": "or-1", "openrouter_model": "m"}
+
+    @pytest.fixture
+    def built(self, monkeypatch):
+        """Swap in a registry whose builder records calls and returns mocks."""
+        from unittest.mock import MagicMock
+        import ai_clients
+        calls = []
+
+        def builder(sdk, api_key, base_url):
+            calls.append((sdk, api_key, base_url))
+            return MagicMock()
+
+        monkeypatch.setattr(wine_app, "_ai_clients", ai_clients.ClientRegistry(builder))
+        return calls
+
+    def test_client_is_reused(self, built):
+        first = wine_app._ai_client("openrouter", self.OPTS)
+        assert wine_app._ai_client("openrouter", self.OPTS) is first
+        assert built == [("openai", "or-1", "https://openrouter.ai/api/v1")]
+
+    def test_client_is_rebuilt_when_key_changes(self, built):
+        first = wine_app._ai_client("openrouter", self.OPTS)
+        second = wine_app._ai_client("openrouter", {**self.OPTS, "openrouter_api_key": "or-2"})
+        assert second is not first
+        assert [c[1] for c in built] == ["or-1", "or-2"]
+
+    def test_calls_share_one_client(self, built):
+        client = wine_app._ai_client("openrouter", self.OPTS)
+        client.chat.completions.create.return_value.choices[0].message.content = "{}"
+        wine_app._call_openrouter(None, None, "prompt", self.OPTS)
+        wine_app._call_chat_openrouter([{"role": "user", "content": "hi"}], "sys", self.OPTS)
+        assert len(built) == 1
+        assert client.chat.completions.create.call_count == 2
+
+    def test_real_clients_are_built_lazily(self):
+        import ai_clients
+        registry = ai_clients.ClientRegistry()
+        client = registry.get("mistral", "openai", "k", "https://api.mistral.ai/v1")
+        assert str(client.base_url).startswith("https://api.mistral.ai/v1")
+        assert registry.get("mistral", "openai", "k", "https://api.mistral.ai/v1") is client
+        assert registry.get("anthropic", "anthropic", "k").api_key == "k"
+
+    def test_provider_call_lookup(self):
+        from unittest.mock import patch
+        assert wine_app._provider_call("unknown") is None
+        assert wine_app._provider_call("ollama", chat=True) is wine_app._call_chat_ollama
+        with patch("app._call_mistral") as fake:
+            assert wine_app._provider_call("mistral") is fake
+
+    def test_rate_limiter_spaces_requests_per_provider(self):
+        import ai_clients
+        now, slept = [100.0], []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+
+        limiter = ai_clients.RateLimiter(clock=lambda: now[0], sleep=sleep)
+        waits = [limiter.acquire("anthropic", 30) for _ in range(3)]
+        assert waits == [0.0, 2.0, 2.0]
+        assert limiter.acquire("openai", 30) == 0.0
+        assert limiter.acquire("anthropic", 0) == 0.0
+        now[0] += 10
+        assert limiter.acquire("anthropic", 30) == 0.0
+
+
+# ── server_settings() ─────────────────────────────────────────────────────────
+
+class TestServerSettings:
+    def test_defaults(self, monkeypatch):
+        monkeypatch.setattr(wine_app, "OPTIONS_PATH", "/nonexistent/options.json")
+        monkeypatch.delenv("SERVER_WORKERS", raising=False)
+        monkeypatch.delenv("SERVER_THREADS", raising=False)
+        assert wine_app.server_settings() == {"workers": 2, "threads": 4}
+
+    def test_env_override(self, monkeypatch):
+        monkeypatch.setattr(wine_app, "OPTIONS_PATH", "/nonexistent/options.json")
+        monkeypatch.setenv("SERVER_WORKERS", "3")
+        monkeypatch.setenv("SERVER_THREADS", "8")
+        assert wine_app.server_settings() == {"workers": 3, "threads": 8}
+
+    def test_values_are_clamped(self):
+        settings = wine_app.server_settings({"server_workers": 100, "server_threads": 0})
+        assert settings == {"workers": 8, "threads": 1}
+
+    def test_invalid_values_fall_back(self):
+        settings = wine_app.server_settings({"server_workers": "many", "server_threads": None})
+        assert settings == {"workers": 2, "threads": 4}
+
+
 # ── allowed() ─────────────────────────────────────────────────────────────────
 
 class TestAllowed:
@@ -414,3 +541,200 @@ class TestBuildWineCellarContext:
             text, _ = wine_app._build_wine_cellar_context()
         # English fallback applied
         assert "Vintage 2020" in text
+
+
+    def test_unchanged_cellar_is_served_from_cache(self, app, sample_wine):
+        queries = []
+        with app.app_context():
+            wine_app._build_wine_cellar_context()
+            db = wine_app.get_db()
+            db.set_trace_callback(queries.append)
+            text, count = wine_app._build_wine_cellar_context()
+            db.set_trace_callback(None)
+        assert count == 1 and "Château Test" in text
+        assert not [q for q in queries if "FROM wines" in q]
+
+    def test_only_changed_wines_are_reformatted(self, app, client, sample_wine):
+        wine_id = sample_wine["wine"]["id"]
+        client.post("/add", data={"name": "Zweiter", "type": "Weisswein", "quantity": "1"})
+        with app.app_context():
+            wine_app._build_wine_cellar_context()
+            db = wine_app.get_db()
+            db.execute("UPDATE wines SET quantity = 5 WHERE id = ?", (wine_id,))
+            db.commit()
+            text, count = wine_app._build_wine_cellar_context()
+        assert wine_app._cellar_context.rebuilt_lines == 1
+        assert count == 2
+        assert "Menge: 5" in text
+        # Listed by id: new wines are appended, the prefix stays stable
+        assert text.index("Château Test") < text.index("Zweiter")
+
+
+class TestPromptCaching:
+    def test_system_prompt_breakpoint_after_stable_prefix(self):
+        prompt = wine_app._SystemPrompt("rules + cellar\n\nImages: 1", stable_len=len("rules + cellar"))
+        assert prompt == "rules + cellar\n\nImages: 1"
+        assert wine_app._anthropic_system(prompt) == [
+            {"type": "text", "text": "rules + cellar", "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": "Images: 1"},
+        ]
+        assert len(wine_app._anthropic_system("plain")) == 1
+
+    def test_last_turn_is_cached(self):
+        history = [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"},
+                   {"role": "user", "content": "c"}]
+        out = wine_app._anthropic_messages(history, "QUJD", "image/png")
+        assert out[:2] == history[:2]
+        image, text = out[-1]["content"]
+        assert image["type"] == "image" and "cache_control" not in image
+        assert text == {"type": "text", "text": "c", "cache_control": {"type": "ephemeral"}}
+        assert history[-1] == {"role": "user", "content": "c"}
+
+
+class TestCellarRetrieval:
+    @pytest.fixture
+    def cellar(self, app, client):
+        for name, type_, region, grape, qty, notes in (
+            ("Barolo Riserva", "Rotwein", "Piemonte", "Nebbiolo", 2, ""),
+            ("Barbaresco", "Rotwein", "Piemonte", "Nebbiolo", 0, ""),
+            ("Rioja Reserva", "Rotwein", "Rioja", "Tempranillo", 3, "great with lamb"),
+            ("Riesling Kabinett", "Weisswein", "Mosel", "Riesling", 6, ""),
+            ("Brut Réserve", "Schaumwein", "Champagne", "Chardonnay", 1, ""),
+        ):
+            client.post("/add", data={"name": name, "type": type_, "region": region, "grape": grape,
+                                      "quantity": str(qty), "notes": notes})
+        with app.app_context():
+            db = wine_app.get_db()
+            yield db, {r["name"]: r["id"] for r in db.execute("SELECT id, name FROM wines")}
+
+    def test_terms_drop_stopwords(self):
+        import cellar_retrieval
+        assert cellar_retrieval.terms("Which wine goes with the lamb, rack B6?") == ["goes", "lamb", "rack", "b6"]
+
+    def test_search_hits_come_first_in_stock_only(self, cellar):
+        import cellar_retrieval
+        db, ids = cellar
+        picked = cellar_retrieval.relevant_ids(db, "Something from Piemonte?", k=3)
+        assert picked[0] == ids["Barolo Riserva"]
+        assert ids["Barbaresco"] not in picked
+        assert len(picked) == 3
+        assert cellar_retrieval.relevant_ids(db, "Was passt zu Lamm? lamb", k=1) == [ids["Rioja Reserva"]]
+
+    def test_referenced_wines_and_types(self, cellar):
+        import cellar_retrieval
+        db, ids = cellar
+        history = [f"Try the [Riesling](wine:{ids['Riesling Kabinett']})"]
+        picked = cellar_retrieval.relevant_ids(db, "And a sparkling one?", history, k=2)
+        assert picked == [ids["Riesling Kabinett"], ids["Brut Réserve"]]
+
+    def test_summary(self, cellar):
+        import cellar_retrieval
+        db, _ = cellar
+        text = cellar_retrieval.summary(db)
+        assert "Rotwein 2 wines / 5 bottles" in text
+        assert "Top regions: " in text and "Piemonte (1)" in text
+        assert "Barbaresco" not in text
+
+
+class TestDrinkWindowHistogram:
+    @staticmethod
+    def _naive(rows):
+        """Reference: walk every year of every window."""
+        counts = {}
+        for r in rows:
+            try:
+                until = int(r["drink_until"])
+                frm = int(r["drink_from"]) if r["drink_from"] else until
+            except (ValueError, TypeError):
+                continue
+            for yr in range(frm, until + 1):
+                by_type = counts.setdefault(yr, {})
+                t = r["type"] or "Anderes"
+                by_type[t] = by_type.get(t, 0) + r["quantity"]
+        if not counts:
+            return []
+        return [{"year": yr, "counts": counts.get(yr, {})}
+                for yr in range(min(counts), max(counts) + 1)]
+
+    @staticmethod
+    def _row(type_, qty, frm, until):
+        return {"type": type_, "quantity": qty, "drink_from": frm, "drink_until": until}
+
+    def test_matches_naive_loop(self):
+        import random
+        import cellar_stats
+        rnd = random.Random(7)
+        rows = []
+        for _ in range(300):
+            frm = rnd.randint(2015, 2040)
+            rows.append(self._row(
+                rnd.choice(["Rotwein", "Weisswein", None]), rnd.randint(1, 12),
+                rnd.choice([frm, None, ""]), frm + rnd.randint(-2, 15),
+            ))
+        chart, types = cellar_stats.drink_window_histogram(rows)
+        assert chart == self._naive(rows)
+        assert types == ["Anderes", "Rotwein", "Weisswein"]
+
+    def test_gap_years_are_empty(self):
+        import cellar_stats
+        chart, _ = cellar_stats.drink_window_histogram([
+            self._row("Rotwein", 2, 2020, 2020), self._row("Rotwein", 1, 2023, 2024),
+        ])
+        assert [c["year"] for c in chart] == [2020, 2021, 2022, 2023, 2024]
+        assert chart[1]["counts"] == {}
+        assert chart[4]["counts"] == {"Rotwein": 1}
+
+    def test_invalid_windows_ignored(self):
+        import cellar_stats
+        rows = [self._row("Rotwein", 1, "abc", 2030), self._row("Rotwein", 1, 2031, 2030)]
+        assert cellar_stats.drink_window_histogram(rows) == ([], [])
+
+
+# ── image_variants.load_scaled() ──────────────────────────────────────────────
+
+class TestLoadScaled:
+    @staticmethod
+    def _jpeg(size, orientation=1):
+        import io
+        from PIL import Image
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        buf = io.BytesIO()
+        Image.new("RGB", size, (200, 30, 60)).save(buf, format="JPEG", exif=exif)
+        buf.seek(0)
+        return Image.open(buf)
+
+    def test_jpeg_decoded_at_reduced_scale(self):
+        from image_variants import load_scaled
+        img = self._jpeg((8000, 6000))
+        out = load_scaled(img, 1800)
+        assert img.size == (2000, 1500)  # draft: 1/4 scale, not 48 MP
+        assert out.size == (1800, 1350)
+        assert out.getpixel((900, 675)) == pytest.approx((200, 30, 60), abs=3)
+
+    def test_exif_orientation_applied(self):
+        from image_variants import load_scaled
+        out = load_scaled(self._jpeg((4000, 3000), orientation=6), 1800)
+        assert out.size == (1350, 1800)
+
+    def test_is_final(self):
+        from image_variants import is_final
+        assert is_final(self._jpeg((1800, 1200)), 1800)
+        assert not is_final(self._jpeg((1801, 1200)), 1800)
+        assert not is_final(self._jpeg((800, 600), orientation=6), 1800)
+
+    def test_decode_cap(self, monkeypatch):
+        import image_variants
+        from PIL import Image
+        monkeypatch.setattr(image_variants, "MAX_DECODE_PIXELS", 5000)
+        with pytest.raises(ValueError):
+            image_variants.load_scaled(Image.new("RGB", (100, 100)), 50)
+        # JPEGs are checked after draft mode has shrunk them
+        assert image_variants.load_scaled(self._jpeg((400, 400)), 20).size == (20, 20)
+
+    def test_small_upload_not_reencoded(self, tmp_path):
+        path = tmp_path / "small.jpg"
+        self._jpeg((640, 480)).save(path, quality=100)
+        before = path.read_bytes()
+        wine_app._downscale(str(path))
+        assert path.read_bytes() == before
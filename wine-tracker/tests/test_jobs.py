@@ -0,0 +1,376 @@
+"""
+Tests for the background job runner and the /api/jobs endpoints.
+
+Jobs run on real worker threads; tests wait for them via
+``JobRunner.wait`` before asserting on their stored outcome.
+"""
+import io
+import json
+import os
+import sys
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+sys.path.insert(0, APP_DIR)
+
+import app as wine_app
+import jobs
+
+AJAX = {"X-Requested-With": "XMLHttpRequest"}
+
+
+@pytest.fixture
+def runner():
+    r = jobs.JobRunner(max_workers=1)
+    yield r
+    r.shutdown()
+
+
+def _wait(job_id):
+    wine_app._jobs.wait(job_id, timeout=10)
+    return wine_app.jobs.get(wine_app._jobs_db(), job_id)
+
+
+# ── Runner ────────────────────────────────────────────────────────────────────
+
+class TestJobRunner:
+    def test_result_and_progress_are_stored(self, runner, tmp_path):
+        path = str(tmp_path / "jobs.db")
+
+        def work(job, n):
+            for i in range(n):
+                job.progress("count", i, n)
+            job.progress("count", n, n)
+            return {"counted": n}
+
+        job_id = runner.submit(path, "test", work, 3)
+        runner.wait(job_id, timeout=10)
+        job = jobs.get(path, job_id)
+        assert job["status"] == "done"
+        assert job["kind"] == "test"
+        assert job["result"] == {"counted": 3}
+        assert (job["stage"], job["done"], job["total"]) == ("count", 3, 3)
+
+    def test_exception_marks_job_failed(self, runner, tmp_path):
+        path = str(tmp_path / "jobs.db")
+
+        def work(job):
+            raise RuntimeError("boom")
+
+        job_id = runner.submit(path, "test", work)
+        runner.wait(job_id, timeout=10)
+        job = jobs.get(path, job_id)
+        assert job["status"] == "failed"
+        assert job["error"] == "boom"
+        assert job["result"] is None
+
+    def test_progress_writes_are_throttled(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "jobs.db")
+        writes = []
+        monkeypatch.setattr(jobs, "_update", lambda p, i, **f: writes.append(f))
+        ctx = jobs.JobContext(path, "x")
+        for i in range(1000):
+            ctx.progress("rows", i, 1000)
+        ctx.progress("rows", 1000, 1000)
+        # First call and the final one; everything in between is throttled
+        assert [w["done"] for w in writes] == [0, 1000]
+
+    def test_recover_fails_unfinished_jobs(self, tmp_path):
+        path = str(tmp_path / "jobs.db")
+        conn = jobs.connect(path)
+        conn.executemany(
+            "INSERT INTO jobs (id, kind, status, created, updated) VALUES (?, 'test', ?, ?, ?)",
+            [("run", "running", "2026-01-01T00:00:00", "2099-01-01T00:00:00"),
+             ("new", "queued", "2026-01-01T00:00:00", "2099-01-01T00:00:00"),
+             ("old", "done", "2000-01-01T00:00:00", "2000-01-01T00:00:00"),
+             ("ok", "done", "2099-01-01T00:00:00", "2099-01-01T00:00:00")],
+        )
+        conn.commit()
+        conn.close()
+
+        assert sorted(jobs.recover(path)) == ["new", "run"]
+        assert jobs.get(path, "run")["error"] == "interrupted"
+        assert jobs.get(path, "new")["status"] == "failed"
+        assert jobs.get(path, "old") is None
+        assert jobs.get(path, "ok")["status"] == "done"
+
+    def _insert(self, path, job_id, pid, heartbeat):
+        conn = jobs.connect(path)
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, created, updated, pid, heartbeat) "
+            "VALUES (?, 'test', 'running', ?, ?, ?, ?)",
+            (job_id, heartbeat, heartbeat, pid, heartbeat),
+        )
+        conn.commit()
+        conn.close()
+
+    def test_get_fails_job_of_dead_worker(self, tmp_path):
+        import subprocess
+        path = str(tmp_path / "jobs.db")
+        proc = subprocess.Popen([sys.executable, "-c", "pass"])
+        proc.wait()
+        self._insert(path, "dead", proc.pid, jobs._now())
+
+        job = jobs.get(path, "dead")
+        assert (job["status"], job["error"]) == ("failed", "interrupted")
+
+    def test_reap_fails_silent_jobs_only(self, tmp_path):
+        path = str(tmp_path / "jobs.db")
+        self._insert(path, "live", os.getpid(), jobs._now())
+        self._insert(path, "silent", os.getpid(), "2026-01-01T00:00:00")
+
+        assert jobs.reap(path) == ["silent"]
+        assert jobs.get(path, "live")["status"] == "running"
+        assert jobs.get(path, "silent")["status"] == "failed"
+
+    def test_heartbeat_keeps_running_job_alive(self, runner, tmp_path, monkeypatch):
+        import threading
+        import time
+        monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL", 0.05)
+        path = str(tmp_path / "jobs.db")
+        release = threading.Event()
+        job_id = runner.submit(path, "test", lambda job: release.wait(10))
+        conn = jobs.connect(path)
+        conn.execute("UPDATE jobs SET heartbeat = '2026-01-01T00:00:00' WHERE id = ?", (job_id,))
+        conn.commit()
+        conn.close()
+        time.sleep(0.3)
+
+        job = jobs.get(path, job_id)
+        assert job["status"] in ("queued", "running")
+        assert job["pid"] == os.getpid()
+        release.set()
+        runner.wait(job_id, timeout=10)
+        assert jobs.get(path, job_id)["status"] == "done"
+
+    def test_connect_adds_columns_to_old_table(self, tmp_path):
+        import sqlite3
+        path = str(tmp_path / "jobs.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                     "stage TEXT, done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0, "
+                     "result TEXT, error TEXT, created TEXT NOT NULL, updated TEXT NOT NULL)")
+        conn.close()
+        cols = {r[1] for r in jobs.connect(path).execute("PRAGMA table_info(jobs)")}
+        assert {"pid", "heartbeat"} <= cols
+
+
+# ── Routes ────────────────────────────────────────────────────────────────────
+
+class TestJobRoutes:
+    def test_status_of_orphaned_job_is_failed(self, client):
+        conn = jobs.connect(wine_app._jobs_db())
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, created, updated, pid, heartbeat) "
+            "VALUES ('gone', 'import', 'running', ?, ?, ?, '2026-01-01T00:00:00')",
+            (jobs._now(), jobs._now(), os.getpid()),
+        )
+        conn.commit()
+        conn.close()
+        job = client.get("/api/jobs/gone").get_json()["job"]
+        assert (job["status"], job["error"]) == ("failed", "interrupted")
+
+    def test_unknown_job_is_404(self, client):
+        resp = client.get("/api/jobs/nope")
+        assert resp.status_code == 404
+        assert resp.get_json() == {"ok": False, "error": "not_found"}
+
+    def test_export_job_download(self, client, sample_wine):
+        resp = client.post("/api/jobs/export", headers=AJAX)
+        assert resp.status_code == 202
+        job = _wait(resp.get_json()["job_id"])
+        assert job["status"] == "done"
+
+        dl = client.get(f"/api/jobs/{job['id']}/download")
+        assert dl.status_code == 200
+        assert dl.mimetype == "application/zip"
+        assert job["result"]["filename"] in dl.headers["Content-Disposition"]
+        wines = json.loads(zipfile.ZipFile(io.BytesIO(dl.data)).read("wines.json"))
+        assert [w["name"] for w in wines] == ["Château Test"]
+
+    def test_download_requires_finished_export(self, client):
+        job_id = wine_app._jobs.submit(wine_app._jobs_db(), "reanalyze", lambda job: {})
+        _wait(job_id)
+        assert client.get(f"/api/jobs/{job_id}/download").status_code == 404
+
+    def test_background_import_commit(self, client, db, sample_wine, tmp_path, monkeypatch):
+        import_tmp = tmp_path / "import_tmp"
+        import_tmp.mkdir()
+        monkeypatch.setattr(wine_app, "IMPORT_TMP_DIR", str(import_tmp))
+        csv = "name,year,type,quantity\nNeu,2019,Rotwein,2\nZweiter,2020,Weisswein,1\n"
+        preview = client.post(
+            "/import/preview",
+            data={"file": (io.BytesIO(csv.encode()), "w.csv")},
+            content_type="multipart/form-data",
+        ).get_json()
+
+        resp = client.post(
+            "/import/commit",
+            data=json.dumps({"token": preview["token"], "strategy": "skip", "background": True}),
+            content_type="application/json",
+        )
+        assert resp.status_code == 202
+        job = _wait(resp.get_json()["job_id"])
+        assert job["status"] == "done", job["error"]
+        assert job["result"] == {"inserted": 2, "updated": 0, "skipped": 0}
+        assert (job["stage"], job["done"], job["total"]) == ("wines", 2, 2)
+        assert db.execute("SELECT COUNT(*) FROM wines").fetchone()[0] == 3
+        assert os.listdir(import_tmp) == []
+
+        status = client.get(f"/api/jobs/{job['id']}").get_json()
+        assert status["ok"] is True
+        assert status["job"]["status"] == "done"
+
+    def test_readonly_may_start_export_job(self, client, monkeypatch):
+        monkeypatch.setattr(wine_app, "AUTH_ENABLED", True)
+        with client.session_transaction() as s:
+            s["user"] = "viewer"
+            s["role"] = "readonly"
+        resp = client.post("/api/jobs/export", headers=AJAX)
+        assert resp.status_code == 202
+        _wait(resp.get_json()["job_id"])
+        resp = client.post("/api/jobs/reanalyze", json={"wine_ids": [1]}, headers=AJAX)
+        assert resp.status_code == 403
+
+
+class TestReanalyzeJob:
+    AI_OPTS = {"ai_provider": "anthropic", "anthropic_api_key": "sk-test"}
+
+    def test_requires_ai_provider(self, client):
+        resp = client.post("/api/jobs/reanalyze", json={"wine_ids": [1]})
+        assert resp.status_code == 400
+        assert resp.get_json()["error"] == "no_api_key"
+
+    @pytest.mark.parametrize("ids", [None, [], ["1"], [True], list(range(501))])
+    def test_rejects_invalid_ids(self, client, ids):
+        with patch("app.load_options", return_value={**wine_app.HA_OPTIONS, **self.AI_OPTS}):
+            resp = client.post("/api/jobs/reanalyze", json={"wine_ids": ids})
+        assert resp.status_code == 400
+        assert resp.get_json()["error"] == "invalid_wine_ids"
+
+    def test_collects_fields_without_saving(self, client, db, sample_wine):
+        wine_id = sample_wine["wine"]["id"]
+
+        def fake_analyze(opts, image_b64, media_type, wine_context, db=None):
+            return {"grape": "Cabernet Franc", "name": wine_context["name"]}
+
+        with patch("app.load_options", return_value={**wine_app.HA_OPTIONS, **self.AI_OPTS}), \
+                patch("app._analyze_wine_from_context", side_effect=fake_analyze):
+            resp = client.post("/api/jobs/reanalyze", json={"wine_ids": [wine_id, 9999, wine_id]})
+            assert resp.status_code == 202
+            job = _wait(resp.get_json()["job_id"])
+
+        assert job["status"] == "done"
+        assert job["result"] == {
+            "results": {str(wine_id): {"grape": "Cabernet Franc", "name": "Château Test"}},
+            "failed": {"9999": "not_found"},
+        }
+        assert (job["done"], job["total"]) == (2, 2)
+        grape = db.execute("SELECT grape FROM wines WHERE id = ?", (wine_id,)).fetchone()[0]
+        assert grape == "Merlot"
+
+
+class TestEnrichJob:
+    AI_OPTS = {"ai_provider": "anthropic", "anthropic_api_key": "sk-test", "ai_requests_per_minute": 0}
+    ENRICHED = {
+        "maturity_data": {"youth": [2020, 2022], "maturity": [2023, 2026],
+                          "peak": [2027, 2032], "decline": [2033, 2040]},
+        "taste_profile": {"body": 4, "tannin": 4, "acidity": 3, "sweetness": 1},
+        "food_pairings": ["Lamm", "Hartkäse"],
+    }
+
+    def _add(self, client, name, **extra):
+        client.post("/add", data={"name": name, "type": "Rotwein", "quantity": "1", **extra})
+
+    def _opts(self):
+        return patch("app.load_options", return_value={**wine_app.HA_OPTIONS, **self.AI_OPTS})
+
+    def test_fills_only_missing_fields(self, client, db, sample_wine):
+        self._add(client, "Done", maturity_data="{}", taste_profile="{}", food_pairings='["Pasta"]')
+        self._add(client, "Partial", food_pairings='["Pasta"]')
+        self._add(client, "Drunk", quantity="0")
+        self._add(client, "Broken")
+
+        def fake_call(image_b64, media_type, prompt, opts):
+            return "not json" if "Broken" in prompt else json.dumps(self.ENRICHED)
+
+        with self._opts(), patch("app._call_anthropic", side_effect=fake_call), \
+                patch.object(wine_app, "ENRICH_WRITE_BATCH", 1):
+            resp = client.post("/api/jobs/enrich", json={})
+            assert resp.status_code == 202
+            assert resp.get_json()["total"] == 3  # Done and Drunk are skipped
+            job = _wait(resp.get_json()["job_id"])
+
+        assert job["status"] == "done"
+        ids = {r["name"]: r["id"] for r in db.execute("SELECT id, name FROM wines")}
+        assert sorted(job["result"]["updated"]) == sorted([ids["Château Test"], ids["Partial"]])
+        assert list(job["result"]["failed"]) == [str(ids["Broken"])]
+        assert (job["done"], job["total"]) == (3, 3)
+
+        rows = {r["name"]: r for r in db.execute("SELECT * FROM wines")}
+        assert json.loads(rows["Château Test"]["taste_profile"])["body"] == 4
+        assert json.loads(rows["Partial"]["maturity_data"])["peak"] == [2027, 2032]
+        assert json.loads(rows["Partial"]["food_pairings"]) == ["Pasta"]  # kept
+        assert rows["Broken"]["maturity_data"] is None
+
+    def test_nothing_to_do(self, client):
+        self._add(client, "Done", maturity_data="{}", taste_profile="{}", food_pairings="[]")
+        with self._opts():
+            resp = client.post("/api/jobs/enrich", json={})
+        assert resp.status_code == 200
+        assert resp.get_json() == {"ok": True, "job_id": None, "total": 0}
+
+    def test_rejects_invalid_ids(self, client):
+        with self._opts():
+            resp = client.post("/api/jobs/enrich", json={"wine_ids": ["1"]})
+        assert resp.status_code == 400
+
+    def test_requests_run_concurrently(self, client, sample_wine):
+        import threading
+        for i in range(3):
+            self._add(client, f"Wine {i}")
+        barrier = threading.Barrier(wine_app.ENRICH_CONCURRENCY, timeout=5)
+
+        def fake_call(*args):
+            barrier.wait()  # only returns once all pool threads are in a call
+            return json.dumps(self.ENRICHED)
+
+        with self._opts(), patch("app._call_anthropic", side_effect=fake_call):
+            job = _wait(client.post("/api/jobs/enrich", json={}).get_json()["job_id"])
+        assert len(job["result"]["updated"]) == 4
+        assert job["result"]["failed"] == {}
+
+    def test_anthropic_message_batches(self, client, db, sample_wine, monkeypatch):
+        from types import SimpleNamespace as NS
+        from unittest.mock import MagicMock
+        wine_id = sample_wine["wine"]["id"]
+        self._add(client, "Second")
+        second = db.execute("SELECT id FROM wines WHERE name = 'Second'").fetchone()[0]
+
+        counts = NS(succeeded=1, errored=0, canceled=0, expired=0, processing=1)
+        fake = MagicMock()
+        fake.messages.batches.create.return_value = NS(id="b1", processing_status="in_progress",
+                                                       request_counts=counts)
+        fake.messages.batches.retrieve.return_value = NS(id="b1", processing_status="ended",
+                                                         request_counts=counts)
+        fake.messages.batches.results.return_value = [
+            NS(custom_id=str(wine_id), result=NS(type="succeeded", message=NS(
+                content=[NS(text=json.dumps(self.ENRICHED))]))),
+            NS(custom_id=str(second), result=NS(type="errored")),
+        ]
+        monkeypatch.setattr(wine_app, "ENRICH_POLL_SECONDS", 0)
+
+        with self._opts(), patch("app._ai_client", return_value=fake), \
+                patch("app._call_anthropic") as single:
+            resp = client.post("/api/jobs/enrich", json={"batch_api": True})
+            job = _wait(resp.get_json()["job_id"])
+
+        single.assert_not_called()
+        requests_ = fake.messages.batches.create.call_args.kwargs["requests"]
+        assert [r["custom_id"] for r in requests_] == [str(wine_id), str(second)]
+        assert "Château Test" in requests_[0]["params"]["messages"][0]["content"][-1]["text"]
+        assert job["result"]["updated"] == [wine_id]
+        assert job["result"]["failed"] == {str(second): "errored"}
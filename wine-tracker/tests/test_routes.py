@@ -6,6 +6,8 @@ import io
 import json
 import os
 import sys
+from datetime import date
+from urllib.parse import quote
 
 import pytest
 from unittest.mock import patch
@@ -17,6 +19,14 @@ sys.path.insert(0, APP_DIR)
 AJAX = {"X-Requested-With": "XMLHttpRequest"}
 
 
+def _age_upload(path, seconds=2 * 3600):
+    """Make an upload older than the image store's GC grace period."""
+    import app as wine_app
+    wine_app.wait_for_image(os.path.basename(path))
+    old = os.path.getmtime(path) - seconds
+    os.utime(path, (old, old))
+
+
 # ── GET / (index) ─────────────────────────────────────────────────────────────
 
 class TestIndex:
@@ -115,6 +125,249 @@ class TestIndex:
         assert 'view-cards' in html
 
 
+# ── GET /api/wines (lazy loading) ─────────────────────────────────────────────
+
+class TestWineListApi:
+    def _add_many(self, client, n, **extra):
+        for i in range(n):
+            data = {"name": f"Wine {i:03d}", "quantity": "1", "type": "Rotwein"}
+            data.update(extra)
+            client.post("/add", data=data, headers=AJAX)
+
+    def _pages(self, client, qs="", limit=3):
+        """Names of every page, following next_cursor."""
+        names, cursor = [], None
+        while True:
+            url = f"/api/wines?limit={limit}&{qs}"
+            if cursor:
+                url += "&cursor=" + quote(cursor)
+            data = json.loads(client.get(url).data)
+            assert data["ok"] is True
+            names += [w["name"] for w in data["wines"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return names
+
+    def test_index_renders_first_page_only(self, client, monkeypatch):
+        import app as wine_app
+        monkeypatch.setattr(wine_app, "WINE_PAGE_SIZE", 5)
+        self._add_many(client, 8)
+        html = client.get("/").data.decode()
+        assert html.count('class="card ') == 5
+        assert "Wine 004" in html and "Wine 005" not in html
+        assert 'id="wineGridSentinel" style="height:1px">' in html
+        # Badge shows the server counts, not just the rendered page
+        assert '<span id="bottleCountNum">8</span>' in html
+
+    def test_index_hides_empty_bottles_by_default(self, client):
+        client.post("/add", data={"name": "Empty Wine", "quantity": "0"}, headers=AJAX)
+        client.post("/add", data={"name": "Full Wine", "quantity": "5"}, headers=AJAX)
+        html = client.get("/").data.decode()
+        assert "Full Wine" in html and "Empty Wine" not in html
+        assert "Empty Wine" in client.get("/?show_empty=1").data.decode()
+
+    def test_no_sentinel_when_everything_fits(self, client, sample_wine):
+        html = client.get("/").data.decode()
+        assert 'id="wineGridSentinel" style="height:1px" hidden>' in html
+
+    def test_pages_cover_list_in_order(self, client):
+        self._add_many(client, 7)
+        assert self._pages(client) == [f"Wine {i:03d}" for i in range(7)]
+
+    def test_null_sort_keys_are_paged(self, client, db):
+        db.executemany("INSERT INTO wines (name, type, year) VALUES (?, ?, ?)",
+                       [("B", None, None), ("A", None, 2019), ("C", "Rotwein", None),
+                        ("A", "Rotwein", 2020), ("A", "", None)])
+        db.commit()
+        # NULL and empty type sort together, a missing year before any year
+        assert self._pages(client, limit=2) == ["A", "A", "B", "A", "C"]
+
+    def test_delete_does_not_skip_rows(self, client, db):
+        """Rows before the cursor vanishing does not shift the next page."""
+        self._add_many(client, 6)
+        first = json.loads(client.get("/api/wines?limit=3").data)
+        db.execute("DELETE FROM wines WHERE name IN ('Wine 000', 'Wine 001')")
+        db.commit()
+        rest = json.loads(client.get(
+            "/api/wines?limit=3&cursor=" + quote(first["next_cursor"])).data)
+        assert [w["name"] for w in rest["wines"]] == ["Wine 003", "Wine 004", "Wine 005"]
+
+    def test_table_sort(self, client):
+        for name, price in (("A", "30"), ("B", ""), ("C", "10"), ("D", "20")):
+            client.post("/add", data={"name": name, "price": price, "quantity": "1"}, headers=AJAX)
+        assert self._pages(client, "sort=price") == ["B", "C", "D", "A"]
+        assert self._pages(client, "sort=price&desc=1") == ["A", "D", "C", "B"]
+
+    def test_invalid_sort(self, client):
+        assert client.get("/api/wines?sort=notes").status_code == 400
+
+    def test_list_columns_only(self, client, sample_wine):
+        data = json.loads(client.get("/api/wines").data)
+        wine = data["wines"][0]
+        assert wine["name"] == "Château Test"
+        assert "maturity_data" not in wine
+        assert "food_pairings" not in wine
+        assert "_k0" not in wine
+
+    def test_filters_applied(self, client):
+        client.post("/add", data={"name": "Red", "type": "Rotwein", "quantity": "1"}, headers=AJAX)
+        client.post("/add", data={"name": "White", "type": "Weisswein", "quantity": "1"}, headers=AJAX)
+        client.post("/add", data={"name": "Gone", "type": "Rotwein", "quantity": "0"}, headers=AJAX)
+        names = lambda qs: [w["name"] for w in json.loads(client.get("/api/wines?" + qs).data)["wines"]]
+        assert names("type=Rotwein") == ["Gone", "Red"]
+        assert names("type=Rotwein&show_empty=0") == ["Red"]
+        assert names("q=whi") == ["White"]
+        assert self._pages(client, "type=Rotwein", limit=1) == ["Gone", "Red"]
+
+    def test_drink_window_filter(self, client):
+        year = date.today().year
+        for name, start, end in (("Now", year - 1, year + 2), ("Last", "", year),
+                                 ("Past", "", year - 1), ("Later", year + 1, year + 5),
+                                 ("Unknown", "", "")):
+            client.post("/add", data={"name": name, "drink_from": start, "drink_until": end,
+                                      "quantity": "1"}, headers=AJAX)
+        names = lambda dw: [w["name"] for w in json.loads(client.get("/api/wines?dw=" + dw).data)["wines"]]
+        assert names("in") == ["Last", "Now"]
+        assert names("last") == ["Last"]
+        assert names("past") == ["Past"]
+
+    def test_counts(self, client):
+        year = date.today().year
+        client.post("/add", data={"name": "Red", "type": "Rotwein", "quantity": "2",
+                                  "drink_until": year}, headers=AJAX)
+        client.post("/add", data={"name": "Red 2", "type": "Rotwein", "quantity": "3"}, headers=AJAX)
+        client.post("/add", data={"name": "White", "type": "Weisswein", "quantity": "1"}, headers=AJAX)
+        client.post("/add", data={"name": "Gone", "type": "Rotwein", "quantity": "0"}, headers=AJAX)
+
+        counts = json.loads(client.get("/api/wines/counts?type=Rotwein&show_empty=0").data)["counts"]
+        assert (counts["bottles"], counts["wines"], counts["cellar"]) == (5, 2, 4)
+        # Type counts ignore the type filter, drink-window counts ignore that one
+        assert counts["types"] == {"Rotwein": 2, "Weisswein": 1}
+        assert counts["drink_window"] == {"": 2, "in": 1, "last": 1, "past": 0}
+        assert counts["has_drink_window"] is True
+
+        counts = json.loads(client.get("/api/wines/counts?dw=last").data)["counts"]
+        assert counts["types"] == {"Rotwein": 1}
+        assert counts["wines"] == 1
+
+    @pytest.mark.parametrize("cursor", ["abc", "[1, 2]", '["a", "b", 1, "x"]', "[null, 1, 2, 3]"])
+    def test_invalid_paging(self, client, cursor):
+        resp = client.get("/api/wines?cursor=" + quote(cursor))
+        assert resp.status_code == 400
+
+    def test_limit_is_capped(self, client, monkeypatch):
+        import app as wine_app
+        monkeypatch.setattr(wine_app, "WINE_PAGE_MAX", 2)
+        self._add_many(client, 4)
+        data = json.loads(client.get("/api/wines?limit=1000").data)
+        assert len(data["wines"]) == 2
+        assert data["next_cursor"] is not None
+
+
+# ── Full-text search ──────────────────────────────────────────────────────────
+
+class TestSearch:
+    def _add(self, client, **data):
+        data.setdefault("quantity", "1")
+        resp = client.post("/add", data=data, headers=AJAX)
+        return json.loads(resp.data)["wine"]["id"]
+
+    def _search(self, client, q, **params):
+        qs = "&".join(f"{k}={v}" for k, v in params.items())
+        return json.loads(client.get(f"/api/search?q={q}&{qs}").data)
+
+    def test_accent_insensitive(self, client):
+        wid = self._add(client, name="Crozes-Hermitage", region="Côtes du Rhône")
+        assert self._search(client, "rhone")["ids"] == [wid]
+
+    def test_prefix_match(self, client):
+        wid = self._add(client, name="Château Margaux")
+        assert self._search(client, "chat")["ids"] == [wid]
+
+    def test_all_words_must_match(self, client):
+        a = self._add(client, name="Barolo", region="Piemonte")
+        self._add(client, name="Barolo", region="Langhe")
+        assert self._search(client, "barolo piem")["ids"] == [a]
+
+    def test_searches_grape_location_and_food(self, client):
+        wid = self._add(client, name="Plain", grape="Nebbiolo", location="Regal 7",
+                        food_pairings='["Trüffelrisotto", "Wild"]')
+        assert self._search(client, "nebbiolo")["ids"] == [wid]
+        assert self._search(client, "regal")["ids"] == [wid]
+        assert self._search(client, "truffel")["ids"] == [wid]
+
+    def test_name_match_ranked_first(self, client):
+        in_notes = self._add(client, name="Some Red", notes="Reminds me of a Merlot")
+        in_name = self._add(client, name="Merlot del Ticino")
+        assert self._search(client, "merlot")["ids"] == [in_name, in_notes]
+
+    def test_limit_applies_to_rows_not_ids(self, client):
+        for i in range(3):
+            self._add(client, name=f"Syrah {i}")
+        data = self._search(client, "syrah", limit=1)
+        assert len(data["ids"]) == 3
+        assert len(data["wines"]) == 1
+        assert "maturity_data" not in data["wines"][0]
+
+    def test_operators_in_input_are_harmless(self, client):
+        self._add(client, name="Pinot")
+        data = self._search(client, 'pinot" OR NEAR(')
+        assert data["ok"] is True
+
+    def test_index_follows_edit_and_delete(self, client):
+        wid = self._add(client, name="Old Name")
+        client.post(f"/edit/{wid}", data={"name": "Fresh Name", "quantity": "1"}, headers=AJAX)
+        assert self._search(client, "old")["ids"] == []
+        assert self._search(client, "fresh")["ids"] == [wid]
+        client.post(f"/delete/{wid}", headers=AJAX)
+        assert self._search(client, "fresh")["ids"] == []
+
+    def test_index_page_uses_search(self, client):
+        self._add(client, name="Hermitage", region="Rhône")
+        self._add(client, name="Rioja", region="Spanien")
+        html = client.get("/?q=rhone").data.decode()
+        assert "Hermitage" in html
+        assert "Rioja" not in html
+
+    def test_cellar_list_is_ranked_and_paged(self, client):
+        in_notes = self._add(client, name="Aaa Red", notes="Reminds me of a Merlot")
+        in_name = self._add(client, name="Merlot del Ticino")
+        self._add(client, name="Zinfandel")
+        ids = lambda data: [w["id"] for w in data["wines"]]
+        first = json.loads(client.get("/api/wines?q=merlot&limit=1").data)
+        assert ids(first) == [in_name]
+        rest = json.loads(client.get(
+            "/api/wines?q=merlot&limit=1&cursor=" + quote(first["next_cursor"])).data)
+        assert ids(rest) == [in_notes]
+        assert rest["next_cursor"] is None
+        # A table sort overrides the ranking
+        data = json.loads(client.get("/api/wines?q=merlot&sort=name").data)
+        assert ids(data) == [in_notes, in_name]
+
+    def test_index_page_is_ranked(self, client):
+        self._add(client, name="Aaa Red", notes="Reminds me of a Merlot")
+        self._add(client, name="Merlot del Ticino")
+        html = client.get("/?q=merlot").data.decode()
+        assert html.index("Merlot del Ticino") < html.index("Aaa Red")
+
+    def test_like_fallback_without_fts(self, client, db):
+        self._add(client, name="Sancerre", location="Keller")
+        db.execute("DROP TABLE wines_fts")
+        db.commit()
+        data = self._search(client, "kell")
+        assert len(data["ids"]) == 1
+        assert "Sancerre" in client.get("/?q=Sanc").data.decode()
+
+    def test_rebuild_command(self, app, client, db):
+        wid = self._add(client, name="Gewürztraminer")
+        db.execute("INSERT INTO wines_fts (wines_fts) VALUES ('delete-all')")
+        db.commit()
+        assert self._search(client, "gewurz")["ids"] == []
+        result = app.test_cli_runner().invoke(args=["rebuild-search"])
+        assert "rebuilt" in result.output
+        assert self._search(client, "gewurz")["ids"] == [wid]
+
+
 # ── POST /add ─────────────────────────────────────────────────────────────────
 
 class TestAddWine:
@@ -363,6 +616,7 @@ class TestEditWine:
         assert wine["image"] is not None
         img_path = os.path.join(upload_dir, wine["image"])
         assert os.path.isfile(img_path)
+        _age_upload(img_path)
 
         # Now edit with delete_image
         resp = client.post(
@@ -443,11 +697,42 @@ class TestDeleteWine:
         wine = json.loads(resp.data)["wine"]
         img_path = os.path.join(upload_dir, wine["image"])
         assert os.path.isfile(img_path)
+        _age_upload(img_path)
 
         client.post(f"/delete/{wine['id']}", headers=AJAX)
         assert not os.path.isfile(img_path)
 
 
+# ── Datalist cache ────────────────────────────────────────────────────────────
+
+class TestDatalistCache:
+    def test_cached_between_renders(self, app, sample_wine):
+        import app as wine_app
+        with app.app_context():
+            db = wine_app.get_db()
+            first = wine_app._datalists(db)
+            assert wine_app._datalists(db) is first
+        assert first["used_locations"] == ["Keller A"]
+
+    def test_edit_invalidates(self, client, sample_wine):
+        wine_id = sample_wine["wine"]["id"]
+        client.get("/")
+        client.post(f"/edit/{wine_id}", data={
+            "name": "Château Test", "location": "Keller B", "quantity": "3",
+        }, headers=AJAX)
+        html = client.get("/").data.decode()
+        assert 'value="Keller B"' in html
+        assert 'value="Keller A"' not in html
+
+    def test_write_from_other_connection_invalidates(self, client, sample_wine, db):
+        """Another worker process writing to the DB must invalidate the cache."""
+        client.get("/")
+        db.execute("UPDATE wines SET grape = 'Nebbiolo'")
+        db.commit()
+        html = client.get("/").data.decode()
+        assert 'value="Nebbiolo"' in html
+
+
 # ── GET /stats ────────────────────────────────────────────────────────────────
 
 class TestStatsPage:
@@ -555,6 +840,65 @@ class TestStatsPage:
         # Final stock should be 6
         assert 'data-stock="6"' in html
 
+    def test_stats_drink_window_names_not_embedded(self, client):
+        """Per-year wine names are fetched on hover, not rendered into the page."""
+        client.post("/add", data={"name": "Langlebig", "type": "Rotwein", "quantity": "2",
+                                  "drink_from": "2020", "drink_until": "2999"}, headers=AJAX)
+        html = client.get("/stats").data.decode()
+        assert 'data-year="2999"' in html
+        assert "byDW: {}" in html
+
+    def test_drink_window_year_api(self, client):
+        client.post("/add", data={"name": "Barolo", "type": "Rotwein", "quantity": "2",
+                                  "drink_from": "2025", "drink_until": "2035"}, headers=AJAX)
+        client.post("/add", data={"name": "Riesling", "type": "Weisswein", "quantity": "1",
+                                  "drink_until": "2026"}, headers=AJAX)
+        client.post("/add", data={"name": "Leer", "type": "Rotwein", "quantity": "0",
+                                  "drink_from": "2025", "drink_until": "2030"}, headers=AJAX)
+        data = json.loads(client.get("/api/stats/drink-window/2026").data)
+        assert data["ok"] is True
+        assert [w["n"] for w in data["wines"]["Rotwein"]] == ["Barolo"]
+        assert data["wines"]["Weisswein"][0]["q"] == 1
+        data = json.loads(client.get("/api/stats/drink-window/2030").data)
+        assert list(data["wines"]) == ["Rotwein"]
+        assert json.loads(client.get("/api/stats/drink-window/2040").data)["wines"] == {}
+
+    def test_stats_snapshot_reused_until_write(self, client, monkeypatch):
+        """The stats context is rebuilt only after the cellar changed."""
+        import app as wine_app
+        calls = []
+        real = wine_app._stats_context
+        monkeypatch.setattr(wine_app, "_stats_context", lambda db: calls.append(1) or real(db))
+        client.post("/add", data={"name": "Wine A", "quantity": "5"}, headers=AJAX)
+        client.get("/stats")
+        client.get("/stats")
+        assert len(calls) == 1
+        client.post("/add", data={"name": "Wine B", "quantity": "3"}, headers=AJAX)
+        assert 'data-stock="8"' in client.get("/stats").data.decode()
+        assert len(calls) == 2
+
+    def test_stats_snapshot_invalidated_by_timeline(self, client, db, monkeypatch):
+        """Writes to the timeline alone (stock chart) also refresh the page."""
+        import app as wine_app
+        calls = []
+        real = wine_app._stats_context
+        monkeypatch.setattr(wine_app, "_stats_context", lambda db: calls.append(1) or real(db))
+        client.get("/stats")
+        db.execute("INSERT INTO timeline (wine_id, action, quantity, timestamp) VALUES (1, 'added', 1, '2024-01-01')")
+        db.commit()
+        client.get("/stats")
+        assert len(calls) == 2
+
+    def test_check_stats_command(self, app, client, db):
+        client.post("/add", data={"name": "Wine A", "type": "Rotwein", "quantity": "5"}, headers=AJAX)
+        runner = app.test_cli_runner()
+        assert "consistent" in runner.invoke(args=["check-stats"]).output
+        db.execute("UPDATE cellar_stats SET bottles = 1")
+        db.commit()
+        result = runner.invoke(args=["check-stats", "--rebuild"])
+        assert "bottles is 1, expected 5" in result.output
+        assert "consistent" in runner.invoke(args=["check-stats"]).output
+
 
 # ── GET /api/wine/<id> ────────────────────────────────────────────────────────
 
@@ -628,6 +972,21 @@ class TestApiSummary:
         assert data["total_bottles"] == 5
         assert len(data["by_type"]) == 2
 
+    def test_counts_follow_edits_and_deletes(self, client):
+        resp = client.post("/add", data={"name": "Red", "type": "Rotwein", "quantity": "2"}, headers=AJAX)
+        wine_id = json.loads(resp.data)["wine"]["id"]
+        client.post("/add", data={"name": "Empty", "type": "Rotwein", "quantity": "0"}, headers=AJAX)
+        client.post(f"/edit/{wine_id}", data={"name": "Red", "type": "Weisswein", "quantity": "4"}, headers=AJAX)
+        data = json.loads(client.get("/api/summary").data)
+        assert data["total_bottles"] == 4
+        assert {r["type"]: (r["cnt"], r["total"]) for r in data["by_type"]} == {
+            "Rotwein": (1, 0), "Weisswein": (1, 4),
+        }
+        client.post(f"/delete/{wine_id}", headers=AJAX)
+        data = json.loads(client.get("/api/summary").data)
+        assert data["total_bottles"] == 0
+        assert [r["type"] for r in data["by_type"]] == ["Rotwein"]
+
 
 # ── GET /timeline ─────────────────────────────────────────────────────────────
 
@@ -638,6 +997,158 @@ class TestTimelinePage:
         assert b"timeline" in resp.data.lower() or b"Zeitverlauf" in resp.data
 
 
+class TestTimelineApi:
+    @staticmethod
+    def _log(db, rows):
+        db.executemany(
+            "INSERT INTO timeline (wine_id, action, quantity, timestamp) VALUES (?,?,?,?)", rows
+        )
+        db.commit()
+
+    def test_groups_by_wine_action_and_day(self, client, db):
+        db.execute("INSERT INTO wines (id, name, quantity) VALUES (1, 'Barolo', 5)")
+        self._log(db, [
+            (1, "consumed", 1, "2024-03-01T10:00:00"),
+            (1, "consumed", 2, "2024-03-01T20:00:00"),
+            (1, "consumed", 1, "2024-03-02T09:00:00"),
+            (1, "restocked", 3, "2024-03-01T12:00:00"),
+        ])
+        entries = json.loads(client.get("/api/timeline").data)["entries"]
+        assert [(e["action"], e["quantity"], e["timestamp"]) for e in entries] == [
+            ("consumed", 1, "2024-03-02T09:00:00"),
+            ("consumed", 3, "2024-03-01T20:00:00"),
+            ("restocked", 3, "2024-03-01T12:00:00"),
+        ]
+        assert entries[1]["id"] == 2  # newest row of the group
+        assert entries[1]["wine_name"] == "Barolo"
+
+    def test_chat_entries_resolve_session_titles(self, client, db):
+        db.executemany(
+            "INSERT INTO chat_sessions (id, title, created, updated) VALUES (?,?,?,?)",
+            [(1, "Pairing", "2024-01-01T10:00:00", "2024-01-01T10:00:00"),
+             (2, "Barolo?", "2024-02-01T10:00:00", "2024-02-01T10:00:00")],
+        )
+        self._log(db, [
+            (0, "chat", 1, "2024-01-01T10:00:01"),
+            (0, "chat", 1, "2024-01-01T11:00:00"),
+            (0, "chat", 1, "2024-02-01T10:00:01"),
+            (0, "chat", 1, "2023-12-31T10:00:00"),
+        ])
+        import app as wine_app
+        entries = json.loads(client.get("/api/timeline").data)["entries"]
+        fallback = wine_app.T.get("log_chat", "Sommelier chat")
+        assert [(e["wine_name"], e.get("session_id")) for e in entries] == [
+            ("Barolo?", 2), ("Pairing", 1), ("Pairing", 1), (fallback, None),
+        ]
+
+    def test_cursor_pagination(self, client, db):
+        db.execute("INSERT INTO wines (id, name, quantity) VALUES (1, 'A', 5), (2, 'B', 5)")
+        rows = []
+        for day in range(1, 11):
+            rows.append((1, "consumed", 1, f"2024-05-{day:02d}T08:00:00"))
+            rows.append((2, "consumed", 1, f"2024-05-{day:02d}T08:00:00"))
+            rows.append((1, "consumed", 1, f"2024-05-{day:02d}T09:00:00"))
+        self._log(db, rows)
+        full = json.loads(client.get("/api/timeline?limit=500").data)
+        assert full["next_cursor"] is None
+        assert full["summary"]["total"] == len(full["entries"]) == 20
+
+        seen, cursor = [], None
+        while True:
+            url = "/api/timeline?limit=3" + (f"&cursor={cursor}" if cursor else "")
+            page = json.loads(client.get(url).data)
+            assert ("summary" in page) == (cursor is None)
+            seen += page["entries"]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert seen == full["entries"]
+
+    def test_invalid_cursor(self, client):
+        assert client.get("/api/timeline?cursor=garbage").status_code == 400
+        assert client.get("/api/timeline?limit=x").status_code == 400
+
+    def test_summary_counts_current_month(self, client, db):
+        from datetime import datetime
+        now = datetime.now().isoformat()
+        self._log(db, [
+            (1, "consumed", 2, now), (2, "consumed", 1, now), (1, "added", 6, now),
+            (1, "consumed", 5, "2001-01-01T10:00:00"),
+        ])
+        summary = json.loads(client.get("/api/timeline").data)["summary"]
+        assert summary["consumed_month"] == 3
+        assert summary["added_month"] == 6
+        assert summary["restocked_month"] == 0
+        assert summary["total"] == 4
+
+
+# ── HTTP caching ──────────────────────────────────────────────────────────────
+
+class TestHttpCaching:
+    def _revalidate(self, client, url):
+        first = client.get(url)
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+        assert first.headers["Cache-Control"] == "no-cache"
+        again = client.get(url, headers={"If-None-Match": etag})
+        return etag, again
+
+    def test_static_urls_carry_content_hash(self, client):
+        import re
+        html = client.get("/").data.decode()
+        url = re.search(r'href="(/static/style\.css\?v=[0-9a-f]{12})"', html).group(1)
+        assert "/static/theme.js?v=" in html
+        resp = client.get(url)
+        assert resp.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+        assert "immutable" not in client.get("/static/style.css").headers.get("Cache-Control", "")
+
+    def test_uploads_are_immutable(self, client, upload_dir):
+        with open(os.path.join(upload_dir, "abc.png"), "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+        resp = client.get("/uploads/abc.png")
+        assert resp.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+        assert "immutable" not in client.get("/uploads/missing.png").headers.get("Cache-Control", "")
+
+    def test_summary_not_modified_until_cellar_changes(self, client, sample_wine):
+        etag, resp = self._revalidate(client, "/api/summary")
+        assert resp.status_code == 304
+        assert resp.data == b""
+        assert resp.headers["ETag"] == etag
+
+        client.post("/add", data={"name": "Neu", "quantity": "1"}, headers=AJAX)
+        resp = client.get("/api/summary", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+        assert json.loads(resp.data)["total_bottles"] == 4
+
+    def test_wine_etag_follows_edits(self, client, sample_wine):
+        wine_id = sample_wine["wine"]["id"]
+        etag, resp = self._revalidate(client, f"/api/wine/{wine_id}")
+        assert resp.status_code == 304
+        client.post(f"/edit/{wine_id}", data={"name": "Umbenannt", "quantity": "3"}, headers=AJAX)
+        resp = client.get(f"/api/wine/{wine_id}", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert json.loads(resp.data)["wine"]["name"] == "Umbenannt"
+
+    def test_timeline_etag_follows_timeline_and_chat_sessions(self, client, db, sample_wine):
+        etag, resp = self._revalidate(client, "/api/timeline")
+        assert resp.status_code == 304
+        # Another page of the same timeline has its own ETag
+        assert client.get("/api/timeline?limit=1").headers["ETag"] != etag
+
+        db.execute("INSERT INTO chat_sessions (title, created, updated) VALUES ('x', '2020', '2020')")
+        db.commit()
+        resp = client.get("/api/timeline", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        etag = resp.headers["ETag"]
+
+        wine_id = sample_wine["wine"]["id"]
+        client.post(f"/edit/{wine_id}", data={"name": "Château Test", "quantity": "1"}, headers=AJAX)
+        resp = client.get("/api/timeline", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert json.loads(resp.data)["entries"][0]["action"] == "consumed"
+
+
 # ── Wine log integration ─────────────────────────────────────────────────────
 
 class TestWineLog:
@@ -998,6 +1509,32 @@ class TestAuth:
             )
             assert resp.status_code == 200
 
+    def test_readonly_can_stream_chat(self):
+        """Readonly users can use the streaming chat endpoint the chat panel posts to."""
+        client = self._make_auth_app(extra_users={
+            "viewer": {"hash": generate_password_hash("pass", method="pbkdf2:sha256"), "role": "readonly"},
+        })
+        client.post("/login", data={"username": "viewer", "password": "pass"})
+        with patch("app.load_options") as mock_opts, patch("app._stream_chat") as mock_stream:
+            mock_opts.return_value = {
+                "currency": "CHF", "language": "en",
+                "ai_provider": "anthropic", "anthropic_api_key": "sk-test",
+                "anthropic_model": "claude-sonnet-4-20250514",
+                "openai_api_key": "", "openrouter_api_key": "",
+                "ollama_host": "", "ollama_model": "",
+            }
+            mock_stream.return_value = iter(["Nice ", "wine!"])
+            resp = client.post(
+                "/api/chat/stream",
+                data=json.dumps({"message": "hi", "history": []}),
+                content_type="application/json",
+                headers=AJAX,
+            )
+            assert resp.status_code == 200
+            body = resp.get_data(as_text=True)
+            assert "event: done" in body
+            assert '"response": "Nice wine!"' in body
+
     def test_readonly_hides_fab(self):
         """Readonly users should not see the FAB (add wine) button."""
         client = self._make_auth_app(extra_users={